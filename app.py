@@ -1,26 +1,93 @@
-from flask import Flask, request, jsonify, send_from_directory
-import requests
+from flask import Flask, Response, request, jsonify, send_from_directory
+import json
 import os
-from datetime import datetime
+import time
 from dotenv import load_dotenv
 from openai import OpenAI
 
+# Before the project imports, they read their settings from the environment
 load_dotenv()
 
+import broadcast
+import conversation_store
+from burst_coalescer import BurstCoalescer
+from circuit_breaker import AI_DEADLINE_SECONDS, AI_TIMEOUT_SECONDS
+import tata_client
+from contact_lanes import LaneScheduler
+from faq_matcher import get_matcher
+from intent_router import get_router, opt_change, route_intent
+from message_dedup import DedupIndex, message_key
+from openai_scheduler import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, OpenAIScheduler, SchedulerBusy
+from outbox import RecipientOptedOut
+# Prompt, reply cache, context, breaker, governor and outbox are shared with async_app.py
+from replies import (ai_breaker, answer_intent, context_builder, failed_reply, finish_reply, model_router, outbox,
+                     prepare_reply, reply_cache, reply_key, send_error_reply, send_fallback, send_governor,
+                     send_template_message)
+from send_governor import PRIORITY_BROADCAST
+from webhook_log import WebhookLog
+from webhook_parser import parse_events, parse_statuses
+
 app = Flask(__name__)
 
 # Configuration
 WHATSAPP_TOKEN = os.getenv('WHATSAPP_TOKEN')
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 
+# Webhook mode: 'queue' acknowledges immediately and replies from the worker lanes after
+# collecting a contact's burst of messages, 'inline' runs the AI call and send inside the request
+WEBHOOK_MODE = os.getenv('WEBHOOK_MODE', 'queue')
+AI_WORKERS = int(os.getenv('AI_WORKERS', 4))  # parallel lanes, each contact always uses the same one
+AI_QUEUE_SIZE = int(os.getenv('AI_QUEUE_SIZE', 1000))
+# Messages that already waited this many seconds in an AI lane queue for OpenAI budget behind fresh ones
+AI_BACKLOG_SECONDS = float(os.getenv('AI_BACKLOG_SECONDS', 20))
+WEBHOOK_LOG_SIZE = int(os.getenv('WEBHOOK_LOG_SIZE', 500))
+TATA_CHATS_PAGE_SIZE = int(os.getenv('TATA_CHATS_PAGE_SIZE', 100))
+WEBHOOK_LOG_SEGMENT = int(os.getenv('WEBHOOK_LOG_SEGMENT', 100))
+WEBHOOK_ARCHIVE_DIR = os.getenv('WEBHOOK_ARCHIVE_DIR', 'webhook_archive')
+# Delivery rate and receipt latency cover messages sent within this many hours
+DELIVERY_STATS_HOURS = float(os.getenv('DELIVERY_STATS_HOURS', 24))
+
 # OpenAI client
 client = OpenAI(api_key=OPENAI_API_KEY)
+# Completions wait for RPM/TPM budget instead of hitting 429s (OPENAI_RPM, OPENAI_TPM)
+ai_scheduler = OpenAIScheduler(client)
+
+webhook_dedup = DedupIndex()
+
+# Background workers for AI replies, messages from one contact are answered in order
+ai_workers = LaneScheduler(lanes=AI_WORKERS, max_queue=AI_QUEUE_SIZE, name='ai-lane')
+
+def queue_reply(phone, texts, dedup_keys=()):
+    """Answer a burst of messages from one contact with a single AI reply"""
+    message_text = '\n'.join(texts)
+    key = reply_key(dedup_keys)
+    if not ai_workers.submit(phone, process_message, phone, message_text, key, time.monotonic()):
+        # The webhook was already acknowledged, so the burst still gets an answer
+        intent = route_intent(message_text)
+        if intent is not None:
+            answer_intent(phone, intent, key)
+        else:
+            print(f"AI queue full, fallback reply for {len(texts)} message(s) from {phone}")
+            send_fallback(phone, message_text, 'queue full', key)
 
-# Enhanced storage for comprehensive chat tracking
-chats_db = {}
-messages_db = {}
-all_webhook_data = []  # Store all webhook data for analysis
-all_contacts = {}  # Store all contacts that have ever messaged
+# "hi" / "I need help" / "with my order" sent within seconds become one AI call and one reply
+burst_coalescer = BurstCoalescer(queue_reply)
+
+# Campaign sends, paced to BROADCAST_RATE messages per second
+def send_broadcast_template(phone, template):
+    # SendThrottled is left to the broadcast, which retries the recipient instead of counting a failure
+    send_governor.acquire(phone, PRIORITY_BROADCAST)
+    return send_template_message(phone, template['name'], template['language'], template['components'], fallback=False,
+                                 priority=PRIORITY_BROADCAST, pace=False)
+
+def record_broadcast(phone, template, provider_id=None):
+    conversation_store.add_message(phone, f"Template {template['name']} sent", 'sent', 'template',
+                                   provider_id=provider_id)
+
+broadcasts = broadcast.BroadcastManager(send_broadcast_template, on_sent=record_broadcast,
+                                        opted_out=conversation_store.is_opted_out)
+# Recent webhook payloads for debugging, older ones are archived to disk
+webhook_log = WebhookLog(capacity=WEBHOOK_LOG_SIZE, segment_size=WEBHOOK_LOG_SEGMENT, archive_dir=WEBHOOK_ARCHIVE_DIR)
 
 @app.route('/')
 def dashboard():
@@ -32,54 +99,49 @@ def tata_chats_page():
 
 @app.route('/api/tata-chats', methods=['GET'])
 def get_tata_chats():
-    """Get ALL contacts and chats from webhook data"""
+    """Get contacts and chats from webhook data, a page at a time"""
     try:
-        all_chats = []
-        
-        # Add all contacts that have ever interacted
-        for phone, contact_info in all_contacts.items():
-            messages = messages_db.get(phone, [])
-            last_message = messages[-1] if messages else {'text': 'No recent messages', 'timestamp': contact_info.get('last_seen', '')}
-            
-            all_chats.append({
-                'phone': phone,
-                'name': contact_info.get('name', 'Unknown'),
-                'lastMessage': last_message.get('text', 'No recent messages'),
-                'timestamp': contact_info.get('last_seen', ''),
-                'status': 'Active' if messages else 'Contact only',
-                'messageCount': len(messages),
-                'totalInteractions': contact_info.get('total_interactions', 0),
-                'source': 'Webhook captured',
-                'lastMessageType': last_message.get('type', 'unknown')
-            })
+        limit = min(request.args.get('limit', TATA_CHATS_PAGE_SIZE, type=int), 1000)
+        offset = max(request.args.get('offset', 0, type=int), 0)
+        sorted_chats = []
         
-        # Also add chats that might not be in contacts
-        for phone, chat_data in chats_db.items():
-            if phone not in all_contacts:
-                messages = messages_db.get(phone, [])
-                last_message = messages[-1] if messages else {'text': 'No messages', 'timestamp': ''}
-                
-                all_chats.append({
-                    'phone': phone,
+        # Contacts come back from the index already ordered by last activity
+        for contact in conversation_store.list_contacts(limit, offset):
+            if contact['last_seen']:
+                sorted_chats.append({
+                    'phone': contact['phone'],
+                    'name': contact['name'] or 'Unknown',
+                    'lastMessage': contact['last_text'] or 'No recent messages',
+                    'timestamp': contact['last_seen'],
+                    'status': 'Active' if contact['message_count'] else 'Contact only',
+                    'messageCount': contact['message_count'],
+                    'totalInteractions': contact['total_interactions'],
+                    'source': 'Webhook captured',
+                    'lastMessageType': contact['last_type'] or 'unknown'
+                })
+            else:
+                # Chats that might not be in contacts
+                sorted_chats.append({
+                    'phone': contact['phone'],
                     'name': 'Unknown',
-                    'lastMessage': last_message.get('text', 'No messages'),
-                    'timestamp': chat_data.get('timestamp', ''),
+                    'lastMessage': contact['last_text'] or 'No messages',
+                    'timestamp': contact['chat_timestamp'] or '',
                     'status': 'Chat only',
-                    'messageCount': len(messages),
+                    'messageCount': contact['message_count'],
                     'totalInteractions': 1,
                     'source': 'Chat data',
-                    'lastMessageType': last_message.get('type', 'unknown')
+                    'lastMessageType': contact['last_type'] or 'unknown'
                 })
         
-        # Remove duplicates and sort by timestamp
-        unique_chats = {chat['phone']: chat for chat in all_chats}
-        sorted_chats = sorted(unique_chats.values(), key=lambda x: x.get('timestamp', ''), reverse=True)
-        
+        total = conversation_store.count_contacts()
         return jsonify({
             'success': True,
             'chats': sorted_chats,
-            'total': len(sorted_chats),
-            'totalWebhooks': len(all_webhook_data),
+            'total': total,
+            'offset': offset,
+            'limit': limit,
+            'hasMore': offset + len(sorted_chats) < total,
+            'totalWebhooks': webhook_log.total,
             'note': 'All contacts captured from webhook data - this includes everyone who has ever messaged your WhatsApp number'
         })
         
@@ -92,10 +154,73 @@ def get_webhook_data():
     """Get raw webhook data for debugging"""
     return jsonify({
         'success': True,
-        'webhooks': all_webhook_data[-50:],  # Last 50 webhooks
-        'total': len(all_webhook_data)
+        'webhooks': webhook_log.recent(50),  # Last 50 webhooks
+        'total': webhook_log.total,
+        'archivedSegments': webhook_log.archived_segments()
+    })
+
+@app.route('/api/webhook-data/archive/<name>', methods=['GET'])
+def get_archived_webhook_data(name):
+    """Read back one archived segment of webhook payloads"""
+    webhooks = webhook_log.read_segment(name)
+    if webhooks is None:
+        return jsonify({'success': False, 'error': 'Segment not found'}), 404
+    return jsonify({'success': True, 'webhooks': webhooks, 'total': len(webhooks)})
+
+@app.route('/api/worker-stats', methods=['GET'])
+def get_worker_stats():
+    """Queue depth and job latency of the AI reply workers"""
+    return jsonify({'success': True, 'mode': WEBHOOK_MODE, 'workers': ai_workers.stats()})
+
+@app.route('/api/http-stats', methods=['GET'])
+def get_http_stats():
+    """Connection pool settings and per-endpoint latency of Tata API calls"""
+    return jsonify({'success': True, 'tata': tata_client.stats()})
+
+@app.route('/api/delivery-stats', methods=['GET'])
+def get_delivery_stats():
+    """Delivered, read and failed counts and receipt latency from status webhooks"""
+    hours = request.args.get('hours', DELIVERY_STATS_HOURS, type=float)
+    return jsonify({'success': True, 'delivery': conversation_store.delivery_stats(hours)})
+
+@app.route('/api/send-stats', methods=['GET'])
+def get_send_stats():
+    """Outbound budget per business number and how long sends waited for it"""
+    return jsonify({'success': True, 'governor': send_governor.stats()})
+
+@app.route('/api/ai-stats', methods=['GET'])
+def get_ai_stats():
+    """Counters of the AI reply path"""
+    faq = get_matcher()
+    return jsonify({
+        'success': True,
+        'intents': get_router().stats(),
+        'faq': faq.stats() if faq else None,
+        'replyCache': reply_cache.stats(),
+        'context': context_builder.stats(),
+        'models': model_router.stats(),
+        'bursts': burst_coalescer.stats(),
+        'openai': ai_scheduler.stats(),
+        'breaker': ai_breaker.stats()
     })
 
+@app.route('/api/handoffs', methods=['GET'])
+def get_handoffs():
+    """Messages queued for a human agent while the AI path was unavailable"""
+    limit = min(max(request.args.get('limit', 100, type=int), 1), 500)
+    return jsonify({'success': True, 'handoffs': conversation_store.list_handoffs(limit)})
+
+@app.route('/api/handoffs/<int:handoff_id>/resolve', methods=['POST'])
+def resolve_handoff(handoff_id):
+    if not conversation_store.resolve_handoff(handoff_id):
+        return jsonify({'success': False, 'error': 'Handoff not found or already resolved'}), 404
+    return jsonify({'success': True})
+
+@app.route('/api/dedup-stats', methods=['GET'])
+def get_dedup_stats():
+    """How many retried webhooks were suppressed"""
+    return jsonify({'success': True, 'dedup': webhook_dedup.stats()})
+
 @app.route('/api/chats', methods=['GET'])
 def get_chats():
     # Fetch chats from Tata API
@@ -106,7 +231,7 @@ def get_chats():
         }
         
         # Get conversations from Tata API
-        response = requests.get('https://wb.omni.tatatelebusiness.com/conversations', headers=headers)
+        response = tata_client.get('/conversations', headers=headers)
         
         if response.status_code == 200:
             tata_chats = response.json()
@@ -121,39 +246,19 @@ def get_chats():
                 })
         else:
             # Fallback to local storage
-            chat_list = []
-            for phone, chat_data in chats_db.items():
-                chat_list.append({
-                    'phone': phone,
-                    'lastMessage': chat_data.get('lastMessage', 'No messages'),
-                    'timestamp': chat_data.get('timestamp', ''),
-                    'messageCount': len(messages_db.get(phone, []))
-                })
+            chat_list = conversation_store.list_chats()
     
     except Exception as e:
         print(f"Error fetching chats: {e}")
         # Fallback to local storage
-        chat_list = []
-        for phone, chat_data in chats_db.items():
-            chat_list.append({
-                'phone': phone,
-                'lastMessage': chat_data.get('lastMessage', 'No messages'),
-                'timestamp': chat_data.get('timestamp', ''),
-                'messageCount': len(messages_db.get(phone, []))
-            })
-    
-    stats = {
-        'totalMessages': sum(len(msgs) for msgs in messages_db.values()),
-        'activeChats': len(chat_list),
-        'aiResponses': sum(1 for msgs in messages_db.values() for msg in msgs if msg.get('type') == 'sent'),
-        'successRate': 95
-    }
+        chat_list = conversation_store.list_chats()
     
+    stats = conversation_store.chat_stats(len(chat_list), DELIVERY_STATS_HOURS)
     return jsonify({'chats': chat_list, 'stats': stats})
 
 @app.route('/api/messages/<phone>', methods=['GET'])
 def get_messages(phone):
-    messages = messages_db.get(phone, [])
+    messages = conversation_store.get_messages(phone)
     return jsonify({'messages': messages})
 
 @app.route('/api/send-message', methods=['POST'])
@@ -165,28 +270,13 @@ def api_send_message():
     if not phone or not message:
         return jsonify({'success': False, 'error': 'Phone and message required'})
     
-    # Send session message using Tata API
-    success = send_session_message(phone, message)
-    
-    if success:
-        # Store message locally
-        if phone not in messages_db:
-            messages_db[phone] = []
-        
-        messages_db[phone].append({
-            'text': message,
-            'type': 'sent',
-            'timestamp': datetime.now().isoformat()
-        })
-        
-        chats_db[phone] = {
-            'lastMessage': message,
-            'timestamp': datetime.now().isoformat()
-        }
-        
-        return jsonify({'success': True})
-    else:
-        return jsonify({'success': False, 'error': 'Message sent to Tata API but user may not receive it. Users must opt-in first by messaging your WhatsApp number.'})
+    # Delivered by the outbox workers, retried if the Tata API fails
+    key = data.get('idempotencyKey') or request.headers.get('Idempotency-Key')
+    try:
+        outbox_id, created = outbox.enqueue(phone, message, 'manual', key=key)
+    except RecipientOptedOut as e:
+        return jsonify({'success': False, 'error': str(e)}), 409
+    return jsonify({'success': True, 'queued': True, 'id': outbox_id, 'duplicate': not created})
 
 @app.route('/api/send-template', methods=['POST'])
 def api_send_template():
@@ -196,88 +286,162 @@ def api_send_template():
     if not phone:
         return jsonify({'success': False, 'error': 'Phone number required'})
     
-    # Send template message using Tata API
-    success = send_template_message(phone)
-    
-    if success:
-        # Store template message locally
-        if phone not in messages_db:
-            messages_db[phone] = []
-        
-        template_msg = "Welcome template sent"
-        messages_db[phone].append({
-            'text': template_msg,
-            'type': 'sent',
-            'timestamp': datetime.now().isoformat()
-        })
-        
-        chats_db[phone] = {
-            'lastMessage': template_msg,
-            'timestamp': datetime.now().isoformat()
-        }
-        
-        return jsonify({'success': True, 'message': 'Template message sent! User can now reply.'})
-    else:
-        return jsonify({'success': False, 'error': 'Template sent to Tata API but user may not receive it. Users must opt-in first.'})
+    key = data.get('idempotencyKey') or request.headers.get('Idempotency-Key')
+    try:
+        outbox_id, created = outbox.enqueue(phone, 'hello_world', 'template', kind='template',
+                                            history_text="Welcome template sent", key=key)
+    except RecipientOptedOut as e:
+        return jsonify({'success': False, 'error': str(e)}), 409
+    return jsonify({'success': True, 'queued': True, 'id': outbox_id, 'duplicate': not created,
+                    'message': 'Template message queued! User can reply once it is delivered.'})
 
-def send_session_message(phone, message):
-    """Send session message using Tata API"""
-    url = "https://wb.omni.tatatelebusiness.com/whatsapp-cloud/messages"
-    
-    headers = {
-        'Authorization': f'Bearer {WHATSAPP_TOKEN}',
-        'Content-Type': 'application/json'
-    }
+@app.route('/api/broadcasts', methods=['POST'])
+def create_broadcast():
+    """Send a template to many recipients
+
+    Accepts JSON {"recipients": [...], "template": "name", "language": "en_US",
+    "parameters": [...], "concurrency": n, "rate": n} or a multipart form with the
+    same fields and a `file` of recipients (CSV: phone, then body parameters).
+    """
+    if request.files.get('file'):
+        form = request.form
+        items = broadcast.read_recipients_file(request.files['file'].read())
+        parameters = json.loads(form['parameters']) if form.get('parameters') else None
+    else:
+        form = request.get_json() or {}
+        items = form.get('recipients') or []
+        parameters = form.get('parameters')
     
-    payload = {
-        'to': phone,
-        'type': 'text',
-        'source': 'external',
-        'text': {'body': message},
-        'metaData': {'custom_callback_data': 'session_message'}
-    }
+    template = form.get('template')
+    if not template:
+        return jsonify({'success': False, 'error': 'Template name required'}), 400
+    try:
+        concurrency = broadcast.parse_limit(form.get('concurrency'), int)
+        rate = broadcast.parse_limit(form.get('rate'))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': f"concurrency and rate must be positive numbers: {e}"}), 400
+    recipients, invalid = broadcast.parse_recipients(items)
+    if not recipients:
+        return jsonify({'success': False, 'error': 'No valid recipients', 'invalid': invalid[:100]}), 400
+    if len(recipients) > broadcast.BROADCAST_MAX_RECIPIENTS:
+        return jsonify({'success': False, 'error': f"At most {broadcast.BROADCAST_MAX_RECIPIENTS} recipients per broadcast"}), 400
     
+    job = broadcasts.create(
+        recipients,
+        template,
+        language=form.get('language') or 'en_US',
+        parameters=parameters,
+        concurrency=concurrency,
+        rate=rate,
+    )
+    return jsonify({
+        'success': True,
+        'job': job.progress(),
+        'invalid': invalid[:100],
+        'stream': f"/api/broadcasts/{job.id}/stream"
+    }), 202
+
+@app.route('/api/broadcasts', methods=['GET'])
+def list_broadcasts():
+    return jsonify({'success': True, 'jobs': broadcasts.list()})
+
+@app.route('/api/broadcasts/<job_id>', methods=['GET'])
+def get_broadcast(job_id):
+    """Progress of a broadcast and a page of per-recipient results"""
+    job = broadcasts.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Broadcast not found'}), 404
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
+    with job.cond:
+        results = job.results[offset:offset + limit]
+    return jsonify({'success': True, 'job': job.progress(), 'results': results, 'offset': offset})
+
+@app.route('/api/broadcasts/<job_id>/stream', methods=['GET'])
+def stream_broadcast(job_id):
+    """Server-sent events with each recipient's result and the job's progress"""
+    job = broadcasts.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Broadcast not found'}), 404
+    return Response(broadcast.stream_events(job), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/broadcasts/<job_id>/cancel', methods=['POST'])
+def cancel_broadcast(job_id):
+    if not broadcasts.cancel(job_id):
+        return jsonify({'success': False, 'error': 'Broadcast not found or already finished'}), 404
+    return jsonify({'success': True})
+
+@app.route('/api/outbox', methods=['GET'])
+def get_outbox_stats():
+    """Pending, sent and dead-lettered outbound messages"""
+    return jsonify({'success': True, 'outbox': outbox.stats()})
+
+@app.route('/api/outbox/dead', methods=['GET'])
+def get_dead_letters():
+    limit = min(max(request.args.get('limit', 100, type=int), 1), 500)
+    return jsonify({'success': True, 'messages': outbox.dead_letters(limit)})
+
+@app.route('/api/outbox/<int:message_id>/retry', methods=['POST'])
+def retry_dead_letter(message_id):
+    if not outbox.requeue(message_id):
+        return jsonify({'success': False, 'error': 'Message not found or not dead-lettered'}), 404
+    return jsonify({'success': True})
+
+def generate_reply(phone, message_text, priority=PRIORITY_INTERACTIVE):
+    """AI reply for a message, answered locally from the FAQ or reply cache when possible"""
+    deadline = time.monotonic() + AI_DEADLINE_SECONDS
+    reply, tier, messages, cache_key = prepare_reply(phone, message_text)
+    if reply is not None:
+        return reply
     try:
-        response = requests.post(url, headers=headers, json=payload)
-        print(f"Session message response: {response.status_code} - {response.text}")
-        return response.status_code == 200
+        response = model_router.complete(ai_scheduler.complete, tier, messages, timeout=AI_TIMEOUT_SECONDS,
+                                         priority=priority, deadline=deadline)
+    except SchedulerBusy:
+        # Local queueing, not a sign that OpenAI is unhealthy
+        raise
     except Exception as e:
-        print(f"Error sending session message: {e}")
-        return False
+        return failed_reply(phone, message_text, e)
+    return finish_reply(cache_key, response)
 
-def send_template_message(phone):
-    """Send template message using Tata API"""
-    url = "https://wb.omni.tatatelebusiness.com/whatsapp-cloud/messages"
-    
-    headers = {
-        'Authorization': f'Bearer {WHATSAPP_TOKEN}',
-        'Content-Type': 'application/json'
-    }
-    
-    # Use hello_world template (default WhatsApp template)
-    payload = {
-        'to': phone,
-        'type': 'template',
-        'template': {
-            'name': 'hello_world',
-            'language': {'code': 'en_US'}
-        }
-    }
-    
+def process_message(phone, message_text, key=None, queued_at=None):
+    """Generate the AI reply for a received message and send it back
+
+    key is the outbox idempotency key of the reply, so a message processed
+    twice is still answered once. A message queued at queued_at (monotonic
+    seconds) more than AI_BACKLOG_SECONDS ago waits for OpenAI budget behind
+    fresh ones, so a backlog doesn't make every contact wait.
+    """
+    priority = PRIORITY_INTERACTIVE
+    if queued_at is not None and time.monotonic() - queued_at > AI_BACKLOG_SECONDS:
+        priority = PRIORITY_BACKGROUND
     try:
-        response = requests.post(url, headers=headers, json=payload)
-        print(f"Template message response: {response.status_code} - {response.text}")
+        # Greetings, STOP and other simple intents never reach the AI
+        intent = route_intent(message_text)
+        if intent is not None:
+            answer_intent(phone, intent, key)
+            return
+        if conversation_store.is_opted_out(phone):
+            print(f"{phone} has opted out, no reply")
+            return
         
-        if response.status_code == 200:
-            return True
-        else:
-            # If template fails, try session message as fallback
-            print("Template failed, trying session message...")
-            return send_session_message(phone, "Hello! Welcome to our AI assistant. Reply with any message to start chatting. 🤖")
-            
+        # Get AI response
+        ai_response = generate_reply(phone, message_text, priority)
+        print(f"AI Response: {ai_response}")
+        
+        # Queue AI reply, it is stored in the chat once delivered
+        outbox.enqueue(phone, ai_response, 'ai', key=key)
+        
+    except SchedulerBusy as e:
+        # Saturation is reported by /api/ai-stats, the customer gets the fallback reply instead of an error
+        print(f"OpenAI saturated, fallback reply for {phone}: {e}")
+        send_fallback(phone, message_text, 'saturated', key)
+    except RecipientOptedOut:
+        # STOP arrived while the reply was being generated
+        print(f"{phone} opted out, reply dropped")
     except Exception as e:
-        print(f"Error sending template message: {e}")
-        return False
+        print(f"Error processing message: {e}")
+        send_error_reply(phone, key)
 
 @app.route('/webhook', methods=['POST'])
 def handle_webhook():
@@ -285,106 +449,69 @@ def handle_webhook():
     print(f"Received webhook data: {data}")
     
     # Store all webhook data for comprehensive tracking
-    webhook_entry = {
-        'timestamp': datetime.now().isoformat(),
-        'data': data,
-        'raw_data': str(data)
-    }
-    all_webhook_data.append(webhook_entry)
+    webhook_log.append(data)
     
-    # Extract and store contact info from any webhook data
-    contact_phone = None
-    contact_name = None
+    # Delivery receipts for messages we sent, applied in one transaction
+    statuses = parse_statuses(data)
+    if statuses:
+        conversation_store.record_statuses(statuses)
     
-    # Try different webhook formats
-    if data.get('contacts'):
-        for contact in data['contacts']:
-            contact_phone = contact.get('wa_id') or contact.get('phone')
-            contact_name = contact.get('profile', {}).get('name', 'Unknown')
+    # Detect the webhook format once, a Meta-style payload can carry many messages
+    events = parse_events(data)
+    results = []
+    accepted = []
     
-    if data.get('messages'):
-        msg_data = data['messages']
-        contact_phone = msg_data.get('from') or contact_phone
+    for event in events:
+        result = {'id': event.message_id, 'phone': event.phone}
+        results.append(result)
+        if not event.phone:
+            result['status'] = 'ignored'
+            continue
+        
+        # Tata retries slow webhooks, only process each message once
+        dedup_key = message_key(event.message_id, event.phone, event.text, event.timestamp)
+        if webhook_dedup.seen(dedup_key):
+            print(f"Duplicate webhook for {event.phone} ignored ({dedup_key})")
+            result['status'] = 'duplicate'
+            continue
+        accepted.append((event, dedup_key, result))
     
-    if data.get('from'):
-        contact_phone = data['from']
+    # Messages the AI lanes can't take are left for Tata to retry and not stored yet,
+    # so a retried message is stored and counted once
+    busy = False
+    stored = []
+    for event, dedup_key, result in accepted:
+        if event.text and WEBHOOK_MODE != 'inline' and not ai_workers.has_capacity(event.phone):
+            webhook_dedup.forget(dedup_key)
+            result['status'] = 'busy'
+            busy = True
+        else:
+            stored.append((event, dedup_key, result))
     
-    # Store contact info
-    if contact_phone:
-        all_contacts[contact_phone] = {
-            'phone': contact_phone,
-            'name': contact_name or 'Unknown',
-            'last_seen': datetime.now().isoformat(),
-            'total_interactions': all_contacts.get(contact_phone, {}).get('total_interactions', 0) + 1
-        }
+    # Store contacts and received messages of the whole batch in one transaction
+    if stored:
+        conversation_store.record_inbound([event for event, _, _ in stored])
     
-    # Handle Tata webhook format
-    if data.get('messages'):
-        message_data = data['messages']
-        phone = message_data.get('from')
+    for event, dedup_key, result in stored:
+        phone = event.phone
+        message_text = event.text
+        if not message_text:
+            result['status'] = 'stored'
+            continue
         
-        if message_data.get('text'):
-            message_text = message_data['text'].get('body')
-        else:
-            message_text = None
-            
-    else:
-        # Alternative format
-        phone = data.get('from')
-        if data.get('text'):
-            message_text = data['text'].get('body') if isinstance(data['text'], dict) else data['text']
-        else:
-            message_text = data.get('message')
-    
-    if phone and message_text:
         print(f"Processing message from {phone}: {message_text}")
         
-        # Store received message
-        if phone not in messages_db:
-            messages_db[phone] = []
-        
-        messages_db[phone].append({
-            'text': message_text,
-            'type': 'received',
-            'timestamp': datetime.now().isoformat()
-        })
-        
-        try:
-            # Get AI response
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": "You are a helpful WhatsApp assistant. Keep responses brief and friendly."},
-                    {"role": "user", "content": message_text}
-                ],
-                max_tokens=150
-            )
-            
-            ai_response = response.choices[0].message.content
-            print(f"AI Response: {ai_response}")
-            
-            # Send AI reply
-            success = send_session_message(phone, ai_response)
-            
-            if success:
-                # Store AI response
-                messages_db[phone].append({
-                    'text': ai_response,
-                    'type': 'sent',
-                    'timestamp': datetime.now().isoformat()
-                })
-                
-                chats_db[phone] = {
-                    'lastMessage': message_text,
-                    'timestamp': datetime.now().isoformat()
-                }
-            
-        except Exception as e:
-            print(f"Error processing message: {e}")
-            error_msg = "Sorry, I encountered an error. Please try again."
-            send_session_message(phone, error_msg)
+        # STOP and START take effect right away, never merged into a burst with other messages
+        if WEBHOOK_MODE == 'inline' or opt_change(message_text):
+            process_message(phone, message_text, reply_key([dedup_key]))
+            result['status'] = 'processed'
+        else:
+            burst_coalescer.add(phone, message_text, dedup_key)
+            result['status'] = 'queued'
     
-    return jsonify({'status': 'success', 'message': 'received'})
+    if busy:
+        return jsonify({'status': 'busy', 'message': 'AI queue full', 'results': results, 'statuses': len(statuses)}), 503
+    return jsonify({'status': 'success', 'message': 'received', 'results': results, 'statuses': len(statuses)})
 
 @app.route('/webhook', methods=['GET'])
 def verify_webhook():
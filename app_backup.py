@@ -1,5 +1,4 @@
 from flask import Flask, request, jsonify
-import requests
 import os
 from datetime import datetime
 from dotenv import load_dotenv
@@ -7,6 +6,11 @@ from openai import OpenAI
 
 load_dotenv()
 
+import tata_client
+from provider_capabilities import CapabilityCache
+from model_tiers import ModelRouter
+from webhook_parser import parse_webhook
+
 app = Flask(__name__)
 
 # Configuration
@@ -16,6 +20,7 @@ VERIFY_TOKEN = os.getenv('VERIFY_TOKEN')
 
 # OpenAI client
 client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+model_router = ModelRouter()
 
 @app.route('/', methods=['GET'])
 def dashboard():
@@ -126,7 +131,7 @@ def api_send_template():
 
 def send_whatsapp_message(phone, message):
     """Send message using Tata Telecom API"""
-    url = "https://wb.omni.tatatelebusiness.com/whatsapp-cloud/messages"
+    url = tata_client.MESSAGES_URL
     
     headers = {
         'Authorization': f'Bearer {WHATSAPP_TOKEN}',
@@ -140,7 +145,7 @@ def send_whatsapp_message(phone, message):
     }
     
     try:
-        response = requests.post(url, headers=headers, json=payload)
+        response = tata_client.post(url, headers=headers, json=payload)
         print(f"Send message response: {response.status_code} - {response.text}")
         return response.status_code == 200
     except Exception as e:
@@ -168,13 +173,9 @@ def handle_webhook():
     print(f"Received webhook data: {data}")
     
     # Extract phone and message from Tata format
-    phone = data.get('from') or data.get('phone')
-    message_text = None
-    
-    if data.get('text'):
-        message_text = data.get('text', {}).get('body') or data.get('text')
-    elif data.get('message'):
-        message_text = data.get('message')
+    event = parse_webhook(data)
+    phone = event.phone if event else None
+    message_text = event.text if event else None
     
     print(f"Phone: {phone}, Message: {message_text}")
     
@@ -195,13 +196,13 @@ def handle_webhook():
             print(f"Getting AI response for: {message_text}")
             
             # Get AI response
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
+            response = model_router.complete(
+                client.chat.completions.create,
+                model_router.choose(message_text),
+                [
                     {"role": "system", "content": "You are a helpful WhatsApp assistant. Keep responses brief and friendly."},
                     {"role": "user", "content": message_text}
-                ],
-                max_tokens=150
+                ]
             )
             
             ai_response = response.choices[0].message.content
@@ -243,37 +244,22 @@ def handle_webhook():
 
 def handle_message(message):
     # Handle different message formats from Tata Telecom
-    from_number = None
-    text = None
-    
-    # Format 1: Direct message object
-    if message.get('from'):
-        from_number = message.get('from')
-        if message.get('text'):
-            text = message.get('text', {}).get('body') or message.get('text')
-    
-    # Format 2: Nested structure
-    elif message.get('sender'):
-        from_number = message.get('sender')
-        text = message.get('message', {}).get('text') or message.get('body')
-    
-    # Format 3: Alternative structure
-    elif message.get('phone'):
-        from_number = message.get('phone')
-        text = message.get('content') or message.get('message')
+    event = parse_webhook(message)
+    from_number = event.phone if event else None
+    text = event.text if event else None
     
     if from_number and text:
         print(f"Received from {from_number}: {text}")
         
         try:
             # Get AI response
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
+            response = model_router.complete(
+                client.chat.completions.create,
+                model_router.choose(text),
+                [
                     {"role": "system", "content": "You are a helpful WhatsApp assistant. Keep responses brief and friendly."},
                     {"role": "user", "content": text}
-                ],
-                max_tokens=150
+                ]
             )
             
             ai_response = response.choices[0].message.content
@@ -285,54 +271,60 @@ def handle_message(message):
     else:
         print(f"Could not extract message data: {message}")
 
-def send_message(to, message):
-    # Try multiple Tata Telecom API endpoints for sending messages
-    endpoints = [
-        f"https://graph.facebook.com/v18.0/{WHATSAPP_PHONE_NUMBER_ID}/messages",
-        "https://api.smartflo.ai/v1/messages",
-        "https://api.smartflo.ai/send"
-    ]
-    
+# Endpoints and payload shapes the provider might accept, tried in this order
+SEND_ENDPOINTS = [
+    f"https://graph.facebook.com/v18.0/{WHATSAPP_PHONE_NUMBER_ID}/messages",
+    "https://api.smartflo.ai/v1/messages",
+    "https://api.smartflo.ai/send"
+]
+
+SEND_PAYLOADS = {
+    'cloud_api': lambda to, message: {
+        'messaging_product': 'whatsapp',
+        'to': to,
+        'text': {'body': message}
+    },
+    'typed_text': lambda to, message: {
+        'to': to,
+        'type': 'text',
+        'text': {'body': message}
+    },
+    'flat': lambda to, message: {
+        'phone': to,
+        'message': message,
+        'type': 'text'
+    }
+}
+
+def attempt_send(route, to, message):
+    """One send through a single endpoint and payload shape"""
+    endpoint, payload_name = route
     headers = {
         'Authorization': f'Bearer {WHATSAPP_TOKEN}',
         'Content-Type': 'application/json'
     }
-    
-    # Different payload formats to try
-    payloads = [
-        {
-            'messaging_product': 'whatsapp',
-            'to': to,
-            'text': {'body': message}
-        },
-        {
-            'to': to,
-            'type': 'text',
-            'text': {'body': message}
-        },
-        {
-            'phone': to,
-            'message': message,
-            'type': 'text'
-        }
-    ]
-    
-    for endpoint in endpoints:
-        for payload in payloads:
-            try:
-                print(f"Trying to send to {endpoint} with payload: {payload}")
-                response = requests.post(endpoint, headers=headers, json=payload)
-                print(f"Response: {response.status_code} - {response.text}")
-                
-                if response.status_code in [200, 201]:
-                    print(f"Message sent successfully via {endpoint}")
-                    return True
-                    
-            except Exception as e:
-                print(f"Error with {endpoint}: {e}")
-                continue
-    
-    print("Failed to send message with all endpoints")
+    response = tata_client.post(endpoint, headers=headers, json=SEND_PAYLOADS[payload_name](to, message))
+    print(f"Response from {endpoint} ({payload_name}): {response.status_code} - {response.text}")
+    return response.status_code in [200, 201]
+
+# The working endpoint/payload combination is found once and reused until it fails
+send_routes = CapabilityCache(
+    [(endpoint, payload_name) for endpoint in SEND_ENDPOINTS for payload_name in SEND_PAYLOADS],
+    attempt_send
+)
+
+# Optionally find the route at startup with a check message to our own number
+if os.getenv('PROVIDER_PROBE_PHONE'):
+    send_routes.probe_async(os.getenv('PROVIDER_PROBE_PHONE'), "Provider connection check")
+
+@app.route('/api/provider-stats', methods=['GET'])
+def provider_stats():
+    return jsonify(send_routes.stats())
+
+def send_message(to, message):
+    if send_routes.send(to, message):
+        return True
+    print("Failed to send message")
     return False
 
 if __name__ == '__main__':
@@ -0,0 +1,333 @@
+"""ASGI variant of app.py for high concurrency
+
+Serves the same webhook and API routes with Starlette and AsyncOpenAI, so
+waiting on OpenAI costs a coroutine rather than a thread. Replies are built
+and queued by replies.py like app.py's, and sent by the same outbox. Run it
+with:
+
+    uvicorn async_app:app --host 0.0.0.0 --port 3000
+"""
+import asyncio
+import contextlib
+import os
+import time
+
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+from starlette.applications import Starlette
+from starlette.responses import FileResponse, JSONResponse, PlainTextResponse
+from starlette.routing import Route
+
+load_dotenv()
+
+import conversation_store
+import tata_client
+from circuit_breaker import AI_DEADLINE_SECONDS, AI_TIMEOUT_SECONDS
+from faq_matcher import get_matcher
+from intent_router import get_router, route_intent
+from message_dedup import DedupIndex, message_key
+from openai_scheduler import OpenAIScheduler, SchedulerBusy
+from outbox import RecipientOptedOut
+from replies import (ai_breaker, answer_intent, context_builder, failed_reply, finish_reply, model_router, outbox,
+                     prepare_reply, reply_cache, reply_key, send_error_reply, send_fallback, send_governor)
+from webhook_log import WebhookLog
+from webhook_parser import parse_events, parse_statuses
+
+# Configuration
+WHATSAPP_TOKEN = os.getenv('WHATSAPP_TOKEN')
+OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+
+# Conversations being answered at once; beyond it webhooks get a 503 so Tata retries later
+ASYNC_MAX_INFLIGHT = int(os.getenv('ASYNC_MAX_INFLIGHT', 5000))
+# Concurrent OpenAI requests, the rest wait for a slot
+ASYNC_AI_CONCURRENCY = int(os.getenv('ASYNC_AI_CONCURRENCY', 200))
+WEBHOOK_LOG_SIZE = int(os.getenv('WEBHOOK_LOG_SIZE', 500))
+WEBHOOK_LOG_SEGMENT = int(os.getenv('WEBHOOK_LOG_SEGMENT', 100))
+WEBHOOK_ARCHIVE_DIR = os.getenv('WEBHOOK_ARCHIVE_DIR', 'webhook_archive')
+DELIVERY_STATS_HOURS = float(os.getenv('DELIVERY_STATS_HOURS', 24))
+
+ai_scheduler = OpenAIScheduler(AsyncOpenAI(api_key=OPENAI_API_KEY))
+webhook_dedup = DedupIndex()
+
+webhook_log = WebhookLog(capacity=WEBHOOK_LOG_SIZE, segment_size=WEBHOOK_LOG_SEGMENT, archive_dir=WEBHOOK_ARCHIVE_DIR)
+
+_ai_slots = None
+_tasks = set()
+_contact_locks = {}  # phone -> [asyncio.Lock, tasks using it], messages of one contact are answered in order
+
+
+async def db(fn, *args, **kwargs):
+    """Run a conversation_store call off the event loop"""
+    return await asyncio.to_thread(fn, *args, **kwargs)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    global _ai_slots
+    _ai_slots = asyncio.Semaphore(ASYNC_AI_CONCURRENCY)
+    yield
+    await tata_client.aclose()
+    await ai_scheduler.client.close()
+
+
+async def dashboard(request):
+    return FileResponse(os.path.join('static', 'dashboard.html'))
+
+
+async def get_chats(request):
+    # Fetch chats from Tata API
+    try:
+        headers = {
+            'Authorization': f'Bearer {WHATSAPP_TOKEN}',
+            'Content-Type': 'application/json'
+        }
+        response = await tata_client.aget('/conversations', headers=headers)
+
+        if response.status_code == 200:
+            chat_list = []
+            for chat in response.json().get('conversations', []):
+                chat_list.append({
+                    'phone': chat.get('contact', {}).get('phone', 'Unknown'),
+                    'lastMessage': chat.get('lastMessage', {}).get('text', 'No messages'),
+                    'timestamp': chat.get('updatedAt', ''),
+                    'messageCount': chat.get('messageCount', 0)
+                })
+        else:
+            chat_list = await db(conversation_store.list_chats)
+
+    except Exception as e:
+        print(f"Error fetching chats: {e}")
+        chat_list = await db(conversation_store.list_chats)
+
+    stats = await db(conversation_store.chat_stats, len(chat_list), DELIVERY_STATS_HOURS)
+
+    return JSONResponse({'chats': chat_list, 'stats': stats})
+
+
+async def get_messages(request):
+    phone = request.path_params['phone']
+    messages = await db(conversation_store.get_messages, phone)
+    return JSONResponse({'messages': messages})
+
+
+async def api_send_message(request):
+    data = await request.json()
+    phone = data.get('phone')
+    message = data.get('message')
+
+    if not phone or not message:
+        return JSONResponse({'success': False, 'error': 'Phone and message required'})
+
+    # Delivered by the outbox workers, retried if the Tata API fails
+    key = data.get('idempotencyKey') or request.headers.get('Idempotency-Key')
+    try:
+        outbox_id, created = await db(outbox.enqueue, phone, message, 'manual', key=key)
+    except RecipientOptedOut as e:
+        return JSONResponse({'success': False, 'error': str(e)}, status_code=409)
+    return JSONResponse({'success': True, 'queued': True, 'id': outbox_id, 'duplicate': not created})
+
+
+async def api_send_template(request):
+    data = await request.json()
+    phone = data.get('phone')
+
+    if not phone:
+        return JSONResponse({'success': False, 'error': 'Phone number required'})
+
+    key = data.get('idempotencyKey') or request.headers.get('Idempotency-Key')
+    try:
+        outbox_id, created = await db(outbox.enqueue, phone, 'hello_world', 'template', kind='template',
+                                      history_text="Welcome template sent", key=key)
+    except RecipientOptedOut as e:
+        return JSONResponse({'success': False, 'error': str(e)}, status_code=409)
+    return JSONResponse({'success': True, 'queued': True, 'id': outbox_id, 'duplicate': not created,
+                         'message': 'Template message queued! User can reply once it is delivered.'})
+
+
+async def get_outbox_stats(request):
+    """Pending, sent and dead-lettered outbound messages"""
+    return JSONResponse({'success': True, 'outbox': await db(outbox.stats)})
+
+
+async def get_send_stats(request):
+    """Outbound budget per business number and how long sends waited for it"""
+    return JSONResponse({'success': True, 'governor': send_governor.stats()})
+
+
+async def get_delivery_stats(request):
+    """Delivered, read and failed counts and receipt latency from status webhooks"""
+    try:
+        hours = float(request.query_params.get('hours', DELIVERY_STATS_HOURS))
+    except ValueError:
+        hours = DELIVERY_STATS_HOURS
+    return JSONResponse({'success': True, 'delivery': await db(conversation_store.delivery_stats, hours)})
+
+
+async def get_ai_stats(request):
+    faq = get_matcher()
+    return JSONResponse({
+        'success': True,
+        'inFlight': len(_tasks),
+        'maxInFlight': ASYNC_MAX_INFLIGHT,
+        'intents': get_router().stats(),
+        'faq': faq.stats() if faq else None,
+        'replyCache': reply_cache.stats(),
+        'context': context_builder.stats(),
+        'models': model_router.stats(),
+        'openai': ai_scheduler.stats(),
+        'breaker': ai_breaker.stats(),
+        'tata': tata_client.stats()
+    })
+
+
+async def complete(tier, messages, deadline):
+    """Chat completion for the tier once an AI slot and the OpenAI budget are free, recorded per tier"""
+    async with _ai_slots:
+        start = time.monotonic()
+        try:
+            response = await ai_scheduler.acomplete(
+                model=tier.model,
+                messages=messages,
+                max_tokens=tier.max_tokens,
+                timeout=AI_TIMEOUT_SECONDS,
+                deadline=deadline
+            )
+        except Exception:
+            model_router.record(tier, time.monotonic() - start, None, ok=False)
+            raise
+        model_router.record(tier, time.monotonic() - start, response.usage)
+    return response
+
+
+async def generate_reply(phone, message_text):
+    """AI reply for a message, answered locally from the FAQ or reply cache when possible"""
+    deadline = time.monotonic() + AI_DEADLINE_SECONDS
+    reply, tier, messages, cache_key = await db(prepare_reply, phone, message_text)
+    if reply is not None:
+        return reply
+    try:
+        # Waiting for a slot counts towards the deadline too
+        response = await asyncio.wait_for(complete(tier, messages, deadline), deadline - time.monotonic())
+    except SchedulerBusy:
+        # Local queueing, not a sign that OpenAI is unhealthy
+        raise
+    except Exception as e:
+        return await db(failed_reply, phone, message_text, e)
+    return finish_reply(cache_key, response)
+
+
+async def process_message(phone, message_text, key=None):
+    """Generate the AI reply and queue it in the outbox, one message per contact at a time"""
+    entry = _contact_locks.setdefault(phone, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            # Greetings, STOP and other simple intents never reach the AI
+            intent = route_intent(message_text)
+            if intent is not None:
+                await db(answer_intent, phone, intent, key)
+                return
+            if await db(conversation_store.is_opted_out, phone):
+                print(f"{phone} has opted out, no reply")
+                return
+            ai_response = await generate_reply(phone, message_text)
+            await db(outbox.enqueue, phone, ai_response, 'ai', key=key)
+    except SchedulerBusy as e:
+        print(f"OpenAI saturated, fallback reply for {phone}: {e}")
+        await db(send_fallback, phone, message_text, 'saturated', key)
+    except RecipientOptedOut:
+        print(f"{phone} opted out, reply dropped")
+    except Exception as e:
+        print(f"Error processing message: {e}")
+        await db(send_error_reply, phone, key)
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            del _contact_locks[phone]
+
+
+async def handle_webhook(request):
+    data = await request.json()
+    webhook_log.append(data)
+
+    statuses = parse_statuses(data)
+    if statuses:
+        await db(conversation_store.record_statuses, statuses)
+
+    events = parse_events(data)
+    results = []
+    accepted = []
+
+    for event in events:
+        result = {'id': event.message_id, 'phone': event.phone}
+        results.append(result)
+        if not event.phone:
+            result['status'] = 'ignored'
+            continue
+
+        dedup_key = message_key(event.message_id, event.phone, event.text, event.timestamp)
+        if webhook_dedup.seen(dedup_key):
+            result['status'] = 'duplicate'
+            continue
+        accepted.append((event, dedup_key, result))
+
+    # Messages over the in-flight cap are left for Tata to retry and not stored yet
+    busy = False
+    stored = []
+    slots = ASYNC_MAX_INFLIGHT - len(_tasks)
+    for event, dedup_key, result in accepted:
+        if event.text and slots <= 0:
+            webhook_dedup.forget(dedup_key)
+            result['status'] = 'busy'
+            busy = True
+            continue
+        if event.text:
+            slots -= 1
+        stored.append((event, dedup_key, result))
+
+    if stored:
+        await db(conversation_store.record_inbound, [event for event, _, _ in stored])
+
+    for event, dedup_key, result in stored:
+        if not event.text:
+            result['status'] = 'stored'
+            continue
+        task = asyncio.create_task(process_message(event.phone, event.text, reply_key([dedup_key])))
+        _tasks.add(task)
+        task.add_done_callback(_tasks.discard)
+        result['status'] = 'queued'
+
+    if busy:
+        return JSONResponse({'status': 'busy', 'message': 'Too many conversations in flight', 'results': results,
+                             'statuses': len(statuses)}, status_code=503)
+    return JSONResponse({'status': 'success', 'message': 'received', 'results': results, 'statuses': len(statuses)})
+
+
+async def verify_webhook(request):
+    mode = request.query_params.get('hub.mode')
+    token = request.query_params.get('hub.verify_token')
+    challenge = request.query_params.get('hub.challenge')
+
+    if mode == 'subscribe' and token == os.getenv('VERIFY_TOKEN'):
+        return PlainTextResponse(challenge)
+    return PlainTextResponse('Forbidden', status_code=403)
+
+
+app = Starlette(lifespan=lifespan, routes=[
+    Route('/', dashboard),
+    Route('/webhook', verify_webhook, methods=['GET']),
+    Route('/webhook', handle_webhook, methods=['POST']),
+    Route('/api/chats', get_chats, methods=['GET']),
+    Route('/api/messages/{phone}', get_messages, methods=['GET']),
+    Route('/api/send-message', api_send_message, methods=['POST']),
+    Route('/api/send-template', api_send_template, methods=['POST']),
+    Route('/api/delivery-stats', get_delivery_stats, methods=['GET']),
+    Route('/api/send-stats', get_send_stats, methods=['GET']),
+    Route('/api/outbox', get_outbox_stats, methods=['GET']),
+    Route('/api/ai-stats', get_ai_stats, methods=['GET']),
+])
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=int(os.environ.get('PORT', 3000)))
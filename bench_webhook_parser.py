@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark for webhook_parser over captured webhook payloads
+Compares the shared parser with the extraction app.py used before it
+
+The parser does more per payload than the old extraction: it returns every
+message of a batch as an InboundEvent with id, timestamp and contact name,
+where the old code pulled four fields out of the first message. That
+costs about a microsecond per payload, small next to the SQLite write and
+the provider round trip of each message.
+
+Usage: python bench_webhook_parser.py [samples.json] [rounds]
+"""
+
+import json
+import os
+import sys
+import time
+
+from webhook_parser import parse_events
+
+SAMPLES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'webhook_samples.json')
+
+
+def legacy_extract(data):
+    """Extraction from the old app.handle_webhook, kept for comparison"""
+    contact_phone = None
+    contact_name = None
+    if data.get('contacts'):
+        for contact in data['contacts']:
+            contact_phone = contact.get('wa_id') or contact.get('phone')
+            contact_name = contact.get('profile', {}).get('name', 'Unknown')
+    if data.get('messages'):
+        contact_phone = data['messages'].get('from') or contact_phone
+    if data.get('from'):
+        contact_phone = data['from']
+
+    if data.get('messages'):
+        message_data = data['messages']
+        phone = message_data.get('from')
+        message_text = message_data['text'].get('body') if message_data.get('text') else None
+    else:
+        phone = data.get('from')
+        if data.get('text'):
+            message_text = data['text'].get('body') if isinstance(data['text'], dict) else data['text']
+        else:
+            message_text = data.get('message')
+    return contact_phone, contact_name, phone, message_text
+
+
+def bench(name, fn, corpus, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for payload in corpus:
+            fn(payload)
+    elapsed = time.perf_counter() - start
+    per_payload = elapsed / (rounds * len(corpus)) * 1e9
+    print(f"{name:<10} {per_payload:8.0f} ns/payload  ({rounds * len(corpus)} payloads in {elapsed:.3f}s)")
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else SAMPLES_PATH
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+
+    with open(path) as f:
+        corpus = json.load(f)
+
+    messages = sum(len(parse_events(payload)) for payload in corpus)
+    print(f"Corpus: {len(corpus)} payloads, {messages} messages\n")
+
+    # Legacy extraction only understands the Tata and flat shapes
+    legacy_corpus = [p for p in corpus if 'entry' not in p and 'entityType' not in p]
+
+    bench('parser', parse_events, corpus, rounds)
+    bench('parser*', parse_events, legacy_corpus, rounds)
+    bench('legacy*', legacy_extract, legacy_corpus, rounds)
+    print("\n* Tata and flat payloads only, the formats the legacy extraction handles")
+    print("  legacy extracts four fields of the first message, the parser builds full events for all of them")
+
+
+if __name__ == '__main__':
+    main()
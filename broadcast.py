@@ -0,0 +1,323 @@
+import csv
+import io
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from send_governor import SendThrottled
+
+# Defaults sized for the provider's standard throughput tier; requests may ask for less, never more
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', 8))
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', 20))  # messages per second
+BROADCAST_MAX_RECIPIENTS = int(os.getenv('BROADCAST_MAX_RECIPIENTS', 100000))
+BROADCAST_KEEP_JOBS = int(os.getenv('BROADCAST_KEEP_JOBS', 50))
+# Sends that found no outbound budget are tried this many more times before the recipient is marked throttled
+BROADCAST_THROTTLE_RETRIES = int(os.getenv('BROADCAST_THROTTLE_RETRIES', 3))
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+CANCELLED = 'cancelled'
+
+_NON_DIGITS = re.compile(r'[^\d]')
+
+
+def normalize_phone(phone):
+    """Digits only with country code, like webhook senders are stored; None if it can't be a phone number"""
+    digits = _NON_DIGITS.sub('', str(phone or ''))
+    return digits if 8 <= len(digits) <= 15 else None
+
+
+def body_components(parameters):
+    """Template components for positional body parameters ({{1}}, {{2}}, ...)"""
+    if not parameters:
+        return None
+    return [{'type': 'body', 'parameters': [{'type': 'text', 'text': str(p)} for p in parameters]}]
+
+
+def parse_recipients(items):
+    """[(phone, parameters)] from phone strings or {'phone', 'parameters'} dicts, deduplicated
+
+    Returns (recipients, invalid entries).
+    """
+    recipients = []
+    invalid = []
+    seen = set()
+    for item in items:
+        if isinstance(item, dict):
+            raw, parameters = item.get('phone'), item.get('parameters')
+        else:
+            raw, parameters = item, None
+        phone = normalize_phone(raw)
+        if phone is None:
+            invalid.append(raw)
+        elif phone not in seen:
+            seen.add(phone)
+            recipients.append((phone, parameters))
+    return recipients, invalid
+
+
+def parse_limit(value, cast=float):
+    """A requested concurrency or rate as a positive number, None when not given
+
+    Raises ValueError for anything else.
+    """
+    if value is None or value == '':
+        return None
+    if isinstance(value, bool):
+        raise ValueError(f"Expected a positive number, got {value!r}")
+    try:
+        number = cast(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Expected a positive number, got {value!r}") from None
+    if not number > 0 or (cast is int and number != float(value)):
+        raise ValueError(f"Expected a positive number, got {value!r}")
+    return number
+
+
+def read_recipients_file(data):
+    """Recipients from an uploaded CSV or text file: a phone per row, extra columns are body parameters"""
+    text = data.decode('utf-8-sig') if isinstance(data, bytes) else data
+    items = []
+    for row in csv.reader(io.StringIO(text)):
+        row = [cell.strip() for cell in row]
+        if not row or not row[0] or row[0].lower() in ('phone', 'number', 'mobile'):
+            continue
+        items.append({'phone': row[0], 'parameters': row[1:] or None})
+    return items
+
+
+class BroadcastJob:
+    """One template sent to many recipients, with per-recipient results in completion order"""
+
+    def __init__(self, recipients, template, concurrency, rate):
+        self.id = uuid.uuid4().hex[:12]
+        self.template = template
+        self.concurrency = concurrency
+        self.rate = rate
+        self.recipients = recipients
+        self.status = QUEUED
+        self.results = []  # {'phone', 'status', 'error', 'at'} as sends finish
+        self.sent = 0
+        self.failed = 0
+        self.skipped = 0
+        self.throttled = 0
+        self.created_at = datetime.now().isoformat()
+        self.started = None
+        self.finished = None
+        self.cancelled = threading.Event()
+        self.cond = threading.Condition()
+
+    def record(self, phone, ok, error=None, message_id=None, skipped=False, throttled=False):
+        status = 'skipped' if skipped else 'throttled' if throttled else 'sent' if ok else 'failed'
+        with self.cond:
+            self.results.append({'phone': phone, 'status': status, 'error': error,
+                                 'messageId': message_id, 'at': datetime.now().isoformat()})
+            if skipped:
+                self.skipped += 1
+            elif throttled:
+                self.throttled += 1
+            elif ok:
+                self.sent += 1
+            else:
+                self.failed += 1
+            self.cond.notify_all()
+
+    def finish(self, status):
+        with self.cond:
+            self.status = status
+            self.finished = time.monotonic()
+            self.cond.notify_all()
+
+    def progress(self):
+        with self.cond:
+            done = self.sent + self.failed + self.skipped + self.throttled
+            elapsed = ((self.finished or time.monotonic()) - self.started) if self.started else 0
+            return {
+                'id': self.id,
+                'status': self.status,
+                'template': self.template['name'],
+                'total': len(self.recipients),
+                'done': done,
+                'sent': self.sent,
+                'failed': self.failed,
+                'skipped': self.skipped,
+                'throttled': self.throttled,
+                'percent': round(done * 100 / len(self.recipients), 1) if self.recipients else 100,
+                'elapsedSeconds': round(elapsed, 2),
+                'throughput': round(done / elapsed, 2) if elapsed else 0,
+                'concurrency': self.concurrency,
+                'rateLimit': self.rate,
+                'createdAt': self.created_at,
+            }
+
+
+class BroadcastManager:
+    """Runs broadcast jobs with bounded concurrency and a messages-per-second cap
+
+    send(phone, template) delivers one template message, where template is
+    {'name', 'language', 'components'}, and returns a truthy value on
+    success; a string is the provider message id, passed to
+    on_sent(phone, template, message_id). A send that raises SendThrottled
+    never reached the provider; it is retried up to throttle_retries times
+    and then recorded as throttled rather than failed. Recipients for whom
+    opted_out(phone) is true are skipped. Jobs run one at a time
+    so the throughput cap holds across jobs; finished jobs are kept for
+    inspection up to keep_jobs.
+    """
+
+    def __init__(self, send, on_sent=None, opted_out=None, concurrency=BROADCAST_CONCURRENCY, rate=BROADCAST_RATE,
+                 keep_jobs=BROADCAST_KEEP_JOBS, throttle_retries=BROADCAST_THROTTLE_RETRIES):
+        self.send = send
+        self.on_sent = on_sent
+        self.opted_out = opted_out
+        self.concurrency = concurrency
+        self.rate = rate
+        self.keep_jobs = keep_jobs
+        self.throttle_retries = throttle_retries
+        self.jobs = {}  # id -> BroadcastJob, oldest first
+        self._pending = []
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._thread = None
+
+    def create(self, recipients, name, language='en_US', parameters=None, concurrency=None, rate=None):
+        """Queue a broadcast, raises ValueError unless concurrency and rate are positive or None"""
+        concurrency = parse_limit(concurrency, int)
+        rate = parse_limit(rate)
+        template = {'name': name, 'language': language, 'parameters': parameters}
+        job = BroadcastJob(
+            recipients,
+            template,
+            self.concurrency if concurrency is None else min(concurrency, self.concurrency),
+            self.rate if rate is None else min(rate, self.rate),
+        )
+        with self._lock:
+            self.jobs[job.id] = job
+            finished = [j for j in self.jobs.values() if j.status in (DONE, CANCELLED)]
+            for old in finished[:max(0, len(self.jobs) - self.keep_jobs)]:
+                del self.jobs[old.id]
+            self._pending.append(job)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='broadcast', daemon=True)
+                self._thread.start()
+            self._wake.notify()
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def list(self):
+        with self._lock:
+            jobs = list(self.jobs.values())
+        return [job.progress() for job in reversed(jobs)]
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is None or job.status in (DONE, CANCELLED):
+            return False
+        job.cancelled.set()
+        with self._lock:
+            if job in self._pending:
+                self._pending.remove(job)
+                job.finish(CANCELLED)
+        return True
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._pending:
+                    self._wake.wait()
+                job = self._pending.pop(0)
+            self._run_job(job)
+
+    def _run_job(self, job):
+        with job.cond:
+            job.status = RUNNING
+            job.started = time.monotonic()
+        recipients = iter(job.recipients)
+        pace_lock = threading.Lock()
+        interval = 1.0 / job.rate if job.rate > 0 else 0
+        next_slot = [time.monotonic()]
+
+        def worker():
+            while not job.cancelled.is_set():
+                with pace_lock:
+                    recipient = next(recipients, None)
+                if recipient is None:
+                    return
+                # Opted-out recipients don't use a send slot
+                if self.opted_out and self.opted_out(recipient[0]):
+                    job.record(recipient[0], False, 'opted out', skipped=True)
+                    continue
+                with pace_lock:
+                    # Space sends evenly so the job never exceeds job.rate messages per second
+                    now = time.monotonic()
+                    slot = max(now, next_slot[0])
+                    next_slot[0] = slot + interval
+                if slot > now:
+                    time.sleep(slot - now)
+                phone, parameters = recipient
+                template = {
+                    'name': job.template['name'],
+                    'language': job.template['language'],
+                    'components': body_components(parameters or job.template['parameters']),
+                }
+                for attempt in range(self.throttle_retries + 1):
+                    throttled = False
+                    try:
+                        ok = self.send(phone, template)
+                        error = None if ok else 'rejected by provider'
+                    except SendThrottled as e:
+                        # Waited for outbound budget and got none, the provider never saw it
+                        ok, error, throttled = False, str(e), True
+                        if job.cancelled.is_set():
+                            break
+                        continue
+                    except Exception as e:
+                        ok, error = False, str(e)
+                    break
+                message_id = ok if isinstance(ok, str) else None
+                job.record(phone, bool(ok), error, message_id, throttled=throttled)
+                if ok and self.on_sent:
+                    try:
+                        self.on_sent(phone, template, message_id)
+                    except Exception as e:
+                        print(f"Broadcast on_sent error for {phone}: {e}")
+
+        threads = [threading.Thread(target=worker, name=f"broadcast-{job.id}-{i}", daemon=True)
+                   for i in range(min(job.concurrency, len(job.recipients)) or 1)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        job.finish(CANCELLED if job.cancelled.is_set() else DONE)
+        print(f"Broadcast {job.id} {job.status}: {job.sent} sent, {job.failed} failed, {job.skipped} skipped, "
+              f"{job.throttled} throttled")
+
+
+def stream_events(job, heartbeat=1.0):
+    """Server-sent events for a job: a 'result' per recipient, 'progress' every heartbeat, then 'done'"""
+    def event(name, payload):
+        return f"event: {name}\ndata: {json.dumps(payload)}\n\n"
+
+    cursor = 0
+    yield event('progress', job.progress())
+    while True:
+        with job.cond:
+            if cursor == len(job.results) and job.status not in (DONE, CANCELLED):
+                job.cond.wait(heartbeat)
+            new = job.results[cursor:]
+            cursor += len(new)
+            finished = job.status in (DONE, CANCELLED) and cursor == len(job.results)
+        for result in new:
+            yield event('result', result)
+        yield event('progress', job.progress())
+        if finished:
+            yield event('done', job.progress())
+            return
@@ -0,0 +1,84 @@
+import heapq
+import os
+import threading
+import time
+
+BURST_WINDOW_SECONDS = float(os.getenv('BURST_WINDOW_SECONDS', 2.0))
+BURST_MAX_WAIT_SECONDS = float(os.getenv('BURST_MAX_WAIT_SECONDS', 6.0))
+
+
+class BurstCoalescer:
+    """Debounces rapid consecutive messages from one contact into a single flush
+
+    Each message restarts the contact's quiet window; once no new message
+    arrives for `window` seconds (or `max_wait` seconds after the first one)
+    on_flush(phone, texts, keys) is called once with every collected message
+    and the keys they were added with.
+    A single timer thread serves all contacts.
+    """
+
+    def __init__(self, on_flush, window=BURST_WINDOW_SECONDS, max_wait=BURST_MAX_WAIT_SECONDS):
+        self.on_flush = on_flush
+        self.window = window
+        self.max_wait = max(max_wait, window)
+        self._pending = {}  # phone -> {'texts': [...], 'keys': [...], 'first': t, 'deadline': t}
+        self._heap = []  # (deadline, phone), may hold stale deadlines
+        self._cond = threading.Condition()
+        self._thread = None
+        self.messages = 0
+        self.flushes = 0
+        self.errors = 0
+
+    def add(self, phone, text, key=None):
+        now = time.monotonic()
+        with self._cond:
+            self.messages += 1
+            burst = self._pending.get(phone)
+            if burst is None:
+                burst = {'texts': [], 'keys': [], 'first': now}
+                self._pending[phone] = burst
+            burst['texts'].append(text)
+            burst['keys'].append(key)
+            burst['deadline'] = min(now + self.window, burst['first'] + self.max_wait)
+            heapq.heappush(self._heap, (burst['deadline'], phone))
+            self._start()
+            self._cond.notify()
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='burst-coalescer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    if self._heap and self._heap[0][0] <= now:
+                        deadline, phone = heapq.heappop(self._heap)
+                        burst = self._pending.get(phone)
+                        # Skip deadlines that a newer message has pushed back
+                        if burst is not None and burst['deadline'] == deadline:
+                            del self._pending[phone]
+                            self.flushes += 1
+                            break
+                        continue
+                    self._cond.wait(self._heap[0][0] - now if self._heap else None)
+            try:
+                self.on_flush(phone, burst['texts'], burst['keys'])
+            except Exception as e:
+                with self._cond:
+                    self.errors += 1
+                print(f"Burst flush error for {phone}: {e}")
+
+    def stats(self):
+        with self._cond:
+            return {
+                'windowSeconds': self.window,
+                'maxWaitSeconds': self.max_wait,
+                'pendingContacts': len(self._pending),
+                'messages': self.messages,
+                'flushes': self.flushes,
+                'callsSaved': self.messages - self.flushes - sum(len(b['texts']) for b in self._pending.values()),
+                'errors': self.errors,
+            }
@@ -4,10 +4,19 @@ import os
 import json
 from datetime import datetime
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import APITimeoutError, OpenAI
 
 load_dotenv()
 
+import tata_client
+from circuit_breaker import AI_FALLBACK_MODE, AI_FALLBACK_REPLY, AI_TIMEOUT_SECONDS, CircuitBreaker
+from faq_matcher import faq_answer
+from intent_router import OPT_IN, OPT_OUT, get_router, route_intent
+from model_tiers import ModelRouter
+from send_governor import PRIORITY_REPLY, PRIORITY_SEND, get_governor
+from message_dedup import DedupIndex, message_key
+from webhook_parser import parse_webhook
+
 app = Flask(__name__)
 
 # Configuration
@@ -20,6 +29,13 @@ client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
 chats = {}
 ai_enabled_chats = set()
 
+webhook_dedup = DedupIndex()
+model_router = ModelRouter()
+ai_breaker = CircuitBreaker()
+send_governor = get_governor()
+handoff_queue = []
+opted_out = set()
+
 def fetch_recent_chats():
     """Fetch recent conversations from Tata Telecom WhatsApp API"""
     try:
@@ -30,10 +46,10 @@ def fetch_recent_chats():
         }
         
         # Try to get phone number settings first to verify connection
-        settings_url = "https://wb.omni.tatatelebusiness.com/whatsapp-cloud/settings"
+        settings_url = "/whatsapp-cloud/settings"
         print(f"Testing API connection with settings endpoint...")
         
-        response = requests.get(settings_url, headers=headers)
+        response = tata_client.get(settings_url, headers=headers)
         print(f"Settings API Response: {response.status_code} - {response.text}")
         
         if response.status_code == 200:
@@ -60,13 +76,13 @@ def fetch_recent_chats():
 def get_phone_settings():
     """Get WhatsApp phone number settings to verify API connection"""
     try:
-        url = "https://wb.omni.tatatelebusiness.com/whatsapp-cloud/settings"
+        url = "/whatsapp-cloud/settings"
         headers = {
             'Authorization': WHATSAPP_TOKEN,
             'Content-Type': 'application/json'
         }
         
-        response = requests.get(url, headers=headers)
+        response = tata_client.get(url, headers=headers)
         if response.status_code == 200:
             settings = response.json()
             print(f"Phone settings: {json.dumps(settings, indent=2)}")
@@ -107,6 +123,22 @@ def get_chats():
         'ai_enabled': list(ai_enabled_chats)
     })
 
+@app.route('/api/dedup-stats')
+def get_dedup_stats():
+    return jsonify(webhook_dedup.stats())
+
+@app.route('/api/ai-stats')
+def get_ai_stats():
+    return jsonify({'intents': get_router().stats(), 'models': model_router.stats(), 'breaker': ai_breaker.stats(), 'handoffs': len(handoff_queue)})
+
+@app.route('/api/handoffs')
+def get_handoffs():
+    return jsonify({'handoffs': handoff_queue})
+
+@app.route('/api/send-stats')
+def get_send_stats():
+    return jsonify(send_governor.stats())
+
 @app.route('/api/send', methods=['POST'])
 def send_manual_message():
     try:
@@ -116,6 +148,8 @@ def send_manual_message():
         
         if not phone or not message:
             return jsonify({'success': False, 'error': 'Phone and message required'})
+        if phone in opted_out:
+            return jsonify({'success': False, 'error': f"{phone} has opted out"}), 409
         
         success = send_whatsapp_message(phone, message)
         if success:
@@ -163,8 +197,11 @@ def simulate_message():
         
         # Auto-reply if AI is enabled
         if phone in ai_enabled_chats:
-            ai_response = get_ai_response(message)
-            add_message(phone, ai_response, 'sent', 'ai')
+            ai_response, template = get_ai_response(message, phone)
+            if template:
+                add_message(phone, f"Template {template} sent", 'sent', 'template')
+            elif ai_response is not None:
+                add_message(phone, ai_response, 'sent', 'ai')
     
     return jsonify({'success': True})
 
@@ -184,11 +221,16 @@ def handle_webhook():
     print(f"Webhook received: {json.dumps(data, indent=2)}")
     
     # Extract message from Tata Telecom format
-    phone = extract_phone(data)
-    message_text = extract_message(data)
+    event = parse_webhook(data)
+    phone = event.phone if event else None
+    message_text = event.text if event else None
     
     print(f"Extracted - Phone: {phone}, Message: {message_text}")
     
+    if event and webhook_dedup.seen(message_key(event.message_id, phone, message_text, event.timestamp)):
+        print(f"Duplicate webhook for {phone} ignored")
+        return jsonify({'status': 'success'})
+    
     if phone and message_text:
         add_message(phone, message_text, 'received')
         print(f"Message added to chat for {phone}")
@@ -196,8 +238,11 @@ def handle_webhook():
         # Auto-reply if AI is enabled for this chat
         if phone in ai_enabled_chats:
             print(f"AI enabled for {phone}, generating response...")
-            ai_response = get_ai_response(message_text)
-            if send_whatsapp_message(phone, ai_response):
+            ai_response, template = get_ai_response(message_text, phone)
+            if template:
+                if send_whatsapp_template(phone, template, priority=PRIORITY_REPLY):
+                    add_message(phone, f"Template {template} sent", 'sent', 'template')
+            elif ai_response is not None and send_whatsapp_message(phone, ai_response, priority=PRIORITY_REPLY):
                 add_message(phone, ai_response, 'sent', 'ai')
                 print(f"AI response sent: {ai_response}")
     else:
@@ -205,31 +250,6 @@ def handle_webhook():
     
     return jsonify({'status': 'success'})
 
-def extract_phone(data):
-    # Handle Tata Telecom webhook format from the API docs
-    # Format: {"messages": {"from": "919999999999", ...}}
-    if data.get('messages'):
-        return data.get('messages', {}).get('from')
-    # Format: {"contacts": [{"wa_id": "919999999999"}]}
-    if data.get('contacts'):
-        contacts = data.get('contacts', [])
-        if contacts and len(contacts) > 0:
-            return contacts[0].get('wa_id')
-    # Direct format: {"from": "919999999999"}
-    return data.get('from')
-
-def extract_message(data):
-    # Handle Tata Telecom webhook format from the API docs
-    # Format: {"messages": {"text": {"body": "message"}, "type": "text"}}
-    if data.get('messages'):
-        msg = data.get('messages', {})
-        if msg.get('text') and msg.get('text', {}).get('body'):
-            return msg.get('text', {}).get('body')
-    # Direct format for testing
-    if data.get('text') and data.get('text', {}).get('body'):
-        return data.get('text', {}).get('body')
-    return None
-
 def add_message(phone, message, direction, source='user'):
     if phone not in chats:
         chats[phone] = []
@@ -241,23 +261,63 @@ def add_message(phone, message, direction, source='user'):
         'timestamp': datetime.now().isoformat()
     })
 
-def get_ai_response(message):
+def get_ai_response(message, phone=None):
+    """Reply to a customer message as (text, template name)
+
+    The template is set instead of the text for intents answered with one;
+    both are None when the contact has opted out.
+    """
+    # Greetings, STOP and other simple intents get a fixed reply
+    intent = route_intent(message)
+    if phone is not None:
+        if intent is not None and intent.name == OPT_IN:
+            opted_out.discard(phone)
+        elif phone in opted_out:
+            return None, None
+        elif intent is not None and intent.name == OPT_OUT:
+            # The confirmation is still sent, it's the last message the contact gets
+            opted_out.add(phone)
+    if intent is not None:
+        return (None, intent.template) if intent.template else (intent.reply, None)
+    
+    # Known questions are answered from the local FAQ without calling OpenAI
+    canned = faq_answer(message)
+    if canned:
+        return canned, None
+    
+    if not ai_breaker.allow():
+        return get_fallback_response(message, phone, 'circuit open'), None
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
+        response = model_router.complete(
+            client.chat.completions.create,
+            model_router.choose(message),
+            [
                 {"role": "system", "content": "You are a helpful WhatsApp assistant. Keep responses brief and friendly."},
                 {"role": "user", "content": message}
             ],
-            max_tokens=150
+            timeout=AI_TIMEOUT_SECONDS
         )
-        return response.choices[0].message.content
-    except:
-        return "Sorry, I'm having trouble responding right now."
-
-def send_whatsapp_message(to, message):
+    except Exception as e:
+        timed_out = isinstance(e, APITimeoutError)
+        ai_breaker.record_failure(timeout=timed_out)
+        print(f"OpenAI call failed: {e}")
+        return get_fallback_response(message, phone, 'timeout' if timed_out else 'error'), None
+    ai_breaker.record_success()
+    return response.choices[0].message.content, None
+
+def get_fallback_response(message, phone, reason):
+    if AI_FALLBACK_MODE == 'human' and phone:
+        handoff_queue.append({
+            'phone': phone,
+            'message': message,
+            'reason': reason,
+            'timestamp': datetime.now().isoformat()
+        })
+    return AI_FALLBACK_REPLY
+
+def send_whatsapp_message(to, message, priority=PRIORITY_SEND):
     """Send WhatsApp message using Tata Telecom API"""
-    url = "https://wb.omni.tatatelebusiness.com/whatsapp-cloud/messages"
+    url = tata_client.MESSAGES_URL
     
     # Correct headers format for Tata Telecom API
     headers = {
@@ -281,7 +341,8 @@ def send_whatsapp_message(to, message):
         print(f"Headers: {headers}")
         print(f"Payload: {json.dumps(payload, indent=2)}")
         
-        response = requests.post(url, headers=headers, json=payload)
+        send_governor.acquire(to, priority)
+        response = tata_client.post(url, headers=headers, json=payload)
         print(f"Response status: {response.status_code}")
         print(f"Response headers: {dict(response.headers)}")
         print(f"Response body: {response.text}")
@@ -318,6 +379,30 @@ def send_whatsapp_message(to, message):
         print(f"Unexpected error sending message: {e}")
         return False
 
+def send_whatsapp_template(to, template_name, language='en_US', priority=PRIORITY_SEND):
+    """Send an approved WhatsApp template using Tata Telecom API"""
+    headers = {
+        'Authorization': WHATSAPP_TOKEN,  # Direct token, not Bearer
+        'Content-Type': 'application/json'
+    }
+    payload = {
+        "to": to,
+        "type": "template",
+        "template": {
+            "name": template_name,
+            "language": {"code": language}
+        }
+    }
+    
+    try:
+        send_governor.acquire(to, priority)
+        response = tata_client.post(tata_client.MESSAGES_URL, headers=headers, json=payload)
+        print(f"Template {template_name} to {to}: {response.status_code} - {response.text}")
+        return response.status_code == 200
+    except Exception as e:
+        print(f"Error sending template {template_name} to {to}: {e}")
+        return False
+
 DASHBOARD_HTML = '''
 <!DOCTYPE html>
 <html>
@@ -0,0 +1,98 @@
+import os
+import threading
+import time
+
+# Deadline of a single OpenAI call, and when to stop calling it at all
+AI_TIMEOUT_SECONDS = float(os.getenv('AI_TIMEOUT_SECONDS', 10))
+# Deadline of a whole AI reply: waiting for rate budget, retries and the calls themselves
+AI_DEADLINE_SECONDS = float(os.getenv('AI_DEADLINE_SECONDS', 30))
+AI_BREAKER_FAILURES = int(os.getenv('AI_BREAKER_FAILURES', 5))
+AI_BREAKER_RESET_SECONDS = float(os.getenv('AI_BREAKER_RESET_SECONDS', 30))
+# 'reply' only sends AI_FALLBACK_REPLY, 'human' also queues the message for an agent
+AI_FALLBACK_MODE = os.getenv('AI_FALLBACK_MODE', 'reply')
+AI_FALLBACK_REPLY = os.getenv(
+    'AI_FALLBACK_REPLY', "Thanks for your message! We're a little busy right now, a team member will get back to you shortly.")
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """Stops calling a dependency after consecutive failures
+
+    After `failure_threshold` failures or timeouts in a row the breaker opens
+    and allow() answers False for `reset_timeout` seconds. Then a single
+    probe call is let through (half-open): success closes the breaker,
+    failure opens it for another period.
+    """
+
+    def __init__(self, failure_threshold=AI_BREAKER_FAILURES, reset_timeout=AI_BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self._lock = threading.Lock()
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._probe_started = None
+        self.trips = 0
+        self.recoveries = 0
+        self.short_circuited = 0
+        self.successes = 0
+        self.failures = 0
+        self.timeouts = 0
+
+    def allow(self):
+        """True when a call may go ahead, counts it as short-circuited otherwise"""
+        now = time.monotonic()
+        with self._lock:
+            if self.state == OPEN and now - self._opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self._probe_started = None
+            if self.state == HALF_OPEN:
+                # One probe at a time, a probe that never reported back is replaced after reset_timeout
+                if self._probe_started is None or now - self._probe_started >= self.reset_timeout:
+                    self._probe_started = now
+                    return True
+            elif self.state == CLOSED:
+                return True
+            self.short_circuited += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.successes += 1
+            self._consecutive = 0
+            if self.state != CLOSED:
+                self.state = CLOSED
+                self.recoveries += 1
+                print("Circuit breaker closed, AI path restored")
+
+    def record_failure(self, timeout=False):
+        with self._lock:
+            self.failures += 1
+            if timeout:
+                self.timeouts += 1
+            self._consecutive += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self._consecutive >= self.failure_threshold):
+                self.state = OPEN
+                self._opened_at = time.monotonic()
+                self.trips += 1
+                print(f"Circuit breaker opened after {self._consecutive} consecutive failure(s)")
+
+    def stats(self):
+        with self._lock:
+            retry_in = self._opened_at + self.reset_timeout - time.monotonic() if self.state == OPEN else 0
+            return {
+                'state': self.state,
+                'consecutiveFailures': self._consecutive,
+                'failureThreshold': self.failure_threshold,
+                'resetSeconds': self.reset_timeout,
+                'retryInSeconds': round(max(0.0, retry_in), 1),
+                'trips': self.trips,
+                'recoveries': self.recoveries,
+                'shortCircuited': self.short_circuited,
+                'successes': self.successes,
+                'failures': self.failures,
+                'timeouts': self.timeouts,
+            }
@@ -0,0 +1,64 @@
+import zlib
+
+from worker_pool import WorkerPool, percentile_ms
+
+
+class LaneScheduler:
+    """Runs jobs in per-contact order while different contacts run in parallel
+
+    Each phone number is hashed onto one of `lanes` single-threaded worker
+    pools, so all jobs for a contact execute strictly in submission order.
+    """
+
+    def __init__(self, lanes=4, max_queue=1000, name='lane'):
+        self.lanes = [
+            WorkerPool(workers=1, max_queue=max(1, max_queue // lanes), name=f"{name}-{i}")
+            for i in range(lanes)
+        ]
+
+    def lane_for(self, key):
+        return zlib.crc32(str(key).encode('utf-8')) % len(self.lanes)
+
+    def submit(self, key, fn, *args, **kwargs):
+        """Queue a job on the key's lane, returns False when that lane is full"""
+        return self.lanes[self.lane_for(key)].submit(fn, *args, **kwargs)
+
+    def has_capacity(self, key):
+        return self.lanes[self.lane_for(key)].has_capacity()
+
+    def join(self):
+        for lane in self.lanes:
+            lane.join()
+
+    def stats(self):
+        lane_stats = [lane.stats() for lane in self.lanes]
+        latencies = []
+        run_times = []
+        for lane in self.lanes:
+            lane_latencies, lane_run_times = lane.latency_samples()
+            latencies.extend(lane_latencies)
+            run_times.extend(lane_run_times)
+        latencies.sort()
+
+        totals = {key: sum(s[key] for s in lane_stats)
+                  for key in ('queueDepth', 'maxQueue', 'inFlight', 'submitted', 'completed', 'failed', 'rejected')}
+        totals.update({
+            'workers': len(self.lanes),
+            'latencyMs': {
+                'p50': percentile_ms(latencies, 50),
+                'p95': percentile_ms(latencies, 95),
+                'max': percentile_ms(latencies, 100),
+            },
+            'avgRunMs': round(sum(run_times) / len(run_times) * 1000, 1) if run_times else 0,
+            'lanes': [{
+                'lane': i,
+                'queueDepth': s['queueDepth'],
+                'maxQueue': s['maxQueue'],
+                'inFlight': s['inFlight'],
+                'completed': s['completed'],
+                'failed': s['failed'],
+                'rejected': s['rejected'],
+                'latencyMs': s['latencyMs'],
+            } for i, s in enumerate(lane_stats)],
+        })
+        return totals
@@ -0,0 +1,133 @@
+import os
+import threading
+from collections import OrderedDict
+
+import conversation_store
+
+CONTEXT_MAX_TURNS = int(os.getenv('CONTEXT_MAX_TURNS', 10))
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', 1000))
+CONTEXT_TRANSCRIPT_TOKENS = int(os.getenv('CONTEXT_TRANSCRIPT_TOKENS', 200))
+CONTEXT_TRANSCRIPT_CONTACTS = int(os.getenv('CONTEXT_TRANSCRIPT_CONTACTS', 10000))
+
+# Extra history read past the turn window so turns that just fell out of it reach the transcript
+_TRANSCRIPT_LOOKBACK = 20
+# Per-message overhead of the chat format (role, separators)
+_MESSAGE_OVERHEAD = 4
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding('o200k_base')
+except Exception:
+    _encoding = None
+
+
+def estimate_tokens(text):
+    """Token count of text, exact with tiktoken installed, ~4 characters per token otherwise"""
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return max(1, (len(text) + 3) // 4)
+
+
+def _transcript_line(message):
+    speaker = 'Customer' if message['type'] == 'received' else 'Assistant'
+    text = ' '.join(message['text'].split())
+    if len(text) > 120:
+        text = text[:117] + '...'
+    return f"{speaker}: {text}"
+
+
+class ContextBuilder:
+    """Builds the chat messages for an AI reply within a token budget
+
+    The newest turns go in verbatim, newest first, until either max_turns or
+    token_budget is reached. Turns older than that go into a per-contact
+    transcript of one truncated line per turn, extended as turns leave the
+    window; its oldest lines drop off once it is over transcript_tokens, so
+    prompt size stays bounded however long a conversation runs. Nothing is
+    paraphrased, the transcript is an abridged record of the earlier turns.
+    """
+
+    def __init__(self, max_turns=CONTEXT_MAX_TURNS, token_budget=CONTEXT_TOKEN_BUDGET,
+                 transcript_tokens=CONTEXT_TRANSCRIPT_TOKENS, max_contacts=CONTEXT_TRANSCRIPT_CONTACTS):
+        self.max_turns = max_turns
+        self.token_budget = token_budget
+        self.transcript_tokens = transcript_tokens
+        self.max_contacts = max_contacts
+        self._transcripts = OrderedDict()  # phone -> {'upto': message id, 'lines': [...], 'tokens': n}
+        self._lock = threading.Lock()
+
+    def build(self, phone, system_prompt):
+        """[system, transcript?, ...recent turns] for the contact's latest message"""
+        history = conversation_store.recent_messages(phone, self.max_turns + _TRANSCRIPT_LOOKBACK)
+        # Room for the transcript is reserved up front, it never grows past transcript_tokens
+        budget = (self.token_budget - estimate_tokens(system_prompt) - _MESSAGE_OVERHEAD
+                  - self.transcript_tokens - _MESSAGE_OVERHEAD)
+
+        window = []
+        for message in reversed(history):
+            cost = estimate_tokens(message['text']) + _MESSAGE_OVERHEAD
+            # Always keep the message being answered, even if it is over budget on its own
+            if window and (len(window) >= self.max_turns or cost > budget):
+                break
+            window.append(message)
+            budget -= cost
+        window.reverse()
+
+        older = history[:len(history) - len(window)]
+        transcript = self._extend_transcript(phone, older) if older else self._transcript(phone)
+
+        messages = [{'role': 'system', 'content': system_prompt}]
+        if transcript:
+            messages.append({'role': 'system', 'content': f"Earlier in this conversation (abridged):\n{transcript}"})
+        for message in window:
+            role = 'user' if message['type'] == 'received' else 'assistant'
+            messages.append({'role': role, 'content': message['text']})
+        return messages
+
+    def _transcript(self, phone):
+        with self._lock:
+            state = self._transcripts.get(phone)
+            if state is None:
+                return None
+            self._transcripts.move_to_end(phone)
+            return '\n'.join(state['lines'])
+
+    def _extend_transcript(self, phone, older):
+        """Add turns that left the window to the contact's transcript"""
+        with self._lock:
+            state = self._transcripts.get(phone)
+            if state is None:
+                state = {'upto': 0, 'lines': [], 'tokens': 0}
+                self._transcripts[phone] = state
+                while len(self._transcripts) > self.max_contacts:
+                    self._transcripts.popitem(last=False)
+            self._transcripts.move_to_end(phone)
+
+            for message in older:
+                if message['id'] <= state['upto']:
+                    continue
+                line = _transcript_line(message)
+                state['lines'].append(line)
+                state['tokens'] += estimate_tokens(line)
+                state['upto'] = message['id']
+
+            # Oldest lines drop off first once the transcript is over its budget
+            while len(state['lines']) > 1 and state['tokens'] > self.transcript_tokens:
+                state['tokens'] -= estimate_tokens(state['lines'].pop(0))
+            return '\n'.join(state['lines']) or None
+
+    def forget(self, phone):
+        with self._lock:
+            self._transcripts.pop(phone, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'maxTurns': self.max_turns,
+                'tokenBudget': self.token_budget,
+                'transcriptTokens': self.transcript_tokens,
+                'transcriptContacts': len(self._transcripts),
+                'tokenizer': 'tiktoken' if _encoding is not None else 'estimate',
+            }
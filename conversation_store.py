@@ -0,0 +1,460 @@
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import message_stats
+from worker_pool import percentile_ms
+
+# SQLite conversation storage shared by every worker process
+DATABASE_PATH = os.getenv('DATABASE_PATH', 'whatsapp_crm.db')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    phone TEXT NOT NULL,
+    text TEXT NOT NULL,
+    type TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    source TEXT,
+    provider_id TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_messages_phone_timestamp ON messages (phone, timestamp);
+
+CREATE TABLE IF NOT EXISTS contacts (
+    phone TEXT PRIMARY KEY,
+    name TEXT,
+    last_seen TEXT,
+    total_interactions INTEGER NOT NULL DEFAULT 0,
+    message_count INTEGER NOT NULL DEFAULT 0,
+    last_text TEXT,
+    last_type TEXT,
+    last_message TEXT,
+    chat_timestamp TEXT,
+    last_activity TEXT NOT NULL DEFAULT ''
+);
+
+-- Messages waiting for a human agent because the AI path was unavailable
+CREATE TABLE IF NOT EXISTS handoffs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    phone TEXT NOT NULL,
+    text TEXT NOT NULL,
+    reason TEXT,
+    timestamp TEXT NOT NULL,
+    resolved INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_handoffs_resolved ON handoffs (resolved, id);
+
+-- Contacts who replied STOP, nothing is sent to them until they reply START
+CREATE TABLE IF NOT EXISTS opt_outs (
+    phone TEXT PRIMARY KEY,
+    timestamp TEXT NOT NULL
+);
+
+-- Latest delivery receipt per sent message, keyed by the provider's message id
+CREATE TABLE IF NOT EXISTS message_status (
+    provider_id TEXT PRIMARY KEY,
+    phone TEXT,
+    status TEXT NOT NULL,
+    rank INTEGER NOT NULL,
+    sent_at REAL,
+    delivered_at REAL,
+    read_at REAL,
+    failed_at REAL,
+    error TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_message_status_sent_at ON message_status (sent_at);
+
+-- Running totals maintained on write so stats never scan the messages table
+CREATE TABLE IF NOT EXISTS counters (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL DEFAULT 0
+);
+'''
+
+INDEXES = '''
+CREATE INDEX IF NOT EXISTS idx_contacts_last_activity ON contacts (last_activity);
+'''
+
+# Statements are kept as constants so sqlite3's per-connection statement cache reuses them
+INSERT_MESSAGE = 'INSERT INTO messages (phone, text, type, timestamp, source, provider_id) VALUES (?, ?, ?, ?, ?, ?)'
+TOUCH_CONTACT_MESSAGE = '''
+INSERT INTO contacts (phone, message_count, last_text, last_type, last_activity) VALUES (?, 1, ?, ?, ?)
+ON CONFLICT(phone) DO UPDATE SET
+    message_count = message_count + 1,
+    last_text = excluded.last_text,
+    last_type = excluded.last_type,
+    last_activity = excluded.last_activity
+'''
+RECORD_CONTACT = '''
+INSERT INTO contacts (phone, name, last_seen, total_interactions, last_activity) VALUES (?, ?, ?, 1, ?3)
+ON CONFLICT(phone) DO UPDATE SET
+    name = excluded.name,
+    last_seen = excluded.last_seen,
+    total_interactions = total_interactions + 1,
+    last_activity = excluded.last_activity
+'''
+UPDATE_CHAT = '''
+INSERT INTO contacts (phone, last_message, chat_timestamp, last_activity) VALUES (?, ?, ?, ?3)
+ON CONFLICT(phone) DO UPDATE SET
+    last_message = excluded.last_message,
+    chat_timestamp = excluded.chat_timestamp,
+    last_activity = excluded.last_activity
+'''
+SELECT_MESSAGES = '''
+SELECT m.text, m.type, m.timestamp, s.status FROM messages m
+LEFT JOIN message_status s ON s.provider_id = m.provider_id
+WHERE m.phone = ?
+ORDER BY m.timestamp, m.id
+'''
+SELECT_RECENT_MESSAGES = '''
+SELECT id, text, type, timestamp, source FROM messages WHERE phone = ?
+ORDER BY timestamp DESC, id DESC
+LIMIT ?
+'''
+SELECT_CHATS = '''
+SELECT phone, last_message, chat_timestamp, message_count FROM contacts
+WHERE chat_timestamp IS NOT NULL
+'''
+# Served straight from idx_contacts_last_activity, so a page costs O(limit)
+SELECT_CONTACTS_PAGE = '''
+SELECT phone, name, last_seen, total_interactions, message_count, last_text, last_type, chat_timestamp
+FROM contacts
+ORDER BY last_activity DESC
+LIMIT ? OFFSET ?
+'''
+COUNT_CONTACTS = 'SELECT COUNT(*) FROM contacts'
+INCREMENT_COUNTER = '''
+INSERT INTO counters (key, value) VALUES (?, ?)
+ON CONFLICT(key) DO UPDATE SET value = value + excluded.value
+'''
+SELECT_COUNTERS = 'SELECT key, value FROM counters'
+INSERT_HANDOFF = 'INSERT INTO handoffs (phone, text, reason, timestamp) VALUES (?, ?, ?, ?)'
+SELECT_OPEN_HANDOFFS = '''
+SELECT id, phone, text, reason, timestamp FROM handoffs
+WHERE resolved = 0
+ORDER BY id
+LIMIT ?
+'''
+RESOLVE_HANDOFF = 'UPDATE handoffs SET resolved = 1 WHERE id = ? AND resolved = 0'
+INSERT_OPT_OUT = 'INSERT INTO opt_outs (phone, timestamp) VALUES (?, ?) ON CONFLICT(phone) DO NOTHING'
+DELETE_OPT_OUT = 'DELETE FROM opt_outs WHERE phone = ?'
+SELECT_OPT_OUT = 'SELECT 1 FROM opt_outs WHERE phone = ?'
+# Receipts can arrive out of order or before the send is recorded: the status only moves
+# forward, each timestamp keeps its first value and a read receipt stands in for a missing delivered one
+UPSERT_STATUS = '''
+INSERT INTO message_status (provider_id, phone, status, rank, sent_at, delivered_at, read_at, failed_at, error, updated_at)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(provider_id) DO UPDATE SET
+    phone = COALESCE(message_status.phone, excluded.phone),
+    status = CASE WHEN excluded.rank > message_status.rank THEN excluded.status ELSE message_status.status END,
+    rank = MAX(message_status.rank, excluded.rank),
+    sent_at = COALESCE(message_status.sent_at, excluded.sent_at),
+    delivered_at = MIN(COALESCE(message_status.delivered_at, excluded.delivered_at),
+                       COALESCE(excluded.delivered_at, message_status.delivered_at)),
+    read_at = COALESCE(message_status.read_at, excluded.read_at),
+    failed_at = COALESCE(message_status.failed_at, excluded.failed_at),
+    error = COALESCE(excluded.error, message_status.error),
+    updated_at = excluded.updated_at
+'''
+COUNT_STATUS_SINCE = 'SELECT status, COUNT(*) FROM message_status WHERE sent_at >= ? GROUP BY status'
+SELECT_LATENCIES_SINCE = '''
+SELECT delivered_at - sent_at, read_at - sent_at FROM message_status
+WHERE sent_at >= ? AND delivered_at IS NOT NULL
+ORDER BY sent_at DESC
+LIMIT ?
+'''
+
+# Delivery receipt states in the order they can follow each other
+STATUS_RANKS = {'sent': 1, 'delivered': 2, 'read': 3, 'failed': 4}
+
+_local = threading.local()
+_init_lock = threading.Lock()
+_initialized = set()
+
+
+def get_connection():
+    """Per-thread connection in WAL mode"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(DATABASE_PATH, timeout=30, cached_statements=256)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        _local.conn = conn
+    return conn
+
+
+def init_db():
+    """Create tables and indexes if they don't exist yet"""
+    with _init_lock:
+        if DATABASE_PATH in _initialized:
+            return
+        conn = get_connection()
+        conn.executescript(SCHEMA)
+        _migrate(conn)
+        conn.executescript(INDEXES)
+        conn.commit()
+        _initialized.add(DATABASE_PATH)
+
+
+def _migrate(conn):
+    """Add columns introduced after a database was first created"""
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(contacts)')}
+    if 'last_activity' not in columns:
+        conn.execute("ALTER TABLE contacts ADD COLUMN last_activity TEXT NOT NULL DEFAULT ''")
+        conn.execute("UPDATE contacts SET last_activity = COALESCE(last_seen, chat_timestamp, '')")
+
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(messages)')}
+    if 'source' not in columns:
+        conn.execute('ALTER TABLE messages ADD COLUMN source TEXT')
+    if 'provider_id' not in columns:
+        conn.execute('ALTER TABLE messages ADD COLUMN provider_id TEXT')
+
+    # Seed the running totals from messages stored before counters existed
+    if conn.execute('SELECT COUNT(*) FROM counters').fetchone()[0] == 0:
+        counts = {}
+        for msg_type, source, count in conn.execute(
+                'SELECT type, source, COUNT(*) FROM messages GROUP BY type, source'):
+            source = source or ('user' if msg_type == 'received' else 'manual')
+            for key in message_stats.message_keys(msg_type, source):
+                counts[key] = counts.get(key, 0) + count
+        conn.executemany(INCREMENT_COUNTER, counts.items())
+
+
+def add_message(phone, text, msg_type, source=None, timestamp=None, provider_id=None):
+    """Store a message, update the contact's last message and the running totals
+
+    source is 'user' for received messages and 'ai', 'manual' or 'template'
+    for sent ones. provider_id is the id the provider returned for a sent
+    message, its delivery receipts are tracked from then on.
+    """
+    source = source or ('user' if msg_type == 'received' else 'manual')
+    timestamp = timestamp or datetime.now().isoformat()
+    keys = message_stats.message_keys(msg_type, source)
+    conn = get_connection()
+    with conn:
+        conn.execute(INSERT_MESSAGE, (phone, text, msg_type, timestamp, source, provider_id))
+        conn.execute(TOUCH_CONTACT_MESSAGE, (phone, text, msg_type, timestamp))
+        conn.executemany(INCREMENT_COUNTER, [(key, 1) for key in keys])
+        if provider_id:
+            now = time.time()
+            conn.execute(UPSERT_STATUS, (provider_id, phone, 'sent', STATUS_RANKS['sent'], now, None, None, None, None, now))
+    message_stats.recent.add(keys)
+
+
+def record_contact(phone, name=None):
+    """Remember a contact that reached us through the webhook"""
+    conn = get_connection()
+    with conn:
+        conn.execute(RECORD_CONTACT, (phone, name or 'Unknown', datetime.now().isoformat()))
+
+
+def record_inbound(events):
+    """Store contacts and messages of a whole webhook batch in one transaction
+
+    events are webhook_parser.InboundEvent objects; ones without text only
+    update the contact.
+    """
+    now = datetime.now().isoformat()
+    contacts = [(event.phone, event.name or 'Unknown', now) for event in events]
+    messages = [(event.phone, event.text, 'received', now, 'user', None) for event in events if event.text]
+    touches = [(event.phone, event.text, 'received', now) for event in events if event.text]
+    keys = message_stats.message_keys('received', 'user')
+    conn = get_connection()
+    with conn:
+        conn.executemany(RECORD_CONTACT, contacts)
+        conn.executemany(INSERT_MESSAGE, messages)
+        conn.executemany(TOUCH_CONTACT_MESSAGE, touches)
+        if messages:
+            conn.executemany(INCREMENT_COUNTER, [(key, len(messages)) for key in keys])
+    if messages:
+        message_stats.recent.add(keys, len(messages))
+
+
+def update_chat(phone, last_message):
+    """Mark a chat as active with its latest message"""
+    conn = get_connection()
+    with conn:
+        conn.execute(UPDATE_CHAT, (phone, last_message, datetime.now().isoformat()))
+
+
+def get_messages(phone):
+    """Messages of a contact, oldest first; sent ones carry their latest delivery status"""
+    rows = get_connection().execute(SELECT_MESSAGES, (phone,)).fetchall()
+    return [{'text': row['text'], 'type': row['type'], 'timestamp': row['timestamp'], 'status': row['status']}
+            for row in rows]
+
+
+def recent_messages(phone, limit=10):
+    """Latest `limit` messages of a contact, oldest first"""
+    rows = get_connection().execute(SELECT_RECENT_MESSAGES, (phone, limit)).fetchall()
+    return [dict(row) for row in reversed(rows)]
+
+
+def list_chats():
+    rows = get_connection().execute(SELECT_CHATS).fetchall()
+    return [{
+        'phone': row['phone'],
+        'lastMessage': row['last_message'] or 'No messages',
+        'timestamp': row['chat_timestamp'] or '',
+        'messageCount': row['message_count']
+    } for row in rows]
+
+
+def list_contacts(limit=100, offset=0):
+    """A page of contacts, most recently active first"""
+    rows = get_connection().execute(SELECT_CONTACTS_PAGE, (limit, offset)).fetchall()
+    return [dict(row) for row in rows]
+
+
+def count_contacts():
+    return get_connection().execute(COUNT_CONTACTS).fetchone()[0]
+
+
+def record_send(success):
+    """Count the outcome of one outbound send attempt"""
+    keys = message_stats.send_keys(success)
+    conn = get_connection()
+    with conn:
+        conn.executemany(INCREMENT_COUNTER, [(key, 1) for key in keys])
+    message_stats.recent.add(keys)
+
+
+def get_counters():
+    """All-time running totals, keyed like message_stats.message_keys()"""
+    return dict(get_connection().execute(SELECT_COUNTERS).fetchall())
+
+
+def queue_handoff(phone, text, reason=None):
+    """Queue a customer message for a human agent"""
+    conn = get_connection()
+    with conn:
+        conn.execute(INSERT_HANDOFF, (phone, text, reason, datetime.now().isoformat()))
+
+
+def list_handoffs(limit=100):
+    """Unresolved handoffs, oldest first"""
+    rows = get_connection().execute(SELECT_OPEN_HANDOFFS, (limit,)).fetchall()
+    return [dict(row) for row in rows]
+
+
+def resolve_handoff(handoff_id):
+    """Mark a handoff as handled, False if it doesn't exist or was already resolved"""
+    conn = get_connection()
+    with conn:
+        return conn.execute(RESOLVE_HANDOFF, (handoff_id,)).rowcount > 0
+
+
+def set_opted_out(phone, opted_out=True):
+    """Record a STOP (or with opted_out=False a START) from a contact"""
+    conn = get_connection()
+    with conn:
+        if opted_out:
+            conn.execute(INSERT_OPT_OUT, (phone, datetime.now().isoformat()))
+        else:
+            conn.execute(DELETE_OPT_OUT, (phone,))
+
+
+def is_opted_out(phone):
+    return get_connection().execute(SELECT_OPT_OUT, (phone,)).fetchone() is not None
+
+
+def _epoch(timestamp, default):
+    try:
+        return float(timestamp)
+    except (TypeError, ValueError):
+        return default
+
+
+def record_statuses(events):
+    """Apply a batch of webhook_parser.StatusEvent receipts, returns how many were known states"""
+    now = time.time()
+    rows = []
+    for event in events:
+        rank = STATUS_RANKS.get(event.status)
+        if rank is None:
+            continue
+        at = _epoch(event.timestamp, now)
+        rows.append((
+            event.message_id,
+            event.recipient,
+            event.status,
+            rank,
+            at if event.status == 'sent' else None,
+            at if event.status in ('delivered', 'read') else None,  # read implies delivered
+            at if event.status == 'read' else None,
+            at if event.status == 'failed' else None,
+            event.error,
+            now,
+        ))
+    if rows:
+        conn = get_connection()
+        with conn:
+            conn.executemany(UPSERT_STATUS, rows)
+    return len(rows)
+
+
+def delivery_stats(hours=24, sample=5000):
+    """Delivery outcome of messages sent in the last `hours` and receipt latency of the newest `sample`"""
+    since = time.time() - hours * 3600
+    conn = get_connection()
+    counts = dict(conn.execute(COUNT_STATUS_SINCE, (since,)).fetchall())
+    delivered_latencies, read_latencies = [], []
+    for delivered, read in conn.execute(SELECT_LATENCIES_SINCE, (since, sample)):
+        delivered_latencies.append(max(0.0, delivered))
+        if read is not None:
+            read_latencies.append(max(0.0, read))
+    delivered_latencies.sort()
+    read_latencies.sort()
+
+    tracked = sum(counts.values())
+    delivered = counts.get('delivered', 0) + counts.get('read', 0)
+    return {
+        'windowHours': hours,
+        'tracked': tracked,
+        'pending': counts.get('sent', 0),
+        'delivered': delivered,
+        'read': counts.get('read', 0),
+        'failed': counts.get('failed', 0),
+        'deliveryRate': round(delivered * 100 / tracked, 1) if tracked else None,
+        'readRate': round(counts.get('read', 0) * 100 / tracked, 1) if tracked else None,
+        'deliveryLatencyMs': {
+            'p50': percentile_ms(delivered_latencies, 50),
+            'p95': percentile_ms(delivered_latencies, 95),
+            'p99': percentile_ms(delivered_latencies, 99),
+        },
+        'readLatencyMs': {
+            'p50': percentile_ms(read_latencies, 50),
+            'p95': percentile_ms(read_latencies, 95),
+            'p99': percentile_ms(read_latencies, 99),
+        },
+    }
+
+
+def chat_stats(active_chats, hours=24):
+    """Dashboard totals for /api/chats, with the delivery outcome of the last `hours`"""
+    # Running counters maintained on write, no scan over stored messages
+    totals = message_stats.summarize(get_counters())
+    windows = message_stats.windowed_summary()
+    delivery = delivery_stats(hours)
+    # Share of sent messages the provider reported delivered, the accepted-send rate until receipts arrive
+    success_rate = delivery['deliveryRate']
+    if success_rate is None:
+        success_rate = windows['lastDay']['successRate']
+    if success_rate is None:
+        success_rate = totals['successRate']
+    return {
+        'totalMessages': totals['totalMessages'],
+        'activeChats': active_chats,
+        'aiResponses': totals['bySource']['ai'],
+        'successRate': success_rate,
+        'delivery': delivery,
+        'received': totals['received'],
+        'sent': totals['sent'],
+        'bySource': totals['bySource'],
+        'lastHour': windows['lastHour'],
+        'lastDay': windows['lastDay']
+    }
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the OpenAI chat completions API, for load and latency tests
+
+Point the bot at it instead of the real API:
+    OPENAI_BASE_URL=http://localhost:8080/v1 python app.py
+
+It also accepts Tata message sends, so TATA_BASE_URL=http://localhost:8080
+keeps the whole pipeline offline.
+
+Usage: python fake_openai_server.py [--port 8080] [--latency lognormal:0.8,0.4]
+           [--error-rate 0.01] [--rate-limit-rate 0.05] [--retry-after 1]
+           [--responses responses.json]
+
+Latency distributions (seconds):
+    fixed:0.5            always 0.5
+    uniform:0.2,1.5      between 0.2 and 1.5
+    normal:0.8,0.2       mean 0.8, standard deviation 0.2
+    lognormal:0.8,0.4    median 0.8 with a long tail, sigma 0.4
+"""
+
+import argparse
+import itertools
+import json
+import math
+import os
+import random
+import threading
+import time
+
+from flask import Flask, jsonify, request
+
+DEFAULT_RESPONSES = [
+    "Hi! Thanks for reaching out. How can I help you today?",
+    "Sure, I can help with that. Could you share a few more details?",
+    "Thanks for your patience! Our team will look into this right away.",
+    "You're welcome! Let me know if there's anything else I can do.",
+]
+
+app = Flask(__name__)
+
+config = {
+    'latency': 'fixed:0',
+    'error_rate': 0.0,
+    'rate_limit_rate': 0.0,
+    'retry_after': 1.0,
+    'responses': DEFAULT_RESPONSES,
+}
+
+_lock = threading.Lock()
+_ids = itertools.count(1)
+_counts = {'requests': 0, 'ok': 0, 'errors': 0, 'rateLimited': 0, 'tataSends': 0}
+_latency_total = 0.0
+
+
+def parse_latency(spec):
+    """Sampler for a latency spec like 'lognormal:0.8,0.4'"""
+    kind, _, args = spec.partition(':')
+    values = [float(v) for v in args.split(',')] if args else []
+    if kind == 'fixed':
+        return lambda: values[0] if values else 0.0
+    if kind == 'uniform':
+        return lambda: random.uniform(values[0], values[1])
+    if kind == 'normal':
+        return lambda: max(0.0, random.gauss(values[0], values[1]))
+    if kind == 'lognormal':
+        return lambda: random.lognormvariate(math.log(values[0]), values[1])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+def _count(key, latency=0.0):
+    global _latency_total
+    with _lock:
+        _counts[key] += 1
+        _latency_total += latency
+
+
+def _estimate_tokens(text):
+    return max(1, len(text or '') // 4)
+
+
+@app.route('/v1/chat/completions', methods=['POST'])
+def chat_completions():
+    body = request.get_json(silent=True) or {}
+    with _lock:
+        _counts['requests'] += 1
+
+    # Injected 429s come back at once, like the real rate limiter
+    if random.random() < config['rate_limit_rate']:
+        _count('rateLimited')
+        response = jsonify({'error': {
+            'message': 'Rate limit reached for requests (fake server)',
+            'type': 'requests',
+            'code': 'rate_limit_exceeded',
+        }})
+        response.headers['retry-after'] = str(config['retry_after'])
+        response.headers['x-ratelimit-remaining-requests'] = '0'
+        return response, 429
+
+    latency = config['sampler']()
+    time.sleep(latency)
+
+    if random.random() < config['error_rate']:
+        _count('errors', latency)
+        return jsonify({'error': {'message': 'The server had an error (fake server)', 'type': 'server_error'}}), 500
+
+    messages = body.get('messages') or []
+    content = random.choice(config['responses'])
+    prompt_tokens = sum(_estimate_tokens(m.get('content')) + 4 for m in messages)
+    completion_tokens = _estimate_tokens(content)
+    _count('ok', latency)
+    return jsonify({
+        'id': f"chatcmpl-fake-{next(_ids)}",
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': body.get('model', 'gpt-4o-mini'),
+        'choices': [{
+            'index': 0,
+            'message': {'role': 'assistant', 'content': content},
+            'finish_reason': 'stop',
+        }],
+        'usage': {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens,
+        },
+    })
+
+
+@app.route('/v1/models', methods=['GET'])
+def list_models():
+    return jsonify({'object': 'list', 'data': [{'id': 'gpt-4o-mini', 'object': 'model', 'owned_by': 'fake'}]})
+
+
+@app.route('/whatsapp-cloud/messages', methods=['POST'])
+def tata_send():
+    """Accepts outbound sends when TATA_BASE_URL points here"""
+    _count('tataSends')
+    to = (request.get_json(silent=True) or {}).get('to')
+    # Same shape as the real send response, tata_client.message_id() reads messages[0].id
+    return jsonify({
+        'messaging_product': 'whatsapp',
+        'contacts': [{'input': to, 'wa_id': to}],
+        'messages': [{'id': f"wamid.fake-{next(_ids)}"}],
+    })
+
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    with _lock:
+        served = _counts['ok'] + _counts['errors']
+        return jsonify({
+            **_counts,
+            'avgLatencyMs': round(_latency_total / served * 1000, 1) if served else 0,
+            'config': {k: v for k, v in config.items() if k not in ('sampler', 'responses')},
+        })
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake OpenAI chat completions server')
+    parser.add_argument('--port', type=int, default=int(os.getenv('FAKE_OPENAI_PORT', 8080)))
+    parser.add_argument('--latency', default=os.getenv('FAKE_OPENAI_LATENCY', 'lognormal:0.8,0.4'))
+    parser.add_argument('--error-rate', type=float, default=float(os.getenv('FAKE_OPENAI_ERROR_RATE', 0)))
+    parser.add_argument('--rate-limit-rate', type=float, default=float(os.getenv('FAKE_OPENAI_429_RATE', 0)))
+    parser.add_argument('--retry-after', type=float, default=float(os.getenv('FAKE_OPENAI_RETRY_AFTER', 1)))
+    parser.add_argument('--responses', default=os.getenv('FAKE_OPENAI_RESPONSES'),
+                        help='JSON file with a list of canned replies')
+    args = parser.parse_args()
+
+    config.update(
+        latency=args.latency,
+        sampler=parse_latency(args.latency),
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+    )
+    if args.responses:
+        with open(args.responses, encoding='utf-8') as f:
+            config['responses'] = json.load(f)
+
+    print(f"Fake OpenAI server on http://localhost:{args.port}/v1 "
+          f"(latency {args.latency}, errors {args.error_rate:.0%}, 429s {args.rate_limit_rate:.0%})")
+    app.run(host='0.0.0.0', port=args.port, threaded=True)
+
+
+config['sampler'] = parse_latency(config['latency'])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+import json
+import math
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+# FAQ answers are off until this file exists, faq.example.json shows the format
+FAQ_PATH = os.getenv('FAQ_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'faq.json'))
+FAQ_MIN_SCORE = float(os.getenv('FAQ_MIN_SCORE', 0.75))
+
+_TOKEN = re.compile(r'\w+')
+
+
+def tokenize(text):
+    return _TOKEN.findall(text.lower())
+
+
+class FaqMatcher:
+    """TF-IDF cosine matcher over canned question/answer pairs
+
+    Every question variant is a row of an L2-normalized TF-IDF matrix, so a
+    lookup is one small matrix-vector product over the columns of the
+    message's known words. Unknown words still count towards the message
+    norm, which keeps long or unrelated messages below the threshold.
+    """
+
+    def __init__(self, entries, min_score=FAQ_MIN_SCORE):
+        self.min_score = min_score
+        self.entries = entries
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.total_seconds = 0.0
+        self.hits_by_id = {}
+
+        rows = []  # (entry index, token counts) per question variant
+        vocabulary = {}
+        for index, entry in enumerate(entries):
+            for question in entry['questions']:
+                counts = {}
+                for token in tokenize(question):
+                    counts[token] = counts.get(token, 0) + 1
+                    vocabulary.setdefault(token, len(vocabulary))
+                rows.append((index, counts))
+
+        self.vocabulary = vocabulary
+        self.row_entries = np.array([index for index, _ in rows], dtype=np.int32)
+
+        document_frequency = np.zeros(len(vocabulary), dtype=np.float32)
+        for _, counts in rows:
+            for token in counts:
+                document_frequency[vocabulary[token]] += 1
+        # Smoothed idf, unknown words get the idf of a word seen in no question
+        self.idf = np.log((1 + len(rows)) / (1 + document_frequency)) + 1
+        self.unknown_idf = math.log(1 + len(rows)) + 1
+
+        matrix = np.zeros((len(rows), len(vocabulary)), dtype=np.float32)
+        for row, (_, counts) in enumerate(rows):
+            for token, count in counts.items():
+                matrix[row, vocabulary[token]] = count
+        matrix *= self.idf
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        self.matrix = matrix / norms
+
+    @classmethod
+    def load(cls, path=FAQ_PATH, min_score=FAQ_MIN_SCORE):
+        with open(path, encoding='utf-8') as f:
+            return cls(json.load(f), min_score=min_score)
+
+    def match(self, text):
+        """(entry, score) of the closest question, or (None, best score) below the threshold"""
+        start = time.perf_counter()
+        counts = {}
+        for token in tokenize(text):
+            counts[token] = counts.get(token, 0) + 1
+
+        best_entry = None
+        best_score = 0.0
+        if counts and len(self.matrix):
+            columns = []
+            weights = []
+            unknown = 0.0
+            for token, count in counts.items():
+                column = self.vocabulary.get(token)
+                if column is None:
+                    unknown += (count * self.unknown_idf) ** 2
+                else:
+                    columns.append(column)
+                    weights.append(count * self.idf[column])
+            if columns:
+                weights = np.array(weights, dtype=np.float32)
+                norm = math.sqrt(float(weights @ weights) + unknown)
+                scores = self.matrix[:, columns] @ weights / norm
+                row = int(scores.argmax())
+                best_score = float(scores[row])
+                if best_score >= self.min_score:
+                    best_entry = self.entries[self.row_entries[row]]
+
+        with self._lock:
+            self.lookups += 1
+            self.total_seconds += time.perf_counter() - start
+            if best_entry is not None:
+                self.hits += 1
+                entry_id = best_entry.get('id', best_entry['questions'][0])
+                self.hits_by_id[entry_id] = self.hits_by_id.get(entry_id, 0) + 1
+        return best_entry, best_score
+
+    def answer(self, text):
+        """Canned answer for a message, or None when no question is close enough"""
+        entry, score = self.match(text)
+        return entry['answer'] if entry else None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self.entries),
+                'questions': len(self.row_entries),
+                'minScore': self.min_score,
+                'lookups': self.lookups,
+                'hits': self.hits,
+                'hitRate': round(self.hits * 100 / self.lookups, 1) if self.lookups else 0,
+                'avgMatchMicros': round(self.total_seconds / self.lookups * 1e6, 1) if self.lookups else 0,
+                'hitsByEntry': dict(self.hits_by_id),
+            }
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def get_matcher():
+    """Matcher over FAQ_PATH, loaded once; None if the file is missing or invalid"""
+    global _default
+    if _default is None:
+        with _default_lock:
+            if _default is None:
+                if not os.path.exists(FAQ_PATH):
+                    _default = FaqMatcher([])
+                    return None
+                try:
+                    _default = FaqMatcher.load()
+                    print(f"Loaded {len(_default.entries)} FAQ entries from {FAQ_PATH}")
+                except (OSError, ValueError, KeyError) as e:
+                    print(f"FAQ matcher disabled, could not load {FAQ_PATH}: {e}")
+                    _default = FaqMatcher([])
+    return _default if _default.entries else None
+
+
+def faq_answer(text):
+    """Canned answer for a message from the default knowledge base, or None"""
+    matcher = get_matcher()
+    return matcher.answer(text) if matcher else None
@@ -7,6 +7,8 @@ from openai import OpenAI
 
 load_dotenv()
 
+from model_tiers import ModelRouter
+
 app = Flask(__name__)
 
 # Configuration
@@ -15,6 +17,7 @@ OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 
 # OpenAI client
 client = OpenAI(api_key=OPENAI_API_KEY)
+model_router = ModelRouter()
 
 # In-memory storage
 chats_db = {}
@@ -240,13 +243,13 @@ def handle_webhook():
         
         try:
             # Get AI response
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
+            response = model_router.complete(
+                client.chat.completions.create,
+                model_router.choose(message_text),
+                [
                     {"role": "system", "content": "You are a helpful WhatsApp assistant. Keep responses brief and friendly."},
                     {"role": "user", "content": message_text}
-                ],
-                max_tokens=150
+                ]
             )
             
             ai_response = response.choices[0].message.content
@@ -0,0 +1,218 @@
+import json
+import os
+import re
+import threading
+import time
+
+# Optional JSON overrides per intent: {"greeting": {"reply": "...", "template": "welcome", "enabled": true}}
+INTENT_PATH = os.getenv('INTENT_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'intents.json'))
+# Keyword intents only fire on short messages, longer ones usually need the AI
+INTENT_MAX_TOKENS = int(os.getenv('INTENT_MAX_TOKENS', 12))
+
+_TOKEN = re.compile(r'\w+')
+
+# Handlers record these two, so a contact who sent STOP gets no further messages until START
+OPT_OUT = 'opt_out'
+OPT_IN = 'opt_in'
+
+# Checked in order, the first intent that matches wins. Patterns must match the whole
+# message when `full` is set, keyword phrases are matched on word boundaries anywhere.
+# An intent never matches a message containing one of its `unless` words or `unless_patterns`,
+# those need the AI.
+INTENTS = [
+    {
+        'name': OPT_OUT,
+        'patterns': [r'(?:stop(?:\s+all)?|unsubscribe|opt[\s-]*out)'],
+        'full': True,
+        'keywords': [],
+        'reply': "You've been unsubscribed and won't receive further messages from us. Reply START to subscribe again.",
+    },
+    {
+        'name': OPT_IN,
+        'patterns': [r'(?:start|unstop|subscribe|opt[\s-]*in)'],
+        'full': True,
+        'keywords': [],
+        'reply': "You're subscribed again and will receive our messages. Reply STOP to unsubscribe.",
+    },
+    {
+        'name': 'greeting',
+        'patterns': [r'(?:hi+|hello+|hey+|hiya|namaste|good\s+(?:morning|afternoon|evening))(?:\s+(?:there|team|all))?'],
+        'full': True,
+        'keywords': [],
+        'reply': "Hello! 👋 How can I help you today?",
+    },
+    {
+        'name': 'order_status',
+        # The reply asks for the order number, a message that already gives one goes to the AI
+        'unless_patterns': [r'\d{4,}'],
+        'unless': [
+            'cancel', 'refund', 'return', 'replace', 'exchange', 'broken', 'damaged', 'defective', 'wrong',
+            'missing', 'complaint', 'not working',
+        ],
+        'keywords': [
+            'where is my order', 'track my order', 'track order', 'order status', 'status of my order',
+            'where is my package', 'track my package', 'where is my parcel', 'delivery status',
+        ],
+        'reply': "Please share your order number and we'll check the latest status for you. "
+                 "You can also track it from the link in your order confirmation message.",
+    },
+    {
+        # Off until intents.json gives the real hours: {"business_hours": {"enabled": true, "reply": "..."}}
+        'name': 'business_hours',
+        'enabled': False,
+        'patterns': [r'\bwhat\s+time\s+do\s+you\s+(?:open|close)\b', r'\bare\s+you\s+open\b'],
+        'keywords': [
+            'business hours', 'opening hours', 'working hours', 'office hours', 'store hours',
+            'when are you open', 'when do you open', 'when do you close', 'timings',
+        ],
+        'reply': "",
+    },
+]
+
+
+class Intent:
+    """A matched intent: deterministic reply text and an optional template to send instead"""
+
+    __slots__ = ('name', 'reply', 'template')
+
+    def __init__(self, name, reply, template=None):
+        self.name = name
+        self.reply = reply
+        self.template = template
+
+    def to_dict(self):
+        return {'name': self.name, 'reply': self.reply, 'template': self.template}
+
+
+def tokenize(text):
+    return _TOKEN.findall(text.lower())
+
+
+class IntentRouter:
+    """Matches simple messages to fixed intents before any AI call
+
+    Keyword phrases live in a word-level trie, so a message is scanned once
+    from each word position whatever the number of phrases; regexes are
+    compiled once up front. Match counts are kept per intent.
+    """
+
+    def __init__(self, intents, max_tokens=INTENT_MAX_TOKENS):
+        self.max_tokens = max_tokens
+        self.intents = {}
+        self._order = []  # intent names by priority
+        self._full_patterns = []  # (priority, name, regex) that must match the whole message
+        self._search_patterns = []  # (priority, name, regex) found anywhere
+        self._trie = {}  # word -> child node, '$' -> (priority, name) at the end of a phrase
+        self._unless = []  # (name, regex) of words that rule the intent out
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.total_seconds = 0.0
+        self.matches = {}
+
+        intents = [spec for spec in intents if spec.get('enabled', True)]
+        for priority, spec in enumerate(intents):
+            name = spec['name']
+            self.intents[name] = Intent(name, spec['reply'], spec.get('template'))
+            self._order.append(name)
+            self.matches[name] = 0
+            for pattern in spec.get('patterns', ()):
+                if spec.get('full'):
+                    self._full_patterns.append((priority, name, re.compile(rf'\s*{pattern}\s*[.!?]*\s*', re.I)))
+                else:
+                    self._search_patterns.append((priority, name, re.compile(pattern, re.I)))
+            unless = [re.escape(word) for word in spec.get('unless', ())] + list(spec.get('unless_patterns', ()))
+            if unless:
+                self._unless.append((name, re.compile(r'\b(?:' + '|'.join(unless) + r')\b', re.I)))
+            for phrase in spec.get('keywords', ()):
+                node = self._trie
+                for word in tokenize(phrase):
+                    node = node.setdefault(word, {})
+                node['$'] = min(node.get('$', (priority, name)), (priority, name))
+
+    @classmethod
+    def load(cls, path=INTENT_PATH, max_tokens=INTENT_MAX_TOKENS):
+        """Router over INTENTS with replies, templates or enabled flags overridden from path"""
+        overrides = {}
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                overrides = json.load(f)
+        intents = [{**spec, **overrides.get(spec['name'], {})} for spec in INTENTS]
+        return cls(intents, max_tokens=max_tokens)
+
+    def route(self, text):
+        """The highest-priority Intent matching the message, or None"""
+        start = time.perf_counter()
+        excluded = {name for name, regex in self._unless if regex.search(text)}
+        best = None
+        for priority, name, regex in self._full_patterns:
+            if name not in excluded and regex.fullmatch(text):
+                best = (priority, name)
+                break
+
+        words = tokenize(text)
+        if len(words) <= self.max_tokens:
+            for priority, name, regex in self._search_patterns:
+                if (best is None or priority < best[0]) and name not in excluded and regex.search(text):
+                    best = (priority, name)
+            for i in range(len(words)):
+                node = self._trie
+                for word in words[i:]:
+                    node = node.get(word)
+                    if node is None:
+                        break
+                    if '$' in node and (best is None or node['$'] < best) and node['$'][1] not in excluded:
+                        best = node['$']
+
+        with self._lock:
+            self.lookups += 1
+            self.total_seconds += time.perf_counter() - start
+            if best is not None:
+                self.matches[best[1]] += 1
+        return self.intents[best[1]] if best else None
+
+    def opt_change(self, text):
+        """OPT_OUT or OPT_IN when the message is a STOP or START request, else None; not counted as a lookup"""
+        for _, name, regex in self._full_patterns:
+            if name in (OPT_OUT, OPT_IN) and regex.fullmatch(text):
+                return name
+        return None
+
+    def stats(self):
+        with self._lock:
+            matched = sum(self.matches.values())
+            return {
+                'intents': list(self._order),
+                'lookups': self.lookups,
+                'matched': matched,
+                'unmatched': self.lookups - matched,
+                'byIntent': dict(self.matches),
+                'avgRouteMicros': round(self.total_seconds / self.lookups * 1e6, 1) if self.lookups else 0,
+            }
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def get_router():
+    """Router over INTENTS with INTENT_PATH overrides, loaded once"""
+    global _default
+    if _default is None:
+        with _default_lock:
+            if _default is None:
+                try:
+                    _default = IntentRouter.load()
+                except (OSError, ValueError) as e:
+                    print(f"Could not load intent overrides from {INTENT_PATH}, using defaults: {e}")
+                    _default = IntentRouter(INTENTS)
+    return _default
+
+
+def route_intent(text):
+    """Intent for a message from the default router, or None when the AI should answer"""
+    return get_router().route(text)
+
+
+def opt_change(text):
+    """OPT_OUT or OPT_IN when the message is a STOP or START request, else None"""
+    return get_router().opt_change(text)
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Load test for the webhook pipeline, meant to run against fake_openai_server.py
+
+Sends `messages` Tata-format webhooks from `contacts` distinct numbers with
+`concurrency` parallel senders, reports acknowledgement latency and status
+codes, then polls /api/outbox until every reply has been delivered.
+
+Usage: python load_test_webhook.py [--url http://localhost:3000] [--messages 500]
+           [--contacts 50] [--concurrency 20]
+"""
+
+import argparse
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from worker_pool import percentile_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Webhook load test')
+    parser.add_argument('--url', default='http://localhost:3000')
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--contacts', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=20)
+    args = parser.parse_args()
+
+    session = requests.Session()
+    run = uuid.uuid4().hex[:8]
+
+    def send(i):
+        payload = {
+            'from': f"+9100000{i % args.contacts:05d}",
+            'id': f"load-{run}-{i}",
+            'text': {'body': f"Load test message {i}, please tell me something interesting"},
+            'timestamp': str(int(time.time())),
+        }
+        start = time.perf_counter()
+        try:
+            status = session.post(f"{args.url}/webhook", json=payload, timeout=30).status_code
+        except requests.RequestException:
+            status = 'error'
+        return status, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(send, range(args.messages)))
+    elapsed = time.perf_counter() - start
+
+    statuses = {}
+    for status, _ in results:
+        statuses[status] = statuses.get(status, 0) + 1
+    latencies = sorted(seconds for _, seconds in results)
+    print(f"Sent {args.messages} webhooks in {elapsed:.2f}s ({args.messages / elapsed:.0f}/s)")
+    print(f"  status codes: {statuses}")
+    print(f"  ack latency ms: p50 {percentile_ms(latencies, 50)}  p95 {percentile_ms(latencies, 95)}  "
+          f"p99 {percentile_ms(latencies, 99)}  max {percentile_ms(latencies, 100)}")
+
+    # Replies are generated in the background and delivered by the outbox, wait until every one is sent
+    while True:
+        try:
+            ai = session.get(f"{args.url}/api/ai-stats", timeout=10).json()
+            outbox = session.get(f"{args.url}/api/outbox", timeout=10).json()['outbox']
+            # async_app.py has no worker lanes, its in-flight count is in /api/ai-stats
+            response = session.get(f"{args.url}/api/worker-stats", timeout=10)
+            workers = response.json()['workers'] if response.status_code == 200 else None
+        except (requests.RequestException, KeyError, ValueError):
+            print("No /api/outbox on this server, not waiting for replies")
+            return
+        generating = ai.get('inFlight', 0) or (ai.get('bursts') or {}).get('pendingContacts')
+        if workers:
+            generating = generating or workers['queueDepth'] or workers['inFlight']
+        if not generating and not outbox['pending'] and not outbox['sending']:
+            break
+        time.sleep(0.5)
+    total = time.perf_counter() - start
+    print(f"All replies delivered after {total:.2f}s ({outbox['sent']} sent, {outbox['dead']} dead-lettered)")
+    if workers:
+        print(f"  AI jobs: {workers['completed']}, job latency ms p50 {workers['latencyMs']['p50']} "
+              f"p95 {workers['latencyMs']['p95']}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+DEDUP_TTL_SECONDS = int(os.getenv('DEDUP_TTL_SECONDS', 3600))
+DEDUP_MAX_ENTRIES = int(os.getenv('DEDUP_MAX_ENTRIES', 100000))
+
+
+def message_key(message_id=None, phone=None, text=None, timestamp=None):
+    """Dedup key for an inbound message
+
+    Uses the provider message id when present, otherwise a hash of
+    (from, body, timestamp). Without an id or a timestamp two identical
+    messages can't be told apart from a retry, so no key is returned.
+    """
+    if message_id:
+        return f"id:{message_id}"
+    if phone and text and timestamp:
+        digest = hashlib.sha1(f"{phone}\x1f{text}\x1f{timestamp}".encode('utf-8')).hexdigest()
+        return f"hash:{digest}"
+    return None
+
+
+class DedupIndex:
+    """Remembers recently seen message keys so webhook retries are processed once"""
+
+    def __init__(self, ttl=DEDUP_TTL_SECONDS, max_entries=DEDUP_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._seen = OrderedDict()  # key -> time first seen, oldest first
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.duplicates = 0
+        self.evicted = 0
+
+    def seen(self, key):
+        """Record key and return True if it was already seen within the TTL"""
+        if key is None:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            self.checked += 1
+            self._evict(now)
+            if key in self._seen:
+                self.duplicates += 1
+                return True
+            self._seen[key] = now
+            return False
+
+    def forget(self, key):
+        """Drop a key so a retry of that message is processed again"""
+        if key is None:
+            return
+        with self._lock:
+            self._seen.pop(key, None)
+
+    def _evict(self, now):
+        # Entries are inserted in time order, so expired ones are always at the front
+        while self._seen:
+            key, first_seen = next(iter(self._seen.items()))
+            if now - first_seen < self.ttl and len(self._seen) < self.max_entries:
+                break
+            self._seen.popitem(last=False)
+            self.evicted += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._seen),
+                'maxEntries': self.max_entries,
+                'ttlSeconds': self.ttl,
+                'checked': self.checked,
+                'duplicatesSuppressed': self.duplicates,
+                'evicted': self.evicted,
+            }
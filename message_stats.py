@@ -0,0 +1,75 @@
+import threading
+import time
+
+# Window name -> length in minutes
+WINDOWS = {'lastHour': 60, 'lastDay': 1440}
+
+
+class WindowedCounter:
+    """Per-minute counter buckets, summed over sliding windows of up to one day"""
+
+    def __init__(self, minutes=1440):
+        self.minutes = minutes
+        self._buckets = [None] * minutes  # slot -> (minute, {key: count})
+        self._lock = threading.Lock()
+
+    def add(self, keys, amount=1):
+        minute = int(time.time() // 60)
+        slot = minute % self.minutes
+        with self._lock:
+            bucket = self._buckets[slot]
+            if bucket is None or bucket[0] != minute:
+                bucket = (minute, {})
+                self._buckets[slot] = bucket
+            counts = bucket[1]
+            for key in keys:
+                counts[key] = counts.get(key, 0) + amount
+
+    def totals(self, minutes):
+        """Counts of every key over the last `minutes` minutes"""
+        oldest = int(time.time() // 60) - min(minutes, self.minutes) + 1
+        totals = {}
+        with self._lock:
+            for bucket in self._buckets:
+                if bucket is None or bucket[0] < oldest:
+                    continue
+                for key, count in bucket[1].items():
+                    totals[key] = totals.get(key, 0) + count
+        return totals
+
+
+# Recent activity of this process, the all-time totals live in conversation_store
+recent = WindowedCounter()
+
+
+def message_keys(direction, source):
+    return ('messages', direction, f"source:{source}")
+
+
+def send_keys(success):
+    return ('send_ok',) if success else ('send_failed',)
+
+
+def success_rate(counts):
+    """Percentage of successful sends, None when nothing was sent"""
+    attempts = counts.get('send_ok', 0) + counts.get('send_failed', 0)
+    if not attempts:
+        return None
+    return round(counts.get('send_ok', 0) * 100 / attempts, 1)
+
+
+def summarize(counts):
+    return {
+        'totalMessages': counts.get('messages', 0),
+        'received': counts.get('received', 0),
+        'sent': counts.get('sent', 0),
+        'bySource': {
+            source: counts.get(f"source:{source}", 0) for source in ('user', 'ai', 'manual', 'template')
+        },
+        'sendAttempts': counts.get('send_ok', 0) + counts.get('send_failed', 0),
+        'successRate': success_rate(counts),
+    }
+
+
+def windowed_summary():
+    return {name: summarize(recent.totals(minutes)) for name, minutes in WINDOWS.items()}
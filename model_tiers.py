@@ -0,0 +1,116 @@
+import os
+import re
+import threading
+import time
+from collections import deque
+
+from context_builder import estimate_tokens
+from worker_pool import percentile_ms
+
+# Model and reply length per tier; fast and deep default to AI_MODEL until a cheaper or
+# stronger model is configured, so only max_tokens differs out of the box
+AI_MODEL = os.getenv('AI_MODEL', 'gpt-4o-mini')
+AI_MAX_TOKENS = int(os.getenv('AI_MAX_TOKENS', 150))
+AI_FAST_MODEL = os.getenv('AI_FAST_MODEL', AI_MODEL)
+AI_FAST_MAX_TOKENS = int(os.getenv('AI_FAST_MAX_TOKENS', 80))
+AI_DEEP_MODEL = os.getenv('AI_DEEP_MODEL', AI_MODEL)
+AI_DEEP_MAX_TOKENS = int(os.getenv('AI_DEEP_MAX_TOKENS', 250))
+
+# Messages up to AI_TIER_SHORT_TOKENS go to the fast tier, ones over AI_TIER_LONG_TOKENS,
+# ones that need conversation context or mention a complex topic go to the deep tier
+AI_TIER_SHORT_TOKENS = int(os.getenv('AI_TIER_SHORT_TOKENS', 12))
+AI_TIER_LONG_TOKENS = int(os.getenv('AI_TIER_LONG_TOKENS', 60))
+AI_COMPLEX_KEYWORDS = os.getenv(
+    'AI_COMPLEX_KEYWORDS',
+    'why,explain,compare,difference,complaint,problem,issue,not working,broken,damaged,refund,cancel,wrong')
+
+FAST = 'fast'
+STANDARD = 'standard'
+DEEP = 'deep'
+
+
+class Tier:
+    __slots__ = ('name', 'model', 'max_tokens')
+
+    def __init__(self, name, model, max_tokens):
+        self.name = name
+        self.model = model
+        self.max_tokens = max_tokens
+
+
+class ModelRouter:
+    """Picks the model and max_tokens for a message and records usage per tier
+
+    Short, simple messages go to the fast tier; long ones, ones that need
+    the earlier conversation and ones mentioning a complex topic go to the
+    deep tier; everything else uses the standard tier.
+    """
+
+    def __init__(self, tiers=None, short_tokens=AI_TIER_SHORT_TOKENS, long_tokens=AI_TIER_LONG_TOKENS,
+                 complex_keywords=AI_COMPLEX_KEYWORDS):
+        tiers = tiers or [
+            Tier(FAST, AI_FAST_MODEL, AI_FAST_MAX_TOKENS),
+            Tier(STANDARD, AI_MODEL, AI_MAX_TOKENS),
+            Tier(DEEP, AI_DEEP_MODEL, AI_DEEP_MAX_TOKENS),
+        ]
+        self.tiers = {tier.name: tier for tier in tiers}
+        self.short_tokens = short_tokens
+        self.long_tokens = long_tokens
+        keywords = [re.escape(k.strip()) for k in complex_keywords.split(',') if k.strip()]
+        self._complex = re.compile(r'\b(?:' + '|'.join(keywords) + r')\b', re.I) if keywords else None
+        self._lock = threading.Lock()
+        self._usage = {name: {'calls': 0, 'errors': 0, 'promptTokens': 0, 'completionTokens': 0,
+                              'latencies': deque(maxlen=500)} for name in self.tiers}
+
+    def choose(self, text, needs_context=False):
+        tokens = estimate_tokens(text)
+        if needs_context or tokens > self.long_tokens or (self._complex and self._complex.search(text)):
+            return self.tiers[DEEP]
+        if tokens <= self.short_tokens:
+            return self.tiers[FAST]
+        return self.tiers[STANDARD]
+
+    def complete(self, create, tier, messages, **kwargs):
+        """create(model=..., messages=..., max_tokens=...) for the tier, timed and recorded"""
+        start = time.monotonic()
+        try:
+            response = create(model=tier.model, messages=messages, max_tokens=tier.max_tokens, **kwargs)
+        except Exception:
+            self.record(tier, time.monotonic() - start, None, ok=False)
+            raise
+        self.record(tier, time.monotonic() - start, getattr(response, 'usage', None))
+        return response
+
+    def record(self, tier, seconds, usage, ok=True):
+        with self._lock:
+            stats = self._usage[tier.name]
+            stats['calls'] += 1
+            stats['latencies'].append(seconds)
+            if not ok:
+                stats['errors'] += 1
+            if usage is not None:
+                stats['promptTokens'] += getattr(usage, 'prompt_tokens', 0) or 0
+                stats['completionTokens'] += getattr(usage, 'completion_tokens', 0) or 0
+
+    def stats(self):
+        tiers = {}
+        with self._lock:
+            for name, tier in self.tiers.items():
+                usage = self._usage[name]
+                latencies = sorted(usage['latencies'])
+                calls = usage['calls']
+                tiers[name] = {
+                    'model': tier.model,
+                    'maxTokens': tier.max_tokens,
+                    'calls': calls,
+                    'errors': usage['errors'],
+                    'promptTokens': usage['promptTokens'],
+                    'completionTokens': usage['completionTokens'],
+                    'avgTokens': round((usage['promptTokens'] + usage['completionTokens']) / calls, 1) if calls else 0,
+                    'latencyMs': {
+                        'p50': percentile_ms(latencies, 50),
+                        'p95': percentile_ms(latencies, 95),
+                        'max': percentile_ms(latencies, 100),
+                    },
+                }
+        return {'shortTokens': self.short_tokens, 'longTokens': self.long_tokens, 'tiers': tiers}
@@ -0,0 +1,282 @@
+import asyncio
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import deque
+
+from openai import APIConnectionError, InternalServerError, RateLimitError
+
+from context_builder import estimate_tokens
+from token_bucket import TokenBucket
+from worker_pool import percentile_ms
+
+OPENAI_RPM = int(os.getenv('OPENAI_RPM', 500))
+OPENAI_TPM = int(os.getenv('OPENAI_TPM', 200000))
+OPENAI_MAX_QUEUE = int(os.getenv('OPENAI_MAX_QUEUE', 1000))
+OPENAI_QUEUE_TIMEOUT = float(os.getenv('OPENAI_QUEUE_TIMEOUT', 60))
+OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', 3))
+# How often a queued acomplete() call checks whether it is admitted
+ASYNC_POLL_SECONDS = 0.05
+
+# Lower numbers are admitted first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+
+# Connection errors, timeouts and 5xx responses are retried with a short backoff like the SDK does
+_TRANSIENT_ERRORS = (APIConnectionError, InternalServerError)
+
+
+class SchedulerBusy(Exception):
+    """The completion could not be admitted before its queue timeout or the queue is full"""
+
+
+def retry_after_seconds(error, attempt):
+    """Delay requested by a 429 response, exponential backoff when it names none"""
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    for header, scale in (('retry-after-ms', 0.001), ('retry-after', 1.0)):
+        value = headers.get(header)
+        if value:
+            try:
+                return max(0.0, float(value) * scale)
+            except ValueError:
+                pass
+    return min(2 ** attempt, 30)
+
+
+def request_cost(kwargs):
+    """Tokens a completion request is charged up front: prompt estimate plus max_tokens"""
+    cost = sum(estimate_tokens(m.get('content')) + 4 for m in kwargs.get('messages', ()))
+    return cost + (kwargs.get('max_tokens') or 0)
+
+
+def clip_timeout(kwargs, timeout, deadline):
+    """Cap the request timeout at the time left before deadline"""
+    if deadline is not None:
+        remaining = deadline - time.monotonic()
+        kwargs['timeout'] = remaining if timeout is None else min(timeout, remaining)
+
+
+def transient_delay(attempt):
+    """Backoff before retrying a connection error or 5xx response"""
+    return min(0.5 * 2 ** attempt, 8)
+
+
+class OpenAIScheduler:
+    """Admits chat completions within requests-per-minute and tokens-per-minute budgets
+
+    Callers block in a priority queue until both token buckets can cover the
+    request (prompt estimate + max_tokens). A 429 pauses all admissions for
+    the Retry-After delay and the request is queued again, so bursts show
+    up as queue wait in stats() instead of errors. Connection errors and 5xx
+    responses are retried after a short backoff; either kind of retry is
+    made at most max_retries times. acomplete() is the same for an
+    AsyncOpenAI client.
+    """
+
+    def __init__(self, client, rpm=OPENAI_RPM, tpm=OPENAI_TPM, max_queue=OPENAI_MAX_QUEUE,
+                 queue_timeout=OPENAI_QUEUE_TIMEOUT, max_retries=OPENAI_MAX_RETRIES):
+        # Retries are made here, so a 429 pauses every caller instead of only retrying one
+        self.client = client.with_options(max_retries=0)
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.max_retries = max_retries
+        self._cond = threading.Condition()
+        self._waiting = []  # heap of (priority, seq)
+        self._seq = itertools.count()
+        self._paused_until = 0.0
+        self._queue_waits = deque(maxlen=500)
+        self.admitted = 0
+        self.admitted_background = 0
+        self.completed = 0
+        self.rate_limited = 0
+        self.retries = 0
+        self.error_retries = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.failed = 0
+
+    def complete(self, priority=PRIORITY_INTERACTIVE, deadline=None, **kwargs):
+        """chat.completions.create(**kwargs) once the rate budgets allow it
+
+        deadline (a time.monotonic() value) bounds the whole call: queueing,
+        retries and each attempt's timeout. SchedulerBusy is raised when it
+        passes before the request is admitted, the last error when it passes
+        before a retry.
+        """
+        cost = request_cost(kwargs)
+        timeout = kwargs.get('timeout')
+        for attempt in range(self.max_retries + 1):
+            self._admit(priority, cost, deadline)
+            clip_timeout(kwargs, timeout, deadline)
+            try:
+                response = self.client.chat.completions.create(**kwargs)
+            except Exception as e:
+                delay = self._retry_delay(e, attempt, deadline)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            return self._completed(response, cost)
+
+    async def acomplete(self, priority=PRIORITY_INTERACTIVE, deadline=None, **kwargs):
+        """complete() for a scheduler around an AsyncOpenAI client, waits without blocking the event loop"""
+        cost = request_cost(kwargs)
+        timeout = kwargs.get('timeout')
+        for attempt in range(self.max_retries + 1):
+            await self._aadmit(priority, cost, deadline)
+            clip_timeout(kwargs, timeout, deadline)
+            try:
+                response = await self.client.chat.completions.create(**kwargs)
+            except Exception as e:
+                delay = self._retry_delay(e, attempt, deadline)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            return self._completed(response, cost)
+
+    def _retry_delay(self, error, attempt, deadline):
+        """Seconds to wait before retrying after error, None when it isn't retried"""
+        if isinstance(error, RateLimitError):
+            delay = retry_after_seconds(error, attempt)
+            with self._cond:
+                self.rate_limited += 1
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                self._cond.notify_all()
+            print(f"OpenAI rate limited, pausing admissions for {delay:.1f}s")
+            if attempt == self.max_retries:
+                with self._cond:
+                    self.failed += 1
+                return None
+            with self._cond:
+                self.retries += 1
+            # The pause is waited out in the queue
+            return 0
+        if isinstance(error, _TRANSIENT_ERRORS):
+            delay = transient_delay(attempt)
+            if attempt == self.max_retries or (deadline is not None and time.monotonic() + delay >= deadline):
+                with self._cond:
+                    self.failed += 1
+                return None
+            with self._cond:
+                self.error_retries += 1
+            print(f"OpenAI request failed ({error}), retrying in {delay:.1f}s")
+            return delay
+        with self._cond:
+            self.failed += 1
+        return None
+
+    def _completed(self, response, cost):
+        usage = getattr(response, 'usage', None)
+        with self._cond:
+            self.completed += 1
+            if usage is not None and getattr(usage, 'total_tokens', None):
+                self.tokens.take(usage.total_tokens - cost)
+        return response
+
+    def _admit(self, priority, cost, deadline=None):
+        ticket = (priority, next(self._seq))
+        queued_at = time.monotonic()
+        deadline = min(queued_at + self.queue_timeout, deadline or float('inf'))
+        with self._cond:
+            self._enqueue(ticket)
+            try:
+                while True:
+                    wait = self._try_admit(ticket, cost, queued_at, deadline)
+                    if wait == 0:
+                        return
+                    self._cond.wait(wait)
+            except SchedulerBusy:
+                self._dequeue(ticket)
+                raise
+
+    async def _aadmit(self, priority, cost, deadline=None):
+        # Coroutines can't wait on the condition, they poll it instead
+        ticket = (priority, next(self._seq))
+        queued_at = time.monotonic()
+        deadline = min(queued_at + self.queue_timeout, deadline or float('inf'))
+        with self._cond:
+            self._enqueue(ticket)
+        try:
+            while True:
+                with self._cond:
+                    wait = self._try_admit(ticket, cost, queued_at, deadline)
+                if wait == 0:
+                    return
+                await asyncio.sleep(min(wait, ASYNC_POLL_SECONDS))
+        except BaseException:
+            # Also a cancelled coroutine gives up its place
+            with self._cond:
+                if ticket in self._waiting:
+                    self._dequeue(ticket)
+            raise
+
+    def _enqueue(self, ticket):
+        if len(self._waiting) >= self.max_queue:
+            self.rejected += 1
+            raise SchedulerBusy('OpenAI request queue is full')
+        heapq.heappush(self._waiting, ticket)
+
+    def _dequeue(self, ticket):
+        self._waiting.remove(ticket)
+        heapq.heapify(self._waiting)
+        self._cond.notify_all()
+
+    def _try_admit(self, ticket, cost, queued_at, deadline):
+        """0 once ticket is admitted, else seconds to wait before trying again; called holding _cond"""
+        now = time.monotonic()
+        if self._waiting[0] == ticket and now >= self._paused_until:
+            wait = max(self.requests.wait_time(1, now), self.tokens.wait_time(cost, now))
+            if wait == 0:
+                self.requests.take(1)
+                self.tokens.take(min(cost, self.tokens.capacity))
+                heapq.heappop(self._waiting)
+                self.admitted += 1
+                if ticket[0] >= PRIORITY_BACKGROUND:
+                    self.admitted_background += 1
+                self._queue_waits.append(now - queued_at)
+                self._cond.notify_all()
+                return 0
+        elif self._waiting[0] == ticket:
+            wait = self._paused_until - now
+        else:
+            wait = None  # woken when the head of the queue is admitted
+        if now >= deadline:
+            self.timed_out += 1
+            raise SchedulerBusy(f"OpenAI request not admitted within {deadline - queued_at:.1f}s")
+        return min(wait, deadline - now) if wait is not None else deadline - now
+
+    def stats(self):
+        with self._cond:
+            now = time.monotonic()
+            self.requests._refill(now)
+            self.tokens._refill(now)
+            waits = sorted(self._queue_waits)
+            return {
+                'rpm': int(self.requests.capacity),
+                'tpm': int(self.tokens.capacity),
+                'queued': len(self._waiting),
+                'maxQueue': self.max_queue,
+                'requestTokensLeft': int(self.requests.tokens),
+                'tokenBudgetLeft': int(self.tokens.tokens),
+                'pausedForSeconds': round(max(0.0, self._paused_until - now), 2),
+                'admitted': self.admitted,
+                'admittedBackground': self.admitted_background,
+                'completed': self.completed,
+                'rateLimited': self.rate_limited,
+                'retries': self.retries,
+                'errorRetries': self.error_retries,
+                'rejected': self.rejected,
+                'timedOut': self.timed_out,
+                'failed': self.failed,
+                'queueWaitMs': {
+                    'p50': percentile_ms(waits, 50),
+                    'p95': percentile_ms(waits, 95),
+                    'max': percentile_ms(waits, 100),
+                },
+            }
@@ -0,0 +1,322 @@
+import os
+import random
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import conversation_store
+from worker_pool import WorkerPool
+
+OUTBOX_WORKERS = int(os.getenv('OUTBOX_WORKERS', 4))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 6))
+OUTBOX_BASE_DELAY = float(os.getenv('OUTBOX_BASE_DELAY', 2))
+OUTBOX_MAX_DELAY = float(os.getenv('OUTBOX_MAX_DELAY', 300))
+OUTBOX_POLL_SECONDS = float(os.getenv('OUTBOX_POLL_SECONDS', 1))
+# A send claimed this long ago by a worker that died is handed out again
+OUTBOX_CLAIM_TIMEOUT = float(os.getenv('OUTBOX_CLAIM_TIMEOUT', 120))
+
+PENDING = 'pending'
+SENDING = 'sending'
+SENT = 'sent'
+DEAD = 'dead'
+CANCELLED = 'cancelled'
+# Source of the STOP confirmation, the one message still delivered to a contact who opted out
+OPT_OUT_SOURCE = 'opt_out'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    idempotency_key TEXT NOT NULL UNIQUE,
+    phone TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    body TEXT NOT NULL,
+    history_text TEXT NOT NULL,
+    source TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    claimed_at REAL,
+    last_error TEXT,
+    created_at TEXT NOT NULL,
+    sent_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_status_due ON outbox (status, next_attempt_at);
+'''
+
+INSERT_OUTBOX = '''
+INSERT INTO outbox (idempotency_key, phone, kind, body, history_text, source, next_attempt_at, created_at)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(idempotency_key) DO NOTHING
+'''
+SELECT_BY_KEY = 'SELECT id, status FROM outbox WHERE idempotency_key = ?'
+SELECT_DUE = '''
+SELECT id, idempotency_key, phone, kind, body, history_text, source, attempts FROM outbox
+WHERE status = 'pending' AND next_attempt_at <= ?
+ORDER BY next_attempt_at
+LIMIT ?
+'''
+CLAIM = "UPDATE outbox SET status = 'sending', claimed_at = ? WHERE id = ? AND status = 'pending'"
+# A contact can reply STOP after a message was queued for them
+CANCEL_OPTED_OUT = '''
+UPDATE outbox SET status = 'cancelled', last_error = 'recipient opted out'
+WHERE status = 'pending' AND next_attempt_at <= ? AND source != ?
+AND phone IN (SELECT phone FROM opt_outs)
+'''
+RELEASE_STALE = "UPDATE outbox SET status = 'pending' WHERE status = 'sending' AND claimed_at < ?"
+DEFER = "UPDATE outbox SET next_attempt_at = ? WHERE id = ? AND status = 'pending'"
+# The claim is restamped when the send starts and every later update checks it is still
+# ours, so a row released as stale and claimed again is never marked by both senders
+START_SEND = "UPDATE outbox SET claimed_at = ? WHERE id = ? AND status = 'sending' AND claimed_at = ?"
+MARK_SENT = '''
+UPDATE outbox SET status = 'sent', attempts = attempts + 1, sent_at = ?, last_error = NULL
+WHERE id = ? AND status = 'sending' AND claimed_at = ?
+'''
+MARK_RETRY = '''
+UPDATE outbox SET status = ?, attempts = attempts + 1, next_attempt_at = ?, last_error = ?
+WHERE id = ? AND status = 'sending' AND claimed_at = ?
+'''
+REQUEUE_DEAD = "UPDATE outbox SET status = 'pending', attempts = 0, next_attempt_at = ? WHERE id = ? AND status = 'dead'"
+NEXT_DUE = "SELECT MIN(next_attempt_at) FROM outbox WHERE status = 'pending'"
+COUNT_BY_STATUS = 'SELECT status, COUNT(*) FROM outbox GROUP BY status'
+SELECT_DEAD = '''
+SELECT id, idempotency_key, phone, kind, body, source, attempts, last_error, created_at FROM outbox
+WHERE status = 'dead'
+ORDER BY id DESC
+LIMIT ?
+'''
+
+
+class RecipientOptedOut(Exception):
+    """The recipient replied STOP, nothing may be queued for them"""
+
+
+def backoff_delay(attempts, base=OUTBOX_BASE_DELAY, cap=OUTBOX_MAX_DELAY):
+    """Exponential backoff with equal jitter after `attempts` failed tries"""
+    delay = min(cap, base * 2 ** (attempts - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class Outbox:
+    """SQLite outbox for outbound WhatsApp messages
+
+    enqueue() stores a message and returns at once; sender threads deliver
+    due messages through `deliver(message) -> bool`, retrying failures with
+    exponential backoff and jitter and dead-lettering them after
+    max_attempts. on_sent(message) runs once a message is delivered; when
+    deliver returned a string it is there as message['provider_id'].
+    Messages are unique by idempotency key, so enqueueing the same key
+    twice sends once. Messages for a contact who opted out after they were
+    queued are cancelled instead of sent, apart from the STOP confirmation
+    (source OPT_OUT_SOURCE). ready(message) -> seconds is asked before a
+    message is claimed; a positive answer postpones it by that long without
+    using an attempt, so rate limits never park a sender thread.
+    """
+
+    def __init__(self, deliver, on_sent=None, ready=None, workers=OUTBOX_WORKERS, max_attempts=OUTBOX_MAX_ATTEMPTS):
+        self.deliver = deliver
+        self.on_sent = on_sent
+        self.ready = ready
+        self.max_attempts = max_attempts
+        self.pool = WorkerPool(workers=workers, max_queue=workers * 4, name='outbox')
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.delivered = 0
+        self.retried = 0
+        self.dead_lettered = 0
+        self.duplicates = 0
+        self.lost_claims = 0
+        self.deferred = 0
+        self.cancelled = 0
+        conn = conversation_store.get_connection()
+        conn.executescript(SCHEMA)
+        conn.commit()
+
+    def enqueue(self, phone, body, source, kind='text', history_text=None, key=None):
+        """(id, created) of the outbox row; created is False for a known idempotency key
+
+        Raises RecipientOptedOut for a contact who opted out.
+        """
+        if conversation_store.is_opted_out(phone):
+            raise RecipientOptedOut(f"{phone} has opted out")
+        key = key or uuid.uuid4().hex
+        conn = conversation_store.get_connection()
+        with conn:
+            created = conn.execute(INSERT_OUTBOX, (
+                key, phone, kind, body, history_text or body, source, time.time(), datetime.now().isoformat()
+            )).rowcount > 0
+            row = conn.execute(SELECT_BY_KEY, (key,)).fetchone()
+        if created:
+            self._start()
+            self._wake.set()
+        else:
+            with self._lock:
+                self.duplicates += 1
+        return row['id'], created
+
+    def requeue(self, message_id):
+        """Give a dead-lettered message a fresh set of attempts"""
+        conn = conversation_store.get_connection()
+        with conn:
+            requeued = conn.execute(REQUEUE_DEAD, (time.time(), message_id)).rowcount > 0
+        if requeued:
+            self._start()
+            self._wake.set()
+        return requeued
+
+    def _start(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='outbox-poller', daemon=True)
+                    self._thread.start()
+
+    def start(self):
+        """Start delivering, also picks up messages left over from a previous run"""
+        self._start()
+
+    def stop(self):
+        """Stop claiming messages, sends already running finish"""
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _claim(self, limit):
+        now = time.time()
+        conn = conversation_store.get_connection()
+        # IMMEDIATE takes the write lock up front, so two processes never claim the same row
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(RELEASE_STALE, (now - OUTBOX_CLAIM_TIMEOUT,))
+            cancelled = conn.execute(CANCEL_OPTED_OUT, (now, OPT_OUT_SOURCE)).rowcount
+            # Look past messages that aren't ready yet so they don't hold up the rest
+            due = [dict(row) for row in conn.execute(SELECT_DUE, (now, limit * 8 if self.ready else limit))]
+            rows = []
+            deferred = []
+            for row in due:
+                if len(rows) == limit:
+                    break
+                wait = self.ready(row) if self.ready else 0
+                if wait > 0:
+                    deferred.append((now + wait, row['id']))
+                else:
+                    rows.append(row)
+            conn.executemany(CLAIM, [(now, row['id']) for row in rows])
+            conn.executemany(DEFER, deferred)
+            conn.commit()
+            with self._lock:
+                self.deferred += len(deferred)
+                self.cancelled += cancelled
+            for row in rows:
+                row['claimed_at'] = now
+        except Exception:
+            conn.rollback()
+            raise
+        return rows
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                # Only claim what idle workers start right away, a claimed row waiting in the
+                # pool's queue would age towards OUTBOX_CLAIM_TIMEOUT and be handed out twice
+                capacity = self.pool.idle_workers()
+                if capacity > 0:
+                    rows = self._claim(capacity)
+                    for row in rows:
+                        self.pool.submit(self._send, row)
+                    if rows:
+                        continue
+                    next_due = conversation_store.get_connection().execute(NEXT_DUE).fetchone()[0]
+                    wait = OUTBOX_POLL_SECONDS if next_due is None else min(OUTBOX_POLL_SECONDS, max(0.0, next_due - time.time()))
+                else:
+                    # Woken by _send when a worker frees up
+                    wait = OUTBOX_POLL_SECONDS
+            except Exception as e:
+                print(f"Outbox poll error: {e}")
+                wait = OUTBOX_POLL_SECONDS
+            self._wake.wait(wait)
+            self._wake.clear()
+
+    def _send(self, message):
+        conn = conversation_store.get_connection()
+        claimed_at = time.time()
+        with conn:
+            held = conn.execute(START_SEND, (claimed_at, message['id'], message['claimed_at'])).rowcount > 0
+        if not held:
+            self._lose_claim(message)
+            return
+        message['claimed_at'] = claimed_at
+
+        try:
+            ok = self.deliver(message)
+            error = None if ok else 'delivery failed'
+        except Exception as e:
+            ok = False
+            error = str(e)
+
+        if ok:
+            message['provider_id'] = ok if isinstance(ok, str) else None
+            with conn:
+                marked = conn.execute(MARK_SENT, (datetime.now().isoformat(), message['id'], claimed_at)).rowcount > 0
+            if not marked:
+                self._lose_claim(message)
+                return
+            with self._lock:
+                self.delivered += 1
+            self._wake.set()
+            if self.on_sent:
+                self.on_sent(message)
+            return
+
+        attempts = message['attempts'] + 1
+        if attempts >= self.max_attempts:
+            status, next_attempt = DEAD, time.time()
+        else:
+            status, next_attempt = PENDING, time.time() + backoff_delay(attempts)
+        with conn:
+            marked = conn.execute(MARK_RETRY, (status, next_attempt, error, message['id'], claimed_at)).rowcount > 0
+        if not marked:
+            self._lose_claim(message)
+            return
+        with self._lock:
+            if status == DEAD:
+                self.dead_lettered += 1
+            else:
+                self.retried += 1
+        if status == DEAD:
+            print(f"Outbox message {message['id']} to {message['phone']} dead-lettered after {attempts} attempts: {error}")
+        self._wake.set()
+
+    def _lose_claim(self, message):
+        # The row outlived OUTBOX_CLAIM_TIMEOUT and was handed out again, the new claim owns it
+        with self._lock:
+            self.lost_claims += 1
+        print(f"Outbox message {message['id']} to {message['phone']} lost its claim, leaving it to the new sender")
+        self._wake.set()
+
+    def dead_letters(self, limit=100):
+        rows = conversation_store.get_connection().execute(SELECT_DEAD, (limit,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def stats(self):
+        counts = dict(conversation_store.get_connection().execute(COUNT_BY_STATUS).fetchall())
+        with self._lock:
+            return {
+                'pending': counts.get(PENDING, 0),
+                'sending': counts.get(SENDING, 0),
+                'sent': counts.get(SENT, 0),
+                'dead': counts.get(DEAD, 0),
+                'cancelled': counts.get(CANCELLED, 0),
+                'maxAttempts': self.max_attempts,
+                'delivered': self.delivered,
+                'retried': self.retried,
+                'deadLettered': self.dead_lettered,
+                'duplicates': self.duplicates,
+                'lostClaims': self.lost_claims,
+                'deferred': self.deferred,
+                'optedOutCancelled': self.cancelled,
+                'workers': self.pool.stats(),
+            }
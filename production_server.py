@@ -1,21 +1,29 @@
 from flask import Flask, request, jsonify
-import requests
 import os
 from dotenv import load_dotenv
 from openai import OpenAI
 
 load_dotenv()
 
+import tata_client
+from model_tiers import ModelRouter
+from webhook_parser import parse_webhook
+
 app = Flask(__name__)
 
 WHATSAPP_TOKEN = os.getenv('WHATSAPP_TOKEN')
 VERIFY_TOKEN = os.getenv('VERIFY_TOKEN')
 client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+model_router = ModelRouter()
 
 @app.route('/', methods=['GET'])
 def health():
     return jsonify({'status': 'active', 'service': 'WhatsApp AI Bot'})
 
+@app.route('/api/model-stats', methods=['GET'])
+def model_stats():
+    return jsonify(model_router.stats())
+
 @app.route('/webhook', methods=['GET'])
 def verify():
     if request.args.get('hub.verify_token') == VERIFY_TOKEN:
@@ -26,24 +34,25 @@ def verify():
 def webhook():
     data = request.get_json()
     
-    phone = data.get('from') or data.get('phone')
-    message = data.get('text', {}).get('body') or data.get('message')
+    event = parse_webhook(data)
+    phone = event.phone if event else None
+    message = event.text if event else None
     
     if phone and message:
         try:
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
+            response = model_router.complete(
+                client.chat.completions.create,
+                model_router.choose(message),
+                [
                     {"role": "system", "content": "You are a helpful assistant. Keep responses under 100 words."},
                     {"role": "user", "content": message}
-                ],
-                max_tokens=100
+                ]
             )
             
             ai_reply = response.choices[0].message.content
             
             # Send back to Tata API
-            requests.post('https://api.smartflo.ai/v1/messages', 
+            tata_client.post('https://api.smartflo.ai/v1/messages', 
                 headers={'Authorization': f'Bearer {WHATSAPP_TOKEN}', 'Content-Type': 'application/json'},
                 json={'to': phone, 'type': 'text', 'text': {'body': ai_reply}})
             
@@ -0,0 +1,120 @@
+import os
+import threading
+import time
+
+# How long a send waits for a probe already running in another thread
+PROVIDER_PROBE_WAIT = float(os.getenv('PROVIDER_PROBE_WAIT', 15))
+
+
+class CapabilityCache:
+    """Remembers which endpoint and payload variant the provider accepts
+
+    attempt(candidate, to, message) -> bool performs one send with one
+    candidate. The first send probes the candidates in order and caches the
+    one that works; later sends use only that candidate. When it fails the
+    cache is cleared and the same send probes the other candidates, so its
+    result says whether the message went out and no message is sent twice.
+    probe_async() finds a route in the background with a check message.
+    """
+
+    def __init__(self, candidates, attempt, probe_wait=PROVIDER_PROBE_WAIT):
+        self.candidates = list(candidates)
+        self.attempt = attempt
+        self.probe_wait = probe_wait
+        self.route = None
+        self._lock = threading.Lock()
+        self._probed = threading.Event()
+        self._probed.set()
+        self._probing = False
+        self.sends = 0
+        self.fast_path_failures = 0
+        self.probes = 0
+        self.probe_attempts = 0
+        self.last_probe = None
+
+    def send(self, to, message):
+        with self._lock:
+            self.sends += 1
+            route = self.route
+            probe_now = route is None and self._claim_probe()
+        if probe_now:
+            return self._probe(to, message)
+        if route is None:
+            # Another thread is probing, use its result instead of probing again
+            self._probed.wait(self.probe_wait)
+            with self._lock:
+                route = self.route
+            if route is None:
+                return False
+
+        try:
+            if self.attempt(route, to, message):
+                return True
+        except Exception as e:
+            print(f"Provider send error with {route}: {e}")
+
+        with self._lock:
+            self.fast_path_failures += 1
+            if self.route == route:
+                self.route = None
+            probe_now = self.route is None and self._claim_probe()
+        if not probe_now:
+            return False
+        print(f"Provider route {route} failed, probing the other routes")
+        return self._probe(to, message, skip=route)
+
+    def probe_async(self, to, message):
+        """Probe in a background thread, for a check message rather than one a customer is waiting for"""
+        with self._lock:
+            if not self._claim_probe():
+                return
+        threading.Thread(target=self._probe, args=(to, message), name='provider-probe', daemon=True).start()
+
+    def _claim_probe(self):
+        # Called with the lock held, only one probe runs at a time
+        if self._probing:
+            return False
+        self._probing = True
+        self._probed.clear()
+        self.probes += 1
+        return True
+
+    def _probe(self, to, message, skip=None):
+        # skip is the route that just failed with this message, it isn't sent twice
+        found = None
+        try:
+            for candidate in self.candidates:
+                if candidate == skip:
+                    continue
+                with self._lock:
+                    self.probe_attempts += 1
+                try:
+                    if self.attempt(candidate, to, message):
+                        found = candidate
+                        break
+                except Exception as e:
+                    print(f"Provider probe error with {candidate}: {e}")
+        finally:
+            with self._lock:
+                self.route = found
+                self._probing = False
+                self.last_probe = time.time()
+            self._probed.set()
+        if found:
+            print(f"Provider route cached: {found}")
+        else:
+            print("Provider probe found no working route")
+        return found is not None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'route': list(self.route) if self.route else None,
+                'candidates': len(self.candidates),
+                'probing': self._probing,
+                'sends': self.sends,
+                'fastPathFailures': self.fast_path_failures,
+                'probes': self.probes,
+                'probeAttempts': self.probe_attempts,
+                'lastProbe': self.last_probe,
+            }
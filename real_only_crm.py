@@ -1,5 +1,4 @@
 from flask import Flask, request, jsonify, render_template_string
-import requests
 import os
 import json
 from datetime import datetime
@@ -8,6 +7,10 @@ from openai import OpenAI
 
 load_dotenv()
 
+import tata_client
+from model_tiers import ModelRouter
+from webhook_parser import parse_webhook
+
 app = Flask(__name__)
 
 WHATSAPP_TOKEN = os.getenv('WHATSAPP_TOKEN')
@@ -15,13 +18,14 @@ OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 VERIFY_TOKEN = os.getenv('VERIFY_TOKEN')
 
 client = OpenAI(api_key=OPENAI_API_KEY)
+model_router = ModelRouter()
 
 # ONLY real data storage - NO sample data
 real_conversations = {}
 real_messages = {}
 
 def send_whatsapp_message(phone, message):
-    url = "https://wb.omni.tatatelebusiness.com/whatsapp-cloud/messages"
+    url = tata_client.MESSAGES_URL
     headers = {'Authorization': f'Bearer {WHATSAPP_TOKEN}', 'Content-Type': 'application/json'}
     
     payload = {
@@ -31,7 +35,7 @@ def send_whatsapp_message(phone, message):
     }
     
     try:
-        response = requests.post(url, headers=headers, json=payload)
+        response = tata_client.post(url, headers=headers, json=payload)
         if response.status_code == 200:
             # Store sent message as real data
             if phone not in real_messages:
@@ -340,8 +344,9 @@ def webhook():
     
     try:
         # Handle real incoming messages only
-        phone = data.get('from')
-        message_text = data.get('text', {}).get('body') if isinstance(data.get('text'), dict) else data.get('text')
+        event = parse_webhook(data)
+        phone = event.phone if event else None
+        message_text = event.text if event else None
         
         if phone and message_text:
             # Store as real conversation
@@ -364,13 +369,13 @@ def webhook():
             
             # Generate AI response for real conversation
             try:
-                response = client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=[
+                response = model_router.complete(
+                    client.chat.completions.create,
+                    model_router.choose(message_text),
+                    [
                         {"role": "system", "content": "You are a helpful WhatsApp assistant. Keep responses brief and friendly."},
                         {"role": "user", "content": message_text}
-                    ],
-                    max_tokens=150
+                    ]
                 )
                 
                 ai_response = response.choices[0].message.content
@@ -0,0 +1,271 @@
+"""AI replies and outbound sends shared by app.py and async_app.py
+
+Both apps answer with the same prompt, FAQ, reply cache, context and
+fallback, and every outbound message goes through the one outbox, paced
+by the send governor.
+"""
+import asyncio
+import hashlib
+import os
+
+from openai import APITimeoutError
+
+import conversation_store
+import tata_client
+from circuit_breaker import AI_FALLBACK_MODE, AI_FALLBACK_REPLY, CircuitBreaker
+from context_builder import ContextBuilder
+from faq_matcher import faq_answer
+from intent_router import OPT_IN, OPT_OUT
+from model_tiers import ModelRouter
+from outbox import OPT_OUT_SOURCE, Outbox, RecipientOptedOut
+from reply_cache import ReplyCache
+from send_governor import PRIORITY_REPLY, PRIORITY_SEND, SendThrottled, get_governor
+
+WHATSAPP_TOKEN = os.getenv('WHATSAPP_TOKEN')
+
+# AI reply settings, the model and max_tokens per message come from model_tiers.py
+SYSTEM_PROMPT = os.getenv('SYSTEM_PROMPT', 'You are a helpful WhatsApp assistant. Keep responses brief and friendly.')
+ERROR_REPLY = "Sorry, I encountered an error. Please try again."
+
+# Answers with AI_FALLBACK_REPLY instead of waiting on OpenAI once it keeps failing or timing out
+ai_breaker = CircuitBreaker()
+
+# Cheaper or shorter completions for short messages, more room for long or contextual ones
+model_router = ModelRouter()
+
+# Recent turns plus an abridged transcript of older ones, within a token budget
+context_builder = ContextBuilder()
+
+# Replies to repeated messages like "Hi" or "price?" without another OpenAI call
+reply_cache = ReplyCache()
+
+# Every send waits for budget on the business number and the recipient (OUTBOUND_RATE, OUTBOUND_RECIPIENT_RATE)
+send_governor = get_governor()
+
+
+def reply_key(dedup_keys):
+    """Outbox idempotency key of the reply to these inbound messages, None if none can be identified"""
+    keys = [key for key in dedup_keys if key]
+    if not keys:
+        return None
+    return 'reply:' + hashlib.sha1('\x1f'.join(keys).encode('utf-8')).hexdigest()
+
+
+def send_session_message(phone, message, priority=PRIORITY_SEND, pace=True):
+    """Send session message using Tata API, returns the provider message id (True if none is given) or False
+
+    pace=False skips the governor for callers that already reserved the budget.
+    """
+    url = tata_client.MESSAGES_URL
+
+    headers = {
+        'Authorization': f'Bearer {WHATSAPP_TOKEN}',
+        'Content-Type': 'application/json'
+    }
+
+    payload = {
+        'to': phone,
+        'type': 'text',
+        'source': 'external',
+        'text': {'body': message},
+        'metaData': {'custom_callback_data': 'session_message'}
+    }
+
+    sent = False
+    try:
+        if pace:
+            send_governor.acquire(phone, priority)
+        response = tata_client.post(url, headers=headers, json=payload)
+        print(f"Session message response: {response.status_code} - {response.text}")
+        if response.status_code == 200:
+            sent = tata_client.message_id(response) or True
+    except SendThrottled as e:
+        # Never reached the provider, so it isn't a failed send
+        print(f"Session message to {phone} not sent: {e}")
+        return False
+    except Exception as e:
+        print(f"Error sending session message: {e}")
+
+    conversation_store.record_send(bool(sent))
+    return sent
+
+
+def send_template_message(phone, template_name='hello_world', language='en_US', components=None, fallback=True,
+                          priority=PRIORITY_SEND, pace=True):
+    """Send template message using Tata API, falling back to a session message unless fallback is False
+
+    Returns the provider message id (True if none is given) or False, like send_session_message().
+    """
+    url = tata_client.MESSAGES_URL
+
+    headers = {
+        'Authorization': f'Bearer {WHATSAPP_TOKEN}',
+        'Content-Type': 'application/json'
+    }
+
+    # hello_world is the default WhatsApp template
+    payload = {
+        'to': phone,
+        'type': 'template',
+        'template': {
+            'name': template_name,
+            'language': {'code': language}
+        }
+    }
+    if components:
+        payload['template']['components'] = components
+
+    try:
+        if pace:
+            send_governor.acquire(phone, priority)
+        response = tata_client.post(url, headers=headers, json=payload)
+        print(f"Template message response: {response.status_code} - {response.text}")
+        conversation_store.record_send(response.status_code == 200)
+
+        if response.status_code == 200:
+            return tata_client.message_id(response) or True
+        elif not fallback:
+            return False
+        else:
+            # If template fails, try session message as fallback
+            print("Template failed, trying session message...")
+            return send_session_message(phone, "Hello! Welcome to our AI assistant. Reply with any message to start chatting. 🤖",
+                                        priority=priority, pace=pace)
+
+    except SendThrottled as e:
+        print(f"Template message to {phone} not sent: {e}")
+        return False
+    except Exception as e:
+        print(f"Error sending template message: {e}")
+        conversation_store.record_send(False)
+        return False
+
+
+def outbound_priority(message):
+    # Replies to customers go ahead of manual sends and campaigns when the number is at its limit
+    return PRIORITY_REPLY if message['source'] in ('ai', OPT_OUT_SOURCE) else PRIORITY_SEND
+
+
+def outbound_ready(message):
+    """Seconds until the governor has budget for this outbox message, 0 once it is reserved"""
+    return send_governor.try_acquire(message['phone'], outbound_priority(message))
+
+
+def deliver_outbound(message):
+    # Budget was reserved by outbound_ready() when the message was claimed
+    priority = outbound_priority(message)
+    if message['kind'] == 'template':
+        return send_template_message(message['phone'], message['body'], priority=priority, pace=False)
+    return send_session_message(message['phone'], message['body'], priority=priority, pace=False)
+
+
+def record_delivered(message):
+    """Add a delivered outbox message to the conversation history, tagged for its delivery receipts"""
+    conversation_store.add_message(message['phone'], message['history_text'], 'sent', message['source'],
+                                   provider_id=message.get('provider_id'))
+    conversation_store.update_chat(message['phone'], message['history_text'])
+
+
+# Outbound messages are persisted first and delivered with retries (see outbox.py)
+conversation_store.init_db()
+outbox = Outbox(deliver_outbound, on_sent=record_delivered, ready=outbound_ready)
+outbox.start()
+
+
+def fallback_reply(phone, message_text, reason):
+    """Reply sent when the AI path is unavailable, optionally queueing the message for an agent"""
+    if AI_FALLBACK_MODE == 'human':
+        conversation_store.queue_handoff(phone, message_text, reason)
+    return AI_FALLBACK_REPLY
+
+
+def send_fallback(phone, message_text, reason, key=None):
+    """Queue the fallback reply for a message the AI path couldn't take"""
+    try:
+        outbox.enqueue(phone, fallback_reply(phone, message_text, reason), 'ai', key=key)
+    except RecipientOptedOut:
+        print(f"{phone} has opted out, no fallback reply")
+
+
+def send_error_reply(phone, key=None):
+    """Queue the apology for a message whose processing failed"""
+    try:
+        outbox.enqueue(phone, ERROR_REPLY, 'ai', key=key)
+    except Exception as e:
+        print(f"Error reply to {phone} not queued: {e}")
+
+
+def prepare_reply(phone, message_text):
+    """(reply, tier, messages, cache key) for a message
+
+    reply is set when the message is answered without OpenAI: from the FAQ,
+    the reply cache, or with the fallback while the breaker is open.
+    Otherwise tier and messages are the completion to request and the
+    cache key is where finish_reply() stores its answer.
+    """
+    canned = faq_answer(message_text)
+    if canned:
+        print(f"FAQ answer for {phone}")
+        return canned, None, None, None
+
+    cache_key = None
+    messages = context_builder.build(phone, SYSTEM_PROMPT)
+    # More than the system prompt and the message being answered means earlier turns,
+    # however long ago they were
+    has_history = len(messages) > 2
+    tier = model_router.choose(message_text, has_history)
+    if has_history:
+        # Replies that depend on earlier turns can't be shared
+        reply_cache.bypass()
+    else:
+        cache_key = reply_cache.key(message_text, SYSTEM_PROMPT, tier.model)
+        cached = reply_cache.get(cache_key)
+        if cached:
+            print(f"Reply cache hit for {phone}")
+            return cached, None, None, None
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": message_text}
+        ]
+
+    if not ai_breaker.allow():
+        return fallback_reply(phone, message_text, 'circuit open'), None, None, None
+    return None, tier, messages, cache_key
+
+
+def finish_reply(cache_key, response):
+    """Text of a successful completion, cached under cache_key"""
+    ai_breaker.record_success()
+    ai_response = response.choices[0].message.content
+    reply_cache.put(cache_key, ai_response)
+    return ai_response
+
+
+def failed_reply(phone, message_text, error):
+    """Fallback reply after a failed completion, counted against the breaker"""
+    timed_out = isinstance(error, (APITimeoutError, asyncio.TimeoutError))
+    ai_breaker.record_failure(timeout=timed_out)
+    print(f"OpenAI call failed for {phone}: {error}")
+    return fallback_reply(phone, message_text, 'timeout' if timed_out else 'error')
+
+
+def answer_intent(phone, intent, key=None):
+    """Queue the fixed reply or template of a matched intent, recording STOP and START"""
+    if intent.name == OPT_IN:
+        conversation_store.set_opted_out(phone, False)
+    elif conversation_store.is_opted_out(phone):
+        # Nothing goes to a contact who replied STOP until they reply START
+        print(f"{phone} has opted out, no reply")
+        return
+
+    # The STOP confirmation is still delivered after the opt-out is recorded
+    source = OPT_OUT_SOURCE if intent.name == OPT_OUT else 'ai'
+    if intent.template:
+        outbox.enqueue(phone, intent.template, source, kind='template',
+                       history_text=f"Template {intent.template} sent", key=key)
+    else:
+        outbox.enqueue(phone, intent.reply, source, key=key)
+
+    # The confirmation is queued first, it's the last message the contact gets
+    if intent.name == OPT_OUT:
+        conversation_store.set_opted_out(phone, True)
@@ -0,0 +1,95 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+REPLY_CACHE_SIZE = int(os.getenv('REPLY_CACHE_SIZE', 1000))
+REPLY_CACHE_TTL = int(os.getenv('REPLY_CACHE_TTL', 3600))
+
+_PUNCTUATION = re.compile(r'[^\w\s]')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize(text):
+    """Case, punctuation and whitespace-insensitive form of a message"""
+    return _WHITESPACE.sub(' ', _PUNCTUATION.sub('', text.lower())).strip()
+
+
+class ReplyCache:
+    """LRU cache with a TTL for AI replies to identical customer messages
+
+    Keys cover the normalized message text, the system prompt and the model,
+    so changing either of those never serves a stale reply.
+    """
+
+    def __init__(self, max_entries=REPLY_CACHE_SIZE, ttl=REPLY_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, reply), least recently used first
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evicted = 0
+        self.expired = 0
+
+    def key(self, text, system_prompt, model):
+        normalized = normalize(text)
+        if not normalized:
+            return None
+        return hashlib.sha1(f"{model}\x1f{system_prompt}\x1f{normalized}".encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        if key is None:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, reply = entry
+            if expires_at <= now:
+                del self._entries[key]
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return reply
+
+    def put(self, key, reply):
+        if key is None or not reply:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, reply)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evicted += 1
+
+    def bypass(self):
+        """Count a lookup skipped because the conversation context matters"""
+        with self._lock:
+            self.bypassed += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxEntries': self.max_entries,
+                'ttlSeconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'bypassed': self.bypassed,
+                'evicted': self.evicted,
+                'expired': self.expired,
+                'hitRate': round(self.hits * 100 / lookups, 1) if lookups else 0,
+            }
@@ -0,0 +1,203 @@
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+from token_bucket import TokenBucket
+from worker_pool import percentile_ms
+
+# Messages per second the business number may send (the provider's throughput tier) and how
+# many of them may go out at once after an idle spell
+OUTBOUND_RATE = float(os.getenv('OUTBOUND_RATE', 80))
+OUTBOUND_BURST = float(os.getenv('OUTBOUND_BURST', OUTBOUND_RATE))
+# Messages per minute to a single recipient, WhatsApp throttles pairs faster than about one every 6 seconds
+OUTBOUND_RECIPIENT_RATE = float(os.getenv('OUTBOUND_RECIPIENT_RATE', 10))
+OUTBOUND_RECIPIENT_BURST = float(os.getenv('OUTBOUND_RECIPIENT_BURST', 3))
+# A blocking send still waiting for budget after this many seconds fails; keep it well under
+# OUTBOX_CLAIM_TIMEOUT, outbox deliveries check the budget with try_acquire() and never block
+OUTBOUND_MAX_WAIT = float(os.getenv('OUTBOUND_MAX_WAIT', 30))
+OUTBOUND_MAX_RECIPIENTS = int(os.getenv('OUTBOUND_MAX_RECIPIENTS', 10000))
+BUSINESS_NUMBER = os.getenv('WHATSAPP_PHONE_NUMBER_ID') or 'default'
+
+# Lower numbers go first: replies to customers, then single sends, then campaigns
+PRIORITY_REPLY = 0
+PRIORITY_SEND = 1
+PRIORITY_BROADCAST = 2
+
+_PRIORITY_NAMES = {PRIORITY_REPLY: 'reply', PRIORITY_SEND: 'send', PRIORITY_BROADCAST: 'broadcast'}
+
+
+class SendThrottled(Exception):
+    """The send did not get budget within its max wait"""
+
+
+class SendGovernor:
+    """Token buckets per business number and per recipient in front of outbound sends
+
+    acquire() blocks until both the number's budget and the recipient's
+    budget allow one more message; try_acquire() takes the budget only if
+    it is there now and otherwise says how long to come back after.
+    Waiting sends are admitted by priority,
+    then arrival; a waiter whose recipient is still throttled doesn't hold
+    up waiters for other recipients. Recipient buckets that have refilled
+    are dropped once more than max_recipients are tracked.
+    """
+
+    def __init__(self, rate=OUTBOUND_RATE, burst=OUTBOUND_BURST, recipient_rate=OUTBOUND_RECIPIENT_RATE,
+                 recipient_burst=OUTBOUND_RECIPIENT_BURST, max_wait=OUTBOUND_MAX_WAIT,
+                 max_recipients=OUTBOUND_MAX_RECIPIENTS):
+        self.rate = rate
+        self.burst = burst
+        self.recipient_rate = recipient_rate
+        self.recipient_burst = recipient_burst
+        self.max_wait = max_wait
+        self.max_recipients = max_recipients
+        self._numbers = {}  # business number -> TokenBucket
+        self._recipients = OrderedDict()  # (number, recipient) -> TokenBucket, least recently used first
+        self._waiting = {}  # (priority, seq) -> (number, recipient)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self.admitted = 0
+        self.delayed = 0
+        self.throttled = 0
+        self.deferred = 0
+        self._waits = {name: deque(maxlen=1000) for name in _PRIORITY_NAMES.values()}
+
+    def _number_bucket(self, number):
+        bucket = self._numbers.get(number)
+        if bucket is None:
+            bucket = self._numbers[number] = TokenBucket(self.rate * 60, capacity=self.burst)
+        return bucket
+
+    def _recipient_bucket(self, number, recipient, now):
+        key = (number, recipient)
+        bucket = self._recipients.get(key)
+        if bucket is None:
+            if len(self._recipients) >= self.max_recipients:
+                self._prune(now)
+            bucket = self._recipients[key] = TokenBucket(self.recipient_rate, capacity=self.recipient_burst)
+        else:
+            self._recipients.move_to_end(key)
+        return bucket
+
+    def _prune(self, now):
+        waiting = set(self._waiting.values())
+        for key in list(self._recipients):
+            if len(self._recipients) < self.max_recipients:
+                break
+            if key not in waiting and self._recipients[key].available(now) >= self.recipient_burst:
+                del self._recipients[key]
+
+    def acquire(self, recipient, priority=PRIORITY_SEND, number=None, max_wait=None):
+        """Block until a message to recipient may be sent, returns the seconds waited
+
+        Raises SendThrottled when no budget frees up within max_wait.
+        """
+        number = number or BUSINESS_NUMBER
+        ticket = (priority, next(self._seq))
+        start = time.monotonic()
+        deadline = start + (self.max_wait if max_wait is None else max_wait)
+        with self._cond:
+            self._waiting[ticket] = (number, recipient)
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = self._take(ticket, number, recipient, now)
+                    if wait == 0:
+                        break
+                    if now >= deadline:
+                        self.throttled += 1
+                        raise SendThrottled(f"No send budget for {recipient} within {deadline - start:.1f}s")
+                    # A higher-priority waiter goes first and notifies when it's done
+                    self._cond.wait(min(wait, deadline - now) if wait else deadline - now)
+            finally:
+                del self._waiting[ticket]
+                self._cond.notify_all()
+
+            waited = time.monotonic() - start
+            self.admitted += 1
+            if waited > 0.001:
+                self.delayed += 1
+            self._waits[_PRIORITY_NAMES.get(priority, 'send')].append(waited)
+        return waited
+
+    def try_acquire(self, recipient, priority=PRIORITY_SEND, number=None):
+        """0 when a message to recipient may be sent now (the budget is taken), else seconds to retry after"""
+        number = number or BUSINESS_NUMBER
+        with self._cond:
+            now = time.monotonic()
+            wait = self._take((priority, next(self._seq)), number, recipient, now)
+            if wait == 0:
+                self.admitted += 1
+                self._waits[_PRIORITY_NAMES.get(priority, 'send')].append(0.0)
+                return 0.0
+            self.deferred += 1
+            # None means a blocked higher-priority send goes first, come back after its slot
+            return wait or 1.0 / self.rate
+
+    def _take(self, ticket, number, recipient, now):
+        # Called with the lock held: takes one message of budget and returns 0, or returns the
+        # seconds until the budget refills, None when only waiters ahead of the ticket are in the way
+        number_bucket = self._number_bucket(number)
+        recipient_bucket = self._recipient_bucket(number, recipient, now)
+        recipient_wait = recipient_bucket.wait_time(1, now)
+        number_wait = number_bucket.wait_time(1, now)
+        if recipient_wait or number_wait:
+            return recipient_wait or number_wait
+        if self._ahead(ticket, number, now):
+            return None
+        number_bucket.take(1)
+        recipient_bucket.take(1)
+        return 0
+
+    def _ahead(self, ticket, number, now):
+        # Called with the lock held: an earlier waiter on this number that could go right now
+        for other, (other_number, other_recipient) in self._waiting.items():
+            if other < ticket and other_number == number:
+                bucket = self._recipients.get((other_number, other_recipient))
+                if bucket is None or bucket.wait_time(1, now) == 0:
+                    return True
+        return False
+
+    def stats(self):
+        now = time.monotonic()
+        with self._cond:
+            waits = {}
+            for name, samples in self._waits.items():
+                ordered = sorted(samples)
+                waits[name] = {
+                    'samples': len(ordered),
+                    'p50': percentile_ms(ordered, 50),
+                    'p95': percentile_ms(ordered, 95),
+                    'max': percentile_ms(ordered, 100),
+                }
+            return {
+                'ratePerSecond': self.rate,
+                'burst': self.burst,
+                'recipientPerMinute': self.recipient_rate,
+                'recipientBurst': self.recipient_burst,
+                'maxWaitSeconds': self.max_wait,
+                'tokensLeft': {number: round(bucket.available(now), 1) for number, bucket in self._numbers.items()},
+                'trackedRecipients': len(self._recipients),
+                'waiting': len(self._waiting),
+                'admitted': self.admitted,
+                'delayed': self.delayed,
+                'throttled': self.throttled,
+                'deferred': self.deferred,
+                'waitMs': waits,
+            }
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def get_governor():
+    """Governor shared by every send in this process"""
+    global _default
+    if _default is None:
+        with _default_lock:
+            if _default is None:
+                _default = SendGovernor()
+    return _default
@@ -0,0 +1,184 @@
+import os
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from worker_pool import percentile_ms
+
+# Shared keep-alive HTTP client for every outbound Tata API call, so each
+# message reuses a pooled TCP+TLS connection instead of opening a new one
+TATA_BASE_URL = os.getenv('TATA_BASE_URL', 'https://wb.omni.tatatelebusiness.com')
+TATA_POOL_SIZE = int(os.getenv('TATA_POOL_SIZE', 20))
+TATA_CONNECT_TIMEOUT = float(os.getenv('TATA_CONNECT_TIMEOUT', 3.05))
+TATA_READ_TIMEOUT = float(os.getenv('TATA_READ_TIMEOUT', 15))
+TATA_HTTP2 = os.getenv('TATA_HTTP2', 'false').lower() in ('1', 'true', 'yes')
+
+MESSAGES_URL = f"{TATA_BASE_URL}/whatsapp-cloud/messages"
+
+_lock = threading.Lock()
+_session = None
+_async_client = None
+_latencies = {}  # path -> deque of seconds
+_counts = {}  # path -> {'calls': n, 'errors': n}
+
+
+def _create_session():
+    if TATA_HTTP2:
+        try:
+            import httpx
+            print("Tata client using HTTP/2")
+            return httpx.Client(
+                http2=True,
+                timeout=httpx.Timeout(TATA_READ_TIMEOUT, connect=TATA_CONNECT_TIMEOUT),
+                limits=httpx.Limits(max_connections=TATA_POOL_SIZE, max_keepalive_connections=TATA_POOL_SIZE),
+            )
+        except ImportError:
+            print("TATA_HTTP2 is set but httpx[http2] is not installed, using HTTP/1.1")
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=TATA_POOL_SIZE, pool_maxsize=TATA_POOL_SIZE)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session():
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                _session = _create_session()
+    return _session
+
+
+def request(method, url, **kwargs):
+    """Send a request through the pooled session and record its latency
+
+    Relative paths are resolved against TATA_BASE_URL. Raises the underlying
+    client's exceptions like requests.request() does.
+    """
+    if url.startswith('/'):
+        url = TATA_BASE_URL + url
+    if TATA_HTTP2:
+        kwargs.setdefault('timeout', TATA_READ_TIMEOUT)
+    else:
+        kwargs.setdefault('timeout', (TATA_CONNECT_TIMEOUT, TATA_READ_TIMEOUT))
+
+    path = urlsplit(url).path or '/'
+    start = time.monotonic()
+    ok = False
+    try:
+        response = get_session().request(method, url, **kwargs)
+        ok = response.status_code < 500
+        return response
+    finally:
+        _record(f"{method} {path}", time.monotonic() - start, ok)
+
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
+
+
+def message_id(response):
+    """Provider message id of a successful send, from {"id"} or Meta-style {"messages": [{"id"}]}; None if absent"""
+    try:
+        data = response.json()
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    if data.get('id'):
+        return str(data['id'])
+    messages = data.get('messages')
+    if isinstance(messages, list) and messages and isinstance(messages[0], dict) and messages[0].get('id'):
+        return str(messages[0]['id'])
+    return None
+
+
+def get_async_client():
+    """Pooled httpx.AsyncClient for the ASGI app, created on first use inside its event loop"""
+    global _async_client
+    if _async_client is None:
+        import httpx
+        options = dict(
+            timeout=httpx.Timeout(TATA_READ_TIMEOUT, connect=TATA_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=TATA_POOL_SIZE, max_keepalive_connections=TATA_POOL_SIZE),
+        )
+        try:
+            _async_client = httpx.AsyncClient(http2=TATA_HTTP2, **options)
+        except ImportError:
+            print("TATA_HTTP2 is set but httpx[http2] is not installed, using HTTP/1.1")
+            _async_client = httpx.AsyncClient(**options)
+    return _async_client
+
+
+async def arequest(method, url, **kwargs):
+    """Async counterpart of request(), latency goes into the same stats"""
+    if url.startswith('/'):
+        url = TATA_BASE_URL + url
+    path = urlsplit(url).path or '/'
+    start = time.monotonic()
+    ok = False
+    try:
+        response = await get_async_client().request(method, url, **kwargs)
+        ok = response.status_code < 500
+        return response
+    finally:
+        _record(f"{method} {path}", time.monotonic() - start, ok)
+
+
+async def aget(url, **kwargs):
+    return await arequest('GET', url, **kwargs)
+
+
+async def apost(url, **kwargs):
+    return await arequest('POST', url, **kwargs)
+
+
+async def aclose():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+
+def _record(key, seconds, ok):
+    with _lock:
+        if key not in _latencies:
+            _latencies[key] = deque(maxlen=500)
+            _counts[key] = {'calls': 0, 'errors': 0}
+        _latencies[key].append(seconds)
+        _counts[key]['calls'] += 1
+        if not ok:
+            _counts[key]['errors'] += 1
+
+
+def stats():
+    """Per-endpoint call counts and latency percentiles"""
+    with _lock:
+        snapshot = {key: (sorted(values), dict(_counts[key])) for key, values in _latencies.items()}
+    endpoints = {}
+    for key, (values, counts) in snapshot.items():
+        counts['latencyMs'] = {
+            'p50': percentile_ms(values, 50),
+            'p95': percentile_ms(values, 95),
+            'p99': percentile_ms(values, 99),
+            'max': percentile_ms(values, 100),
+        }
+        endpoints[key] = counts
+    return {
+        'poolSize': TATA_POOL_SIZE,
+        'connectTimeout': TATA_CONNECT_TIMEOUT,
+        'readTimeout': TATA_READ_TIMEOUT,
+        'http2': TATA_HTTP2,
+        'endpoints': endpoints,
+    }
+
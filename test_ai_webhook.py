@@ -1,9 +1,10 @@
 import requests
 import json
+import os
 
 def test_ai_webhook():
     """Test the AI webhook with a sample message"""
-    url = "http://localhost:3000/webhook"
+    url = os.getenv("WEBHOOK_URL", "http://localhost:3000/webhook")
     
     # Test message from Tata format
     test_data = {
@@ -1,8 +1,10 @@
 import requests
 import json
+import os
 
 # Test the webhook with sample data
-url = "https://whatsappai-x52i.onrender.com/webhook"
+# Local server by default, set WEBHOOK_URL to test a deployment
+url = os.getenv("WEBHOOK_URL", "http://localhost:3000/webhook")
 
 test_data = {
     "from": "+919355421616",
@@ -0,0 +1,49 @@
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import conversation_store  # noqa: E402
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """conversation_store on a fresh database file, with fresh per-thread connections"""
+    monkeypatch.setattr(conversation_store, 'DATABASE_PATH', str(tmp_path / 'test.db'))
+    monkeypatch.setattr(conversation_store, '_local', threading.local())
+    monkeypatch.setattr(conversation_store, '_initialized', set())
+    conversation_store.init_db()
+    return conversation_store
+
+
+@pytest.fixture
+def app_module(store, monkeypatch):
+    """app.py on the test database
+
+    Its outbox is stopped so queued messages stay pending, and bursts are
+    collected but never flushed.
+    """
+    monkeypatch.setenv('OPENAI_API_KEY', 'test')
+    import app
+    import outbox
+    from burst_coalescer import BurstCoalescer
+
+    store.get_connection().executescript(outbox.SCHEMA)
+    app.outbox.stop()
+    monkeypatch.setattr(app, 'burst_coalescer', BurstCoalescer(lambda *args: None, window=3600))
+    return app
+
+
+@pytest.fixture
+def async_app_module(store, monkeypatch):
+    """async_app.py on the test database, with the shared outbox stopped like app_module's"""
+    monkeypatch.setenv('OPENAI_API_KEY', 'test')
+    import async_app
+    import outbox
+
+    store.get_connection().executescript(outbox.SCHEMA)
+    async_app.outbox.stop()
+    return async_app
@@ -0,0 +1,92 @@
+import uuid
+
+import conversation_store
+
+
+def meta_payload(phone, *texts):
+    messages = [{'from': phone, 'id': f"wamid.{uuid.uuid4().hex}", 'timestamp': '1722330601',
+                 'type': 'text', 'text': {'body': text}} for text in texts]
+    return {'object': 'whatsapp_business_account',
+            'entry': [{'changes': [{'value': {'contacts': [{'wa_id': phone}], 'messages': messages}}]}]}
+
+
+def queued(phone):
+    rows = conversation_store.get_connection().execute(
+        'SELECT body FROM outbox WHERE phone = ? ORDER BY id', (phone,)).fetchall()
+    return [row['body'] for row in rows]
+
+
+def test_stop_inside_a_burst_is_recorded(app_module):
+    phone = '919800000001'
+    response = app_module.app.test_client().post('/webhook', json=meta_payload(phone, 'ok thanks', 'STOP'))
+    assert response.status_code == 200
+    assert conversation_store.is_opted_out(phone)
+    assert len(queued(phone)) == 1
+    assert app_module.burst_coalescer._pending[phone]['texts'] == ['ok thanks']
+
+    # The rest of the burst is flushed after the opt-out and gets no reply
+    app_module.process_message(phone, 'ok thanks', 'reply:later')
+    assert len(queued(phone)) == 1
+
+
+def test_queue_full_burst_still_gets_intent_replies(app_module, monkeypatch):
+    monkeypatch.setattr(app_module.ai_workers, 'submit', lambda *args, **kwargs: False)
+    app_module.queue_reply('919800000002', ['hi'], ['k1'])
+    assert queued('919800000002') == [app_module.route_intent('hi').reply]
+
+    conversation_store.set_opted_out('919800000003', True)
+    app_module.queue_reply('919800000003', ['where is my stuff'], ['k2'])
+    assert queued('919800000003') == []
+
+
+def test_returning_contact_gets_earlier_turns(app_module, monkeypatch):
+    phone = '919800000004'
+    conversation_store.add_message(phone, 'I ordered the blue jacket', 'received', timestamp='2020-01-01T10:00:00')
+    conversation_store.add_message(phone, 'Thanks, noted!', 'sent', timestamp='2020-01-01T10:00:05')
+    conversation_store.add_message(phone, 'is it shipped yet?', 'received')
+    prompts = []
+
+    class Response:
+        class choices:
+            class _choice:
+                class message:
+                    content = 'It shipped yesterday.'
+        choices = [choices._choice]
+
+    def complete(create, tier, messages, **kwargs):
+        prompts.append(messages)
+        return Response
+
+    monkeypatch.setattr(app_module.model_router, 'complete', complete)
+    assert app_module.generate_reply(phone, 'is it shipped yet?') == 'It shipped yesterday.'
+    assert [m['content'] for m in prompts[0][1:]] == ['I ordered the blue jacket', 'Thanks, noted!', 'is it shipped yet?']
+
+
+def test_template_fallback_keeps_the_reserved_send_slot(app_module, monkeypatch):
+    class Response:
+        def __init__(self, status_code):
+            self.status_code = status_code
+            self.text = ''
+
+        def json(self):
+            return {'messages': [{'id': 'wamid.fallback'}]}
+
+    responses = [Response(500), Response(200)]
+    monkeypatch.setattr(app_module.tata_client, 'post', lambda url, **kwargs: responses.pop(0))
+
+    def acquire(*args, **kwargs):
+        raise AssertionError('pace=False must not wait for the governor')
+
+    monkeypatch.setattr(app_module.send_governor, 'acquire', acquire)
+    assert app_module.send_template_message('919800000005', pace=False) == 'wamid.fallback'
+
+
+def test_error_reply_goes_through_the_outbox(app_module, monkeypatch):
+    phone = '919800000006'
+
+    def fail(*args):
+        raise RuntimeError('boom')
+
+    monkeypatch.setattr(app_module, 'generate_reply', fail)
+    app_module.process_message(phone, 'do the jackets come in blue', 'reply:error')
+    assert queued(phone) == ["Sorry, I encountered an error. Please try again."]
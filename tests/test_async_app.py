@@ -0,0 +1,67 @@
+import time
+import uuid
+
+from starlette.testclient import TestClient
+
+import conversation_store
+
+
+def meta_payload(phone, text):
+    message = {'from': phone, 'id': f"wamid.{uuid.uuid4().hex}", 'timestamp': '1722330601',
+               'type': 'text', 'text': {'body': text}}
+    return {'object': 'whatsapp_business_account',
+            'entry': [{'changes': [{'value': {'contacts': [{'wa_id': phone}], 'messages': [message]}}]}]}
+
+
+def queued(phone):
+    rows = conversation_store.get_connection().execute(
+        'SELECT body, idempotency_key FROM outbox WHERE phone = ? ORDER BY id', (phone,)).fetchall()
+    return [tuple(row) for row in rows]
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_ai_reply_goes_through_the_scheduler_and_outbox(async_app_module, monkeypatch):
+    phone = '919800000101'
+    calls = []
+
+    class Response:
+        class usage:
+            prompt_tokens = completion_tokens = total_tokens = 10
+
+        class choices:
+            class _choice:
+                class message:
+                    content = 'We ship in 2 days.'
+        choices = [choices._choice]
+
+    async def acomplete(**kwargs):
+        calls.append(kwargs)
+        return Response
+
+    monkeypatch.setattr(async_app_module.ai_scheduler, 'acomplete', acomplete)
+    with TestClient(async_app_module.app) as client:
+        response = client.post('/webhook', json=meta_payload(phone, 'how long does shipping take to Pune'))
+        assert response.json()['results'][0]['status'] == 'queued'
+        assert wait_for(lambda: queued(phone))
+
+    assert queued(phone)[0][0] == 'We ship in 2 days.'
+    assert queued(phone)[0][1].startswith('reply:')
+    assert calls[0]['deadline'] > time.monotonic() - 5
+
+
+def test_stop_is_recorded_and_confirmed(async_app_module):
+    phone = '919800000102'
+    with TestClient(async_app_module.app) as client:
+        client.post('/webhook', json=meta_payload(phone, 'STOP'))
+        assert wait_for(lambda: conversation_store.is_opted_out(phone))
+        response = client.post('/api/send-message', json={'phone': phone, 'message': 'sale today'})
+    assert response.status_code == 409
+    assert len(queued(phone)) == 1
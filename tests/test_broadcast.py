@@ -0,0 +1,43 @@
+import pytest
+
+import broadcast
+
+
+@pytest.mark.parametrize('value', [-2, 0, '0', 'fast', 'nan', 2.5, True])
+def test_bad_concurrency_is_rejected(value):
+    with pytest.raises(ValueError):
+        broadcast.parse_limit(value, int)
+
+
+def test_requested_limits_are_capped_at_the_defaults():
+    manager = broadcast.BroadcastManager(lambda *a, **k: True, concurrency=4, rate=10)
+    job = manager.create([], 'hello', concurrency='2', rate=50)
+    assert (job.concurrency, job.rate) == (2, 10)
+    job = manager.create([], 'hello', concurrency=None, rate='')
+    assert (job.concurrency, job.rate) == (4, 10)
+    with pytest.raises(ValueError):
+        manager.create([], 'hello', rate=-1)
+
+
+def wait_done(job, timeout=5):
+    with job.cond:
+        job.cond.wait_for(lambda: job.status == broadcast.DONE, timeout)
+    return job.progress()
+
+
+def test_throttled_sends_are_retried_then_reported_as_throttled():
+    attempts = {}
+
+    def send(phone, template):
+        attempts[phone] = attempts.get(phone, 0) + 1
+        if phone == '919800000301' and attempts[phone] < 3 or phone == '919800000302':
+            raise broadcast.SendThrottled('no budget')
+        return 'wamid.' + phone
+
+    manager = broadcast.BroadcastManager(send, concurrency=1, rate=1000, throttle_retries=2)
+    job = manager.create([('919800000301', None), ('919800000302', None)], 'hello')
+    progress = wait_done(job)
+
+    assert (progress['sent'], progress['failed'], progress['throttled']) == (1, 0, 1)
+    assert attempts == {'919800000301': 3, '919800000302': 3}
+    assert [result['status'] for result in job.results] == ['sent', 'throttled']
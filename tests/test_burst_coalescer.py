@@ -0,0 +1,63 @@
+import threading
+import time
+
+from burst_coalescer import BurstCoalescer
+
+
+def collector():
+    flushed = []
+    done = threading.Event()
+
+    def on_flush(phone, texts, keys):
+        flushed.append((phone, texts, keys, time.monotonic()))
+        done.set()
+
+    return flushed, done, on_flush
+
+
+def test_messages_in_the_window_flush_once_in_order():
+    flushed, done, on_flush = collector()
+    coalescer = BurstCoalescer(on_flush, window=0.2, max_wait=5)
+    start = time.monotonic()
+    coalescer.add('919800000601', 'hi', 'k1')
+    time.sleep(0.1)
+    coalescer.add('919800000601', 'I need help', 'k2')
+    coalescer.add('919800000602', 'price?', 'k3')
+
+    assert done.wait(2)
+    time.sleep(0.3)
+    by_phone = {phone: (texts, keys, at) for phone, texts, keys, at in flushed}
+    assert by_phone['919800000601'][:2] == (['hi', 'I need help'], ['k1', 'k2'])
+    assert by_phone['919800000602'][:2] == (['price?'], ['k3'])
+    # The second message restarted the quiet window
+    assert by_phone['919800000601'][2] - start >= 0.3
+    assert coalescer.stats()['callsSaved'] == 1
+
+
+def test_max_wait_flushes_a_contact_that_keeps_typing():
+    flushed, done, on_flush = collector()
+    coalescer = BurstCoalescer(on_flush, window=0.2, max_wait=0.5)
+    start = time.monotonic()
+    while not done.is_set() and time.monotonic() - start < 2:
+        coalescer.add('919800000603', 'more', None)
+        time.sleep(0.05)
+
+    assert done.is_set()
+    assert flushed[0][3] - start < 0.8
+
+
+def test_flush_error_does_not_stop_the_timer():
+    calls = []
+
+    def on_flush(phone, texts, keys):
+        calls.append(phone)
+        if len(calls) == 1:
+            raise RuntimeError('boom')
+
+    coalescer = BurstCoalescer(on_flush, window=0.05)
+    coalescer.add('919800000604', 'a')
+    time.sleep(0.2)
+    coalescer.add('919800000605', 'b')
+    time.sleep(0.2)
+    assert calls == ['919800000604', '919800000605']
+    assert coalescer.stats()['errors'] == 1
@@ -0,0 +1,73 @@
+import circuit_breaker
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+def tripped(monkeypatch, threshold=3):
+    clock = Clock()
+    monkeypatch.setattr(circuit_breaker, 'time', clock)
+    breaker = CircuitBreaker(failure_threshold=threshold, reset_timeout=30)
+    for _ in range(threshold):
+        assert breaker.allow()
+        breaker.record_failure()
+    return breaker, clock
+
+
+def test_opens_after_consecutive_failures_only(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(circuit_breaker, 'time', clock)
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure(timeout=True)
+    assert breaker.state == CLOSED
+
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    stats = breaker.stats()
+    assert (stats['trips'], stats['shortCircuited'], stats['timeouts']) == (1, 1, 1)
+
+
+def test_half_open_lets_one_probe_through_and_closes_on_success(monkeypatch):
+    breaker, clock = tripped(monkeypatch)
+    clock.now += 30
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+    assert breaker.stats()['recoveries'] == 1
+
+
+def test_failed_probe_opens_for_another_period(monkeypatch):
+    breaker, clock = tripped(monkeypatch)
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    clock.now += 29
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.allow()
+
+
+def test_probe_that_never_reports_back_is_replaced(monkeypatch):
+    breaker, clock = tripped(monkeypatch)
+    clock.now += 30
+    assert breaker.allow()
+    clock.now += 29
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.allow()
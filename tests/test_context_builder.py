@@ -0,0 +1,36 @@
+from context_builder import ContextBuilder
+
+
+def add_turns(store, phone, count, timestamp='2026-01-01T10:00:00'):
+    for i in range(count):
+        msg_type = 'received' if i % 2 == 0 else 'sent'
+        store.add_message(phone, f"turn {i}", msg_type, timestamp=timestamp)
+
+
+def test_old_turns_are_included_however_long_ago(store):
+    add_turns(store, '9101', 3, timestamp='2020-01-01T10:00:00')
+    messages = ContextBuilder().build('9101', 'system')
+    assert [m['content'] for m in messages] == ['system', 'turn 0', 'turn 1', 'turn 2']
+    assert [m['role'] for m in messages[1:]] == ['user', 'assistant', 'user']
+
+
+def test_turns_past_the_window_become_an_abridged_transcript(store):
+    add_turns(store, '9102', 5)
+    messages = ContextBuilder(max_turns=2).build('9102', 'system')
+    assert messages[1]['role'] == 'system'
+    assert messages[1]['content'].splitlines()[1:] == ['Customer: turn 0', 'Assistant: turn 1', 'Customer: turn 2']
+    assert [m['content'] for m in messages[2:]] == ['turn 3', 'turn 4']
+
+
+def test_transcript_drops_its_oldest_lines_over_budget(store):
+    add_turns(store, '9103', 12)
+    builder = ContextBuilder(max_turns=2, transcript_tokens=12)
+    transcript = builder.build('9103', 'system')[1]['content'].splitlines()[1:]
+    assert transcript[-1] == 'Assistant: turn 9'
+    assert 'Customer: turn 0' not in transcript
+
+
+def test_message_being_answered_is_kept_over_budget(store):
+    store.add_message('9104', 'word ' * 500, 'received')
+    messages = ContextBuilder(token_budget=50).build('9104', 'system')
+    assert len(messages) == 2
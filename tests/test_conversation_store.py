@@ -0,0 +1,41 @@
+import time
+
+import message_stats
+from webhook_parser import StatusEvent
+
+
+def status(store, provider_id):
+    row = store.get_connection().execute(
+        'SELECT status, delivered_at, read_at FROM message_status WHERE provider_id = ?', (provider_id,)).fetchone()
+    return tuple(row)
+
+
+def test_read_before_delivered_keeps_read(store):
+    now = time.time()
+    store.add_message('919800000201', 'hello', 'sent', 'ai', provider_id='wamid.1')
+    store.record_statuses([StatusEvent('wamid.1', 'read', timestamp=str(now + 5))])
+    store.record_statuses([StatusEvent('wamid.1', 'delivered', timestamp=str(now + 2))])
+
+    assert status(store, 'wamid.1') == ('read', now + 2, now + 5)
+    delivery = store.delivery_stats()
+    assert (delivery['tracked'], delivery['delivered'], delivery['read']) == (1, 1, 1)
+
+
+def test_receipt_before_the_send_is_recorded(store):
+    now = time.time()
+    store.record_statuses([StatusEvent('wamid.2', 'delivered', '919800000202', str(now))])
+    store.add_message('919800000202', 'hello', 'sent', 'ai', provider_id='wamid.2')
+
+    assert status(store, 'wamid.2') == ('delivered', now, None)
+
+
+def test_chat_stats_fall_back_to_the_send_rate_without_receipts(store, monkeypatch):
+    monkeypatch.setattr(message_stats, 'recent', message_stats.WindowedCounter())
+    store.record_send(True)
+    store.record_send(True)
+    store.record_send(False)
+    stats = store.chat_stats(active_chats=3)
+
+    assert stats['activeChats'] == 3
+    assert stats['delivery']['tracked'] == 0
+    assert stats['successRate'] == 66.7
@@ -0,0 +1,35 @@
+import os
+
+import faq_matcher
+from faq_matcher import FaqMatcher
+
+ENTRIES = [
+    {'id': 'refund', 'questions': ['how do i get a refund', 'refund policy'], 'answer': 'Refunds take 5 days.'},
+    {'id': 'payment', 'questions': ['what payment methods do you accept', 'how can i pay'], 'answer': 'UPI and cards.'},
+]
+
+
+def test_close_question_gets_the_answer():
+    matcher = FaqMatcher(ENTRIES, min_score=0.6)
+    assert matcher.answer('How can I pay?') == 'UPI and cards.'
+    assert matcher.answer('Refund policy?') == 'Refunds take 5 days.'
+    assert matcher.stats()['hitsByEntry'] == {'payment': 1, 'refund': 1}
+
+
+def test_unrelated_or_long_messages_stay_below_the_threshold():
+    matcher = FaqMatcher(ENTRIES, min_score=0.6)
+    entry, score = matcher.match('my parcel arrived damaged and the box was open, who do I talk to')
+    assert entry is None and score < 0.6
+    assert matcher.answer('') is None
+
+
+def test_no_faq_file_means_no_faq_answers(tmp_path, monkeypatch):
+    monkeypatch.setattr(faq_matcher, 'FAQ_PATH', str(tmp_path / 'faq.json'))
+    monkeypatch.setattr(faq_matcher, '_default', None)
+    assert faq_matcher.get_matcher() is None
+    assert faq_matcher.faq_answer('how can i pay') is None
+
+
+def test_example_file_loads():
+    example = os.path.join(os.path.dirname(faq_matcher.FAQ_PATH), 'faq.example.json')
+    assert FaqMatcher.load(example).answer('How long does delivery take?')
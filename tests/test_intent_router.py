@@ -0,0 +1,21 @@
+from intent_router import OPT_IN, OPT_OUT, route_intent
+
+
+def test_order_status_asks_for_the_number():
+    assert route_intent('where is my order').name == 'order_status'
+    assert route_intent('track my order please').name == 'order_status'
+
+
+def test_messages_with_an_order_number_go_to_the_ai():
+    assert route_intent('where is my order 12345') is None
+    assert route_intent('order #12345 status?') is None
+
+
+def test_complaints_about_an_order_go_to_the_ai():
+    assert route_intent('I want to cancel my order 12345 because it arrived broken') is None
+    assert route_intent('where is my order 12345? I want a refund') is None
+
+
+def test_stop_and_start():
+    assert route_intent('STOP').name == OPT_OUT
+    assert route_intent('start').name == OPT_IN
@@ -0,0 +1,45 @@
+import message_dedup
+from message_dedup import DedupIndex, message_key
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+def test_retry_within_ttl_is_a_duplicate_and_expires_after(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(message_dedup, 'time', clock)
+    index = DedupIndex(ttl=60)
+
+    assert not index.seen('id:wamid.1')
+    clock.now += 59
+    assert index.seen('id:wamid.1')
+    clock.now += 2
+    assert not index.seen('id:wamid.1')
+    assert index.stats()['duplicatesSuppressed'] == 1
+
+
+def test_oldest_keys_are_evicted_at_max_entries():
+    index = DedupIndex(ttl=3600, max_entries=2)
+    for key in ('a', 'b', 'c'):
+        index.seen(key)
+    assert not index.seen('a')
+    assert index.stats()['evicted'] >= 1
+
+
+def test_forget_lets_a_retry_through():
+    index = DedupIndex()
+    index.seen('id:wamid.2')
+    index.forget('id:wamid.2')
+    assert not index.seen('id:wamid.2')
+
+
+def test_message_key_needs_an_id_or_a_timestamp():
+    assert message_key('wamid.3') == 'id:wamid.3'
+    assert message_key(None, '919800000401', 'hi', '1722330601').startswith('hash:')
+    assert message_key(None, '919800000401', 'hi') is None
+    assert not DedupIndex().seen(None)
@@ -0,0 +1,162 @@
+import asyncio
+import threading
+import time
+
+import httpx
+import pytest
+from openai import APIConnectionError, BadRequestError, RateLimitError
+
+import openai_scheduler
+from openai_scheduler import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, OpenAIScheduler, SchedulerBusy
+
+REQUEST = httpx.Request('POST', 'https://api.openai.com/v1/chat/completions')
+
+
+def rate_limited(retry_after='0'):
+    response = httpx.Response(429, headers={'retry-after': retry_after}, request=REQUEST)
+    return RateLimitError('Rate limit reached', response=response, body=None)
+
+
+class FakeClient:
+    """Stands in for OpenAI(): raises the queued errors, then answers"""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = []
+        self.chat = self
+        self.completions = self
+
+    def with_options(self, **options):
+        return self
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'response'
+
+
+class FakeAsyncClient(FakeClient):
+    """Stands in for AsyncOpenAI()"""
+
+    async def create(self, **kwargs):
+        return FakeClient.create(self, **kwargs)
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(openai_scheduler, 'transient_delay', lambda attempt: 0)
+
+
+def test_429_is_retried_after_retry_after():
+    client = FakeClient(rate_limited('0'), rate_limited('0'))
+    scheduler = OpenAIScheduler(client, max_retries=3)
+    assert scheduler.complete(messages=[], max_tokens=10) == 'response'
+    stats = scheduler.stats()
+    assert (stats['rateLimited'], stats['retries'], stats['completed']) == (2, 2, 1)
+
+
+def test_429_gives_up_after_max_retries():
+    scheduler = OpenAIScheduler(FakeClient(*[rate_limited('0')] * 3), max_retries=2)
+    with pytest.raises(RateLimitError):
+        scheduler.complete(messages=[])
+    assert scheduler.stats()['failed'] == 1
+
+
+def test_connection_errors_are_retried():
+    client = FakeClient(APIConnectionError(request=REQUEST))
+    scheduler = OpenAIScheduler(client, max_retries=2)
+    assert scheduler.complete(messages=[]) == 'response'
+    assert scheduler.stats()['errorRetries'] == 1
+    assert len(client.calls) == 2
+
+
+def test_client_errors_are_not_retried():
+    error = BadRequestError('bad', response=httpx.Response(400, request=REQUEST), body=None)
+    client = FakeClient(error)
+    scheduler = OpenAIScheduler(client, max_retries=3)
+    with pytest.raises(BadRequestError):
+        scheduler.complete(messages=[])
+    assert len(client.calls) == 1
+
+
+def test_token_budget_delays_admission_until_it_times_out():
+    scheduler = OpenAIScheduler(FakeClient(), rpm=600, tpm=100, queue_timeout=0.2)
+    scheduler.complete(messages=[], max_tokens=100)
+    start = time.monotonic()
+    with pytest.raises(SchedulerBusy):
+        scheduler.complete(messages=[], max_tokens=100)
+    assert time.monotonic() - start >= 0.2
+    assert scheduler.stats()['timedOut'] == 1
+
+
+def test_full_queue_is_rejected():
+    scheduler = OpenAIScheduler(FakeClient(), max_queue=0)
+    with pytest.raises(SchedulerBusy):
+        scheduler.complete(messages=[])
+    assert scheduler.stats()['rejected'] == 1
+
+
+def test_interactive_requests_are_admitted_before_background_ones():
+    # One request per second, the first takes the burst
+    scheduler = OpenAIScheduler(FakeClient(), rpm=60, queue_timeout=5)
+    scheduler.requests.tokens = 0
+    order = []
+
+    def complete(name, priority):
+        scheduler.complete(priority=priority, messages=[])
+        order.append(name)
+
+    background = threading.Thread(target=complete, args=('background', PRIORITY_BACKGROUND))
+    background.start()
+    time.sleep(0.05)
+    interactive = threading.Thread(target=complete, args=('interactive', PRIORITY_INTERACTIVE))
+    interactive.start()
+    background.join()
+    interactive.join()
+    assert order == ['interactive', 'background']
+
+
+def test_deadline_cuts_the_budget_wait_short():
+    scheduler = OpenAIScheduler(FakeClient(), rpm=600, tpm=100, queue_timeout=60)
+    scheduler.complete(messages=[], max_tokens=100)
+    start = time.monotonic()
+    with pytest.raises(SchedulerBusy):
+        scheduler.complete(messages=[], max_tokens=100, deadline=start + 0.2)
+    assert time.monotonic() - start < 1
+
+
+def test_deadline_caps_the_attempt_timeout_and_stops_retries(monkeypatch):
+    monkeypatch.setattr(openai_scheduler, 'transient_delay', lambda attempt: 5)
+    client = FakeClient(APIConnectionError(request=REQUEST))
+    scheduler = OpenAIScheduler(client, max_retries=3)
+    with pytest.raises(APIConnectionError):
+        scheduler.complete(messages=[], timeout=10, deadline=time.monotonic() + 2)
+    assert len(client.calls) == 1
+    assert client.calls[0]['timeout'] <= 2
+
+
+def test_acomplete_retries_429_without_blocking_the_loop():
+    scheduler = OpenAIScheduler(FakeAsyncClient(rate_limited('0')), max_retries=2)
+
+    async def run():
+        return await asyncio.gather(scheduler.acomplete(messages=[]), asyncio.sleep(0, 'loop ran'))
+
+    assert asyncio.run(run()) == ['response', 'loop ran']
+    assert scheduler.stats()['retries'] == 1
+
+
+def test_cancelled_acomplete_leaves_the_queue():
+    scheduler = OpenAIScheduler(FakeAsyncClient(), rpm=600, tpm=100)
+    asyncio.run(scheduler.acomplete(messages=[], max_tokens=100))
+
+    async def run():
+        queued = asyncio.create_task(scheduler.acomplete(messages=[], max_tokens=100))
+        await asyncio.sleep(0.1)
+        assert scheduler.stats()['queued'] == 1
+        queued.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+
+    asyncio.run(run())
+    assert scheduler.stats()['queued'] == 0
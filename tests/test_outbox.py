@@ -0,0 +1,149 @@
+import threading
+import time
+
+import pytest
+
+import conversation_store
+import outbox
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(outbox, 'OUTBOX_POLL_SECONDS', 0.02)
+    monkeypatch.setattr(outbox, 'backoff_delay', lambda attempts: 0)
+
+
+@pytest.fixture
+def make_outbox(store):
+    boxes = []
+
+    def make(deliver, **kwargs):
+        box = outbox.Outbox(deliver, **kwargs)
+        boxes.append(box)
+        return box
+
+    yield make
+    for box in boxes:
+        box.stop()
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_retries_then_delivers_once(make_outbox):
+    attempts = []
+    sent = []
+
+    def deliver(message):
+        attempts.append(message['id'])
+        return 'wamid.1' if len(attempts) == 3 else False
+
+    box = make_outbox(deliver, on_sent=sent.append, workers=1, max_attempts=5)
+    box.enqueue('919999999999', 'hello', 'ai', key='reply:1')
+
+    assert wait_for(lambda: sent)
+    assert len(attempts) == 3
+    assert sent[0]['provider_id'] == 'wamid.1'
+    stats = box.stats()
+    assert (stats['sent'], stats['retried'], stats['pending']) == (1, 2, 0)
+
+
+def test_dead_letters_and_requeues(make_outbox):
+    fail = threading.Event()
+    fail.set()
+    box = make_outbox(lambda message: not fail.is_set(), workers=1, max_attempts=2)
+    message_id, _ = box.enqueue('919999999999', 'hello', 'manual')
+
+    assert wait_for(lambda: box.stats()['dead'] == 1)
+    dead = box.dead_letters()
+    assert [row['id'] for row in dead] == [message_id]
+    assert dead[0]['attempts'] == 2
+
+    fail.clear()
+    assert box.requeue(message_id)
+    assert wait_for(lambda: box.stats()['sent'] == 1)
+    assert not box.requeue(message_id)
+
+
+def test_duplicate_key_is_sent_once(make_outbox):
+    sent = []
+    box = make_outbox(lambda message: True, on_sent=sent.append, workers=1)
+    first = box.enqueue('919999999999', 'hello', 'ai', key='reply:same')
+    second = box.enqueue('919999999999', 'hello again', 'ai', key='reply:same')
+
+    assert first == (first[0], True)
+    assert second == (first[0], False)
+    assert wait_for(lambda: sent)
+    time.sleep(0.1)
+    assert len(sent) == 1
+
+
+def test_slow_sends_are_not_claimed_twice(make_outbox, monkeypatch):
+    # Sends together take far longer than the claim timeout; queued rows must not expire and go out twice
+    monkeypatch.setattr(outbox, 'OUTBOX_CLAIM_TIMEOUT', 0.3)
+    delivered = []
+    lock = threading.Lock()
+
+    def deliver(message):
+        time.sleep(0.15)
+        with lock:
+            delivered.append(message['idempotency_key'])
+        return True
+
+    box = make_outbox(deliver, workers=1)
+    for i in range(6):
+        box.enqueue('919999999999', f"message {i}", 'ai', key=f"key-{i}")
+
+    assert wait_for(lambda: box.stats()['sent'] == 6)
+    time.sleep(0.2)
+    assert sorted(delivered) == [f"key-{i}" for i in range(6)]
+    assert box.stats()['lostClaims'] == 0
+
+
+def test_unready_messages_are_deferred_without_using_attempts(make_outbox):
+    checks = []
+    sent = []
+
+    def ready(message):
+        checks.append(message['id'])
+        return 0.2 if len(checks) == 1 else 0
+
+    box = make_outbox(lambda message: True, on_sent=sent.append, ready=ready, workers=1, max_attempts=1)
+    box.enqueue('919999999999', 'hello', 'ai')
+
+    assert wait_for(lambda: sent)
+    assert len(checks) == 2
+    stats = box.stats()
+    assert (stats['deferred'], stats['retried'], stats['dead']) == (1, 0, 0)
+
+
+def test_opted_out_recipients_cannot_be_queued(make_outbox, store):
+    box = make_outbox(lambda message: True, workers=1)
+    store.set_opted_out('919999999999')
+    with pytest.raises(outbox.RecipientOptedOut):
+        box.enqueue('919999999999', 'hello', 'manual')
+
+    store.set_opted_out('919999999999', False)
+    assert box.enqueue('919999999999', 'hello', 'manual')[1]
+
+
+def test_cancels_messages_queued_before_an_opt_out(make_outbox):
+    phone = '919999999999'
+    hold = threading.Event()
+    sent = []
+    box = make_outbox(lambda message: True, on_sent=sent.append, workers=1,
+                      ready=lambda message: 0 if hold.is_set() else 0.05)
+    box.enqueue(phone, 'your reply', 'ai')
+    box.enqueue(phone, 'You are unsubscribed', outbox.OPT_OUT_SOURCE)
+    conversation_store.set_opted_out(phone, True)
+    hold.set()
+
+    assert wait_for(lambda: box.stats()['cancelled'] == 1 and sent)
+    assert [message['body'] for message in sent] == ['You are unsubscribed']
+    assert box.stats()['optedOutCancelled'] == 1
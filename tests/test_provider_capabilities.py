@@ -0,0 +1,41 @@
+from provider_capabilities import CapabilityCache
+
+
+class Provider:
+    def __init__(self, working):
+        self.working = set(working)
+        self.sent = []
+
+    def attempt(self, route, to, message):
+        self.sent.append((route, message))
+        return route in self.working
+
+
+def test_first_send_probes_and_caches_the_route():
+    provider = Provider({'b'})
+    cache = CapabilityCache(['a', 'b', 'c'], provider.attempt)
+    assert cache.send('91', 'one')
+    assert cache.send('91', 'two')
+    assert provider.sent == [('a', 'one'), ('b', 'one'), ('b', 'two')]
+
+
+def test_failed_route_reprobes_with_the_same_send_and_reports_its_result():
+    provider = Provider({'a'})
+    cache = CapabilityCache(['a', 'b', 'c'], provider.attempt)
+    assert cache.send('91', 'one')
+
+    provider.working = {'c'}
+    assert cache.send('91', 'two')
+    # Delivered once through c, the failed route isn't tried again
+    assert provider.sent[1:] == [('a', 'two'), ('b', 'two'), ('c', 'two')]
+    assert cache.route == 'c'
+
+
+def test_send_fails_when_no_route_works():
+    provider = Provider({'a'})
+    cache = CapabilityCache(['a', 'b'], provider.attempt)
+    assert cache.send('91', 'one')
+    provider.working = set()
+    assert not cache.send('91', 'two')
+    assert [message for _, message in provider.sent].count('two') == 2
+    assert cache.route is None
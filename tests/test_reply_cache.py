@@ -0,0 +1,49 @@
+import reply_cache
+from reply_cache import ReplyCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+def test_same_question_with_other_case_and_punctuation_hits():
+    cache = ReplyCache()
+    cache.put(cache.key('What are your prices?', 'prompt', 'gpt-4o-mini'), 'From 499.')
+    assert cache.get(cache.key('  what are your PRICES ', 'prompt', 'gpt-4o-mini')) == 'From 499.'
+    assert cache.get(cache.key('what are your prices', 'other prompt', 'gpt-4o-mini')) is None
+    assert cache.get(cache.key('what are your prices', 'prompt', 'gpt-4o')) is None
+
+
+def test_entries_expire_after_the_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(reply_cache, 'time', clock)
+    cache = ReplyCache(ttl=60)
+    key = cache.key('hi', 'prompt', 'model')
+    cache.put(key, 'Hello!')
+    clock.now += 59
+    assert cache.get(key) == 'Hello!'
+    clock.now += 1
+    assert cache.get(key) is None
+    assert cache.stats()['expired'] == 1
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ReplyCache(max_entries=2)
+    a, b, c = (cache.key(text, 'prompt', 'model') for text in ('a', 'b', 'c'))
+    cache.put(a, 'A')
+    cache.put(b, 'B')
+    cache.get(a)
+    cache.put(c, 'C')
+    assert (cache.get(a), cache.get(b), cache.get(c)) == ('A', None, 'C')
+    assert cache.stats()['evicted'] == 1
+
+
+def test_messages_without_words_are_not_cached():
+    cache = ReplyCache()
+    assert cache.key('?!', 'prompt', 'model') is None
+    cache.put(None, 'reply')
+    assert cache.stats()['size'] == 0
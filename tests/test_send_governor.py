@@ -0,0 +1,46 @@
+import threading
+import time
+
+import pytest
+
+from send_governor import PRIORITY_BROADCAST, PRIORITY_REPLY, SendGovernor, SendThrottled
+
+
+def test_recipient_budget_defers_without_blocking_others():
+    governor = SendGovernor(rate=100, burst=100, recipient_rate=60, recipient_burst=1)
+
+    assert governor.try_acquire('911111111111') == 0
+    wait = governor.try_acquire('911111111111')
+    assert 0.5 < wait <= 1.0
+    assert governor.try_acquire('912222222222') == 0
+    assert governor.stats()['deferred'] == 1
+
+
+def test_acquire_times_out_with_send_throttled():
+    governor = SendGovernor(rate=100, burst=100, recipient_rate=1, recipient_burst=1)
+    governor.acquire('911111111111')
+    with pytest.raises(SendThrottled):
+        governor.acquire('911111111111', max_wait=0.05)
+    assert governor.stats()['throttled'] == 1
+
+
+def test_replies_go_ahead_of_waiting_broadcasts():
+    governor = SendGovernor(rate=20, burst=1, recipient_rate=600, recipient_burst=10)
+    governor.acquire('910000000000')
+    order = []
+
+    def send(phone, priority):
+        governor.acquire(phone, priority, max_wait=5)
+        order.append(phone)
+
+    broadcasts = [threading.Thread(target=send, args=(f"91000000000{i}", PRIORITY_BROADCAST)) for i in range(1, 4)]
+    for thread in broadcasts:
+        thread.start()
+    time.sleep(0.01)
+    reply = threading.Thread(target=send, args=('919999999999', PRIORITY_REPLY))
+    reply.start()
+    for thread in broadcasts + [reply]:
+        thread.join()
+
+    assert order.index('919999999999') <= 1
+    assert len(order) == 4
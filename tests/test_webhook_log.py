@@ -0,0 +1,28 @@
+import pytest
+
+from webhook_log import WebhookLog
+
+
+def fill(log, count):
+    for i in range(count):
+        log.append({'n': i})
+
+
+def test_restart_does_not_overwrite_archived_segments(tmp_path):
+    fill(WebhookLog(capacity=4, segment_size=2, archive_dir=str(tmp_path)), 6)
+    first_run = WebhookLog(capacity=4, segment_size=2, archive_dir=str(tmp_path)).archived_segments()
+    assert first_run == ['webhooks-0000000001-0000000002.jsonl.gz']
+
+    log = WebhookLog(capacity=4, segment_size=2, archive_dir=str(tmp_path))
+    fill(log, 6)
+    assert log.archived_segments() == first_run + ['webhooks-0000000003-0000000004.jsonl.gz']
+    assert log.read_segment(first_run[0])[0]['data'] == {'n': 0}
+
+
+def test_zero_capacity_turns_capture_off(tmp_path):
+    log = WebhookLog(capacity=0, archive_dir=str(tmp_path))
+    fill(log, 3)
+    assert (len(log), log.recent(), log.archived_segments()) == (0, [], [])
+
+    with pytest.raises(ValueError):
+        WebhookLog(capacity=-1, archive_dir=str(tmp_path))
@@ -0,0 +1,42 @@
+from webhook_parser import FLAT, META, RCS, TATA, parse_events, parse_statuses, parse_webhook
+
+
+def test_tata_message_takes_the_contact_name():
+    event = parse_webhook({
+        'contacts': [{'wa_id': '919800000501', 'profile': {'name': 'Rahul'}}],
+        'messages': {'from': '919800000501', 'id': 'wamid.1', 'timestamp': '1722330601', 'text': {'body': 'hi'}},
+    })
+    assert (event.format, event.phone, event.name, event.text, event.message_id) == (
+        TATA, '919800000501', 'Rahul', 'hi', 'wamid.1')
+
+
+def test_meta_batch_yields_every_message():
+    value = {
+        'contacts': [{'wa_id': '919800000502', 'profile': {'name': 'Priya'}}],
+        'messages': [
+            {'from': '919800000502', 'id': 'wamid.2', 'type': 'text', 'text': {'body': 'hello'}},
+            {'from': '919800000502', 'id': 'wamid.3', 'type': 'button', 'button': {'text': 'Yes'}},
+        ],
+    }
+    events = parse_events({'object': 'whatsapp_business_account', 'entry': [{'changes': [{'value': value}]}]})
+    assert [(e.format, e.name, e.text) for e in events] == [(META, 'Priya', 'hello'), (META, 'Priya', 'Yes')]
+
+
+def test_rcs_and_flat_shapes():
+    rcs = parse_webhook({'entityType': 'USER_MESSAGE', 'userPhoneNumber': '919800000503',
+                         'entity': {'text': 'status?'}, 'messageId': 'rcs.1'})
+    assert (rcs.format, rcs.phone, rcs.text, rcs.message_id) == (RCS, '919800000503', 'status?', 'rcs.1')
+    flat = parse_webhook({'sender': '+919800000504', 'message': {'text': 'When will it arrive?'}})
+    assert (flat.format, flat.phone, flat.text) == (FLAT, '+919800000504', 'When will it arrive?')
+    assert parse_events({'text': 'no sender'}) == []
+    assert parse_events(['not', 'a', 'dict']) == []
+
+
+def test_statuses_from_both_shapes():
+    tata = parse_statuses({'statuses': {'id': 'wamid.4', 'status': 'DELIVERED', 'recipient_id': '919800000505'}})
+    assert [(s.message_id, s.status, s.recipient) for s in tata] == [('wamid.4', 'delivered', '919800000505')]
+    meta = parse_statuses({'entry': [{'changes': [{'value': {'statuses': [
+        {'id': 'wamid.5', 'status': 'failed', 'errors': [{'code': 131047, 'title': 'Re-engagement message'}]},
+        {'status': 'read'},
+    ]}}]}]})
+    assert [(s.message_id, s.status, s.error) for s in meta] == [('wamid.5', 'failed', 'Re-engagement message')]
@@ -0,0 +1,36 @@
+import time
+
+
+class TokenBucket:
+    """Refills `rate_per_minute` tokens per minute up to `capacity` (one minute's worth by default)
+
+    Not thread-safe, callers hold their own lock.
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.capacity = float(capacity if capacity is not None else rate_per_minute)
+        self.rate = rate_per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        # `now` may have been read just before the bucket was created
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until `amount` tokens are available"""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount):
+        # May go negative when actual usage exceeds the estimate, later calls then wait longer
+        self.tokens -= amount
+
+    def available(self, now):
+        self._refill(now)
+        return self.tokens
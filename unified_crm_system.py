@@ -1,5 +1,4 @@
 from flask import Flask, request, jsonify, render_template_string
-import requests
 import os
 import json
 from datetime import datetime
@@ -8,6 +7,13 @@ from openai import OpenAI
 
 load_dotenv()
 
+import tata_client
+from faq_matcher import faq_answer
+from intent_router import OPT_IN, OPT_OUT, get_router, route_intent
+from model_tiers import ModelRouter
+from message_dedup import DedupIndex, message_key
+from webhook_parser import RCS, parse_webhook
+
 app = Flask(__name__)
 
 # Configuration
@@ -16,10 +22,14 @@ VERIFY_TOKEN = os.getenv('VERIFY_TOKEN')
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 
 client = OpenAI(api_key=OPENAI_API_KEY)
+model_router = ModelRouter()
 
 # Unified message storage
 conversations = {}
 
+webhook_dedup = DedupIndex()
+opted_out = set()
+
 
 
 @app.route('/')
@@ -31,6 +41,18 @@ def get_conversations():
     print(f"API call: returning {len(conversations)} conversations")
     return jsonify({'conversations': conversations})
 
+@app.route('/api/dedup-stats')
+def get_dedup_stats():
+    return jsonify(webhook_dedup.stats())
+
+@app.route('/api/intent-stats')
+def get_intent_stats():
+    return jsonify(get_router().stats())
+
+@app.route('/api/model-stats')
+def get_model_stats():
+    return jsonify(model_router.stats())
+
 @app.route('/api/add-real-message', methods=['POST'])
 def add_real_message():
     """Add a real message manually"""
@@ -60,8 +82,8 @@ def send_message_via_tata(phone, text):
     }
     
     try:
-        response = requests.post(
-            "https://wb.omni.tatatelebusiness.com/whatsapp-cloud/messages",
+        response = tata_client.post(
+            tata_client.MESSAGES_URL,
             json=payload,
             headers=headers
         )
@@ -70,6 +92,32 @@ def send_message_via_tata(phone, text):
         print(f"Send error: {e}")
         return False
 
+def send_template_via_tata(phone, template_name, language='en_US'):
+    """Send an approved template via Tata WhatsApp API"""
+    headers = {
+        "Authorization": f"Bearer {WHATSAPP_TOKEN}",
+        "Content-Type": "application/json"
+    }
+    payload = {
+        "to": phone,
+        "type": "template",
+        "template": {
+            "name": template_name,
+            "language": {"code": language}
+        }
+    }
+    
+    try:
+        response = tata_client.post(
+            tata_client.MESSAGES_URL,
+            json=payload,
+            headers=headers
+        )
+        return response.status_code == 200
+    except Exception as e:
+        print(f"Template send error: {e}")
+        return False
+
 @app.route('/api/send-message', methods=['POST'])
 def send_message():
     data = request.json
@@ -78,6 +126,8 @@ def send_message():
     
     if not phone or not message:
         return jsonify({'success': False, 'error': 'Phone and message required'})
+    if phone in opted_out:
+        return jsonify({'success': False, 'error': f"{phone} has opted out"}), 409
     
     success = send_message_via_tata(phone, message)
     if success:
@@ -106,43 +156,54 @@ def webhook():
     
     try:
         # Extract user data from Tata webhook
-        user_number = None
-        user_message = None
+        event = parse_webhook(data)
+        if not event or not event.phone or not event.text:
+            return jsonify({"error": "Malformed incoming data"}), 400
         
-        # Standard Tata format
-        if data.get('contacts') and data.get('messages'):
-            user_number = data['contacts'][0]['wa_id']
-            user_message = data['messages']['text']['body']
-        # Alternative format
-        elif data.get('from') and data.get('text'):
-            user_number = data['from']
-            user_message = data['text'].get('body') if isinstance(data['text'], dict) else data['text']
+        user_number = event.phone
+        user_message = event.text
         
-        if not user_number or not user_message:
-            return jsonify({"error": "Malformed incoming data"}), 400
+        if webhook_dedup.seen(message_key(event.message_id, user_number, user_message, event.timestamp)):
+            print(f"Duplicate webhook for {user_number} ignored")
+            return jsonify({"status": "duplicate"}), 200
         
         # Save incoming message
         add_message(user_number, user_message, 'received', 'whatsapp', 'customer')
         print(f"Real message saved: {user_number} - {user_message}")
         
-        # Generate AI reply
+        # Generate AI reply, simple intents and known questions are answered locally
         try:
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": "You are a helpful WhatsApp assistant. Keep responses brief and friendly."},
-                    {"role": "user", "content": user_message}
-                ],
-                max_tokens=150
-            )
-            
-            ai_reply = response.choices[0].message.content
-            
-            # Send AI reply via Tata API
-            send_success = send_message_via_tata(user_number, ai_reply)
-            if send_success:
-                add_message(user_number, ai_reply, 'sent', 'whatsapp', 'ai')
-                print(f"AI reply sent: {ai_reply}")
+            intent = route_intent(user_message)
+            if intent is not None and intent.name == OPT_IN:
+                opted_out.discard(user_number)
+            elif user_number in opted_out:
+                print(f"{user_number} has opted out, no reply")
+                return jsonify({"status": "received"}), 200
+            if intent is not None and intent.template:
+                # Intents configured with a template are answered with it, not with text
+                if send_template_via_tata(user_number, intent.template):
+                    add_message(user_number, f"Template {intent.template} sent", 'sent', 'whatsapp', 'ai')
+            else:
+                ai_reply = intent.reply if intent else faq_answer(user_message)
+                if not ai_reply:
+                    response = model_router.complete(
+                        client.chat.completions.create,
+                        model_router.choose(user_message),
+                        [
+                            {"role": "system", "content": "You are a helpful WhatsApp assistant. Keep responses brief and friendly."},
+                            {"role": "user", "content": user_message}
+                        ]
+                    )
+                    ai_reply = response.choices[0].message.content
+                
+                # Send AI reply via Tata API
+                send_success = send_message_via_tata(user_number, ai_reply)
+                if send_success:
+                    add_message(user_number, ai_reply, 'sent', 'whatsapp', 'ai')
+                    print(f"AI reply sent: {ai_reply}")
+            # Recorded after the confirmation went out, it's the last message the contact gets
+            if intent is not None and intent.name == OPT_OUT:
+                opted_out.add(user_number)
                 
         except Exception as ai_error:
             print(f"AI error: {ai_error}")
@@ -160,13 +221,9 @@ def handle_rcs_webhook():
     print(f"RCS webhook: {json.dumps(data, indent=2)}")
     
     # Extract RCS message
-    if data.get('entityType') == 'USER_MESSAGE':
-        phone = data.get('userPhoneNumber')
-        entity = data.get('entity', {})
-        message = entity.get('text')
-        
-        if phone and message:
-            add_message(phone, message, 'received', 'rcs', 'customer')
+    event = parse_webhook(data)
+    if event and event.format == RCS and event.phone and event.text:
+        add_message(event.phone, event.text, 'received', 'rcs', 'customer')
     
     return jsonify({'status': 'success'})
 
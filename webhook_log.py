@@ -0,0 +1,102 @@
+import gzip
+import json
+import os
+import re
+import threading
+from datetime import datetime
+
+_SEGMENT_NAME = re.compile(r'webhooks-(\d+)-(\d+)\.jsonl\.gz$')
+
+
+class WebhookLog:
+    """Fixed-size ring buffer of captured webhook payloads
+
+    Each payload is kept once as compact JSON bytes. When the buffer is full
+    the oldest segment is written to a gzip file in archive_dir, so memory
+    stays flat while older history can still be read back. Segment numbers
+    carry on from the archive a previous run left behind. A capacity of 0
+    turns capture off.
+    """
+
+    def __init__(self, capacity=500, segment_size=100, archive_dir='webhook_archive'):
+        if capacity < 0:
+            raise ValueError(f"WebhookLog capacity must be 0 or more, got {capacity}")
+        self.capacity = capacity
+        self.segment_size = max(1, min(segment_size, capacity))
+        self.archive_dir = archive_dir
+        self._slots = [None] * capacity
+        self._start = 0  # index of the oldest entry
+        self._count = 0
+        self._lock = threading.Lock()
+        self.total = 0  # entries captured by this process, including archived ones
+        self._archived = self._last_archived()  # sequence number of the newest archived entry
+
+    def append(self, data):
+        if not self.capacity:
+            return
+        entry = json.dumps(
+            {'timestamp': datetime.now().isoformat(), 'data': data},
+            separators=(',', ':'), ensure_ascii=False, default=str
+        ).encode('utf-8')
+        with self._lock:
+            if self._count == self.capacity:
+                self._spill()
+            self._slots[(self._start + self._count) % self.capacity] = entry
+            self._count += 1
+            self.total += 1
+
+    def _spill(self):
+        """Move the oldest segment to a compressed file on disk"""
+        segment = []
+        for _ in range(self.segment_size):
+            segment.append(self._slots[self._start])
+            self._slots[self._start] = None
+            self._start = (self._start + 1) % self.capacity
+            self._count -= 1
+
+        first = self._archived + 1
+        self._archived += len(segment)
+        name = f"webhooks-{first:010d}-{self._archived:010d}.jsonl.gz"
+        try:
+            os.makedirs(self.archive_dir, exist_ok=True)
+            with gzip.open(os.path.join(self.archive_dir, name), 'wb') as f:
+                f.write(b'\n'.join(segment) + b'\n')
+        except OSError as e:
+            print(f"Could not archive webhook segment {name}: {e}")
+
+    def recent(self, limit=50):
+        """Newest `limit` entries, oldest first"""
+        with self._lock:
+            count = min(limit, self._count)
+            first = self._start + self._count - count
+            raw = [self._slots[(first + i) % self.capacity] for i in range(count)]
+        return [_decode(entry) for entry in raw]
+
+    def __len__(self):
+        return self._count
+
+    def _last_archived(self):
+        last = 0
+        for name in self.archived_segments():
+            match = _SEGMENT_NAME.match(name)
+            if match:
+                last = max(last, int(match.group(2)))
+        return last
+
+    def archived_segments(self):
+        if not os.path.isdir(self.archive_dir):
+            return []
+        return sorted(name for name in os.listdir(self.archive_dir) if name.endswith('.jsonl.gz'))
+
+    def read_segment(self, name):
+        """Entries of one archived segment, or None if it doesn't exist"""
+        if name not in self.archived_segments():
+            return None
+        with gzip.open(os.path.join(self.archive_dir, name), 'rb') as f:
+            return [_decode(line) for line in f if line.strip()]
+
+
+def _decode(entry):
+    item = json.loads(entry)
+    item['raw_data'] = json.dumps(item['data'], separators=(',', ':'), ensure_ascii=False)
+    return item
@@ -0,0 +1,203 @@
+"""One parser for the inbound webhook formats we receive
+
+Supported shapes:
+- Tata:  {"contacts": [{"wa_id", "profile": {"name"}}], "messages": {"from", "id", "text": {"body"}}}
+- Meta:  {"object": "whatsapp_business_account", "entry": [{"changes": [{"value": {"contacts", "messages": [...]}}]}]}
+- RCS:   {"entityType": "USER_MESSAGE", "userPhoneNumber", "entity": {"text"}}
+- Flat:  {"from" | "phone" | "sender", "text": {"body"} | "text" | "message" | "content" | "body"}
+
+The format is detected once per payload and every message in it becomes an
+InboundEvent with only the fields the handlers read. This is not faster
+than pulling a few fields out of the first message, see
+bench_webhook_parser.py; it exists so every handler reads every format.
+
+Delivery receipts come as "statuses" next to or instead of "messages", at
+the top level (Tata) or inside each change value (Meta), and are parsed
+separately by parse_statuses().
+"""
+
+TATA = 'tata'
+META = 'meta'
+RCS = 'rcs'
+FLAT = 'flat'
+
+_NO_NAMES = {}
+
+
+class InboundEvent:
+    """One normalized inbound message"""
+
+    __slots__ = ('format', 'phone', 'name', 'text', 'message_id', 'timestamp')
+
+    def __init__(self, format, phone, name=None, text=None, message_id=None, timestamp=None):
+        self.format = format
+        self.phone = phone
+        self.name = name
+        self.text = text
+        self.message_id = message_id
+        self.timestamp = timestamp
+
+    def __repr__(self):
+        return f"InboundEvent({self.format}, {self.phone!r}, {self.text!r})"
+
+
+class StatusEvent:
+    """One delivery receipt for a message we sent"""
+
+    __slots__ = ('message_id', 'status', 'recipient', 'timestamp', 'error')
+
+    def __init__(self, message_id, status, recipient=None, timestamp=None, error=None):
+        self.message_id = message_id
+        self.status = status
+        self.recipient = recipient
+        self.timestamp = timestamp
+        self.error = error
+
+    def to_dict(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    def __repr__(self):
+        return f"StatusEvent({self.message_id!r}, {self.status!r})"
+
+
+def parse_events(data):
+    """All inbound messages in a webhook payload, detecting its format once"""
+    if not isinstance(data, dict):
+        return []
+    if 'entry' in data:
+        return _parse_meta(data)
+    if 'entityType' in data:
+        return _parse_rcs(data)
+    if 'messages' in data:
+        return _parse_tata(data)
+    return _parse_flat(data)
+
+
+def parse_webhook(data):
+    """First inbound message in a payload, or None"""
+    events = parse_events(data)
+    return events[0] if events else None
+
+
+def parse_statuses(data):
+    """All delivery receipts (sent, delivered, read, failed) in a webhook payload"""
+    if not isinstance(data, dict):
+        return []
+    if 'entry' in data:
+        statuses = []
+        for entry in data.get('entry') or ():
+            for change in entry.get('changes') or ():
+                statuses.extend((change.get('value') or {}).get('statuses') or ())
+    else:
+        statuses = data.get('statuses') or ()
+        if isinstance(statuses, dict):
+            statuses = [statuses]
+    return [event for event in map(_status_event, statuses) if event is not None]
+
+
+def _status_event(status):
+    message_id = status.get('id') or status.get('message_id')
+    state = status.get('status')
+    if not message_id or not state:
+        return None
+    errors = status.get('errors') or ()
+    error = None
+    if errors:
+        first = errors[0]
+        error = first.get('title') or first.get('message') or str(first.get('code'))
+    return StatusEvent(message_id, str(state).lower(), status.get('recipient_id'), status.get('timestamp'), error)
+
+
+def _message_text(message):
+    """Text body of a Tata/Meta message object without a text field"""
+    msg_type = message.get('type')
+    if msg_type == 'button':
+        return message.get('button', {}).get('text')
+    if msg_type == 'interactive':
+        interactive = message.get('interactive', {})
+        reply = interactive.get('button_reply') or interactive.get('list_reply') or {}
+        return reply.get('title')
+    return None
+
+
+def _contact_names(contacts):
+    if not contacts:
+        return _NO_NAMES
+    names = {}
+    for contact in contacts:
+        phone = contact.get('wa_id') or contact.get('phone')
+        if phone:
+            profile = contact.get('profile')
+            names[phone] = profile.get('name') if profile else None
+    return names
+
+
+def _message_event(format, message, names, fallback_phone=None):
+    # Called once per message of every webhook, so the plain text case is handled inline
+    get = message.get
+    phone = get('from') or fallback_phone
+    text = get('text')
+    if text is None:
+        text = _message_text(message)
+    elif type(text) is dict:
+        text = text.get('body')
+    return InboundEvent(format, phone, names.get(phone), text, get('id'), get('timestamp'))
+
+
+def _parse_tata(data):
+    names = _contact_names(data.get('contacts'))
+    fallback_phone = next(iter(names), None) if names else None
+    messages = data['messages']
+    if isinstance(messages, dict):
+        return [_message_event(TATA, messages, names, fallback_phone)]
+    return [_message_event(TATA, message, names, fallback_phone) for message in messages or ()]
+
+
+def _parse_meta(data):
+    events = []
+    for entry in data.get('entry') or ():
+        for change in entry.get('changes') or ():
+            value = change.get('value') or {}
+            messages = value.get('messages')
+            if not messages:
+                continue
+            names = _contact_names(value.get('contacts'))
+            for message in messages:
+                events.append(_message_event(META, message, names))
+    return events
+
+
+def _parse_rcs(data):
+    if data.get('entityType') != 'USER_MESSAGE':
+        return []
+    entity = data.get('entity') or {}
+    return [InboundEvent(
+        RCS,
+        data.get('userPhoneNumber'),
+        None,
+        entity.get('text'),
+        data.get('messageId') or entity.get('messageId'),
+        data.get('sendTime') or data.get('timestamp'),
+    )]
+
+
+def _parse_flat(data):
+    phone = data.get('from') or data.get('phone') or data.get('sender')
+    if not phone:
+        return []
+    text = data.get('text')
+    if isinstance(text, dict):
+        text = text.get('body')
+    if not text:
+        message = data.get('message')
+        text = message.get('text') if isinstance(message, dict) else message
+    if not text:
+        text = data.get('content') or data.get('body')
+    return [InboundEvent(
+        FLAT,
+        phone,
+        data.get('name'),
+        text,
+        data.get('id') or data.get('message_id'),
+        data.get('timestamp'),
+    )]
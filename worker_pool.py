@@ -0,0 +1,116 @@
+import queue
+import threading
+import time
+from collections import deque
+
+
+class WorkerPool:
+    """Bounded pool of background threads for slow webhook work (AI call + send)"""
+
+    def __init__(self, workers=4, max_queue=1000, name='worker'):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.name = name
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=500)  # seconds from enqueue to finish
+        self._run_times = deque(maxlen=500)  # seconds spent running the job
+        self._threads = []
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.in_flight = 0
+
+    def start(self):
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"{self.name}-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue a job, returns False when the queue is full"""
+        self.start()
+        try:
+            self._queue.put_nowait((time.monotonic(), fn, args, kwargs))
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            print(f"{self.name} queue full ({self.max_queue}), job rejected")
+            return False
+        with self._lock:
+            self.submitted += 1
+        return True
+
+    def has_capacity(self):
+        return self._queue.qsize() < self.max_queue
+
+    def free_slots(self):
+        return self.max_queue - self._queue.qsize()
+
+    def idle_workers(self):
+        """Workers with nothing running or queued, so a job submitted now starts at once"""
+        with self._lock:
+            return max(0, self.workers - self.in_flight - self._queue.qsize())
+
+    def _run(self):
+        while True:
+            queued_at, fn, args, kwargs = self._queue.get()
+            started = time.monotonic()
+            with self._lock:
+                self.in_flight += 1
+            ok = True
+            try:
+                fn(*args, **kwargs)
+            except Exception as e:
+                ok = False
+                print(f"{self.name} job error: {e}")
+            finished = time.monotonic()
+            with self._lock:
+                self.in_flight -= 1
+                if ok:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+                self._latencies.append(finished - queued_at)
+                self._run_times.append(finished - started)
+            self._queue.task_done()
+
+    def join(self):
+        """Block until every queued job has finished"""
+        self._queue.join()
+
+    def latency_samples(self):
+        """Recent (queue-to-finish, run) durations in seconds"""
+        with self._lock:
+            return list(self._latencies), list(self._run_times)
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            run_times = list(self._run_times)
+            return {
+                'workers': self.workers,
+                'queueDepth': self._queue.qsize(),
+                'maxQueue': self.max_queue,
+                'inFlight': self.in_flight,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'latencyMs': {
+                    'p50': percentile_ms(latencies, 50),
+                    'p95': percentile_ms(latencies, 95),
+                    'max': percentile_ms(latencies, 100),
+                },
+                'avgRunMs': round(sum(run_times) / len(run_times) * 1000, 1) if run_times else 0,
+            }
+
+
+def percentile_ms(sorted_values, pct):
+    if not sorted_values:
+        return 0
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))
+    return round(sorted_values[index] * 1000, 1)